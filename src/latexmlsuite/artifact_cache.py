@@ -0,0 +1,287 @@
+"""
+Share build outputs between checkouts of a report in a content-addressed cache directory
+
+On a build server several checkouts and branches of the same report build identical figures,
+tables, bibliography xml and chapter xml. With an artifact cache directory (``--artifact_cache``,
+``artifact_cache`` in the general settings or the ``LATEXMLSUITE_ARTIFACT_CACHE`` environment
+variable) the outputs of a stage are stored under a key computed from the content of its inputs,
+its settings and the version of the tool, and the next checkout with the same inputs copies them
+instead of building them again.
+
+Every entry is written to a temporary directory first and then renamed into place, so readers
+never see a half written entry and two writers of the same entry do not interfere. Reading and
+storing take a shared lock on the cache, evicting takes an exclusive lock. When the cache grows
+beyond its maximum size, the entries which were used longest ago are removed at the end of a run.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # niet beschikbaar op windows; de renames zijn daar nog steeds atomair
+    fcntl = None
+
+ARTIFACT_CACHE_VARIABLE = "LATEXMLSUITE_ARTIFACT_CACHE"
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+ENTRY_FILE_NAME = "entry.json"
+VERSIONS_FILE_NAME = "versions.json"
+STALE_TMP_AGE = 3600
+SIZE_UNITS = dict(K=1024, M=1024 ** 2, G=1024 ** 3, T=1024 ** 4)
+
+_logger = logging.getLogger(__name__)
+
+
+def parse_size(size):
+    """
+    Lees een grootte zoals 500M of 10G
+
+    Args:
+        size: int or str
+            Aantal bytes, of een getal met K, M, G of T erachter
+
+    Returns: int
+        Het aantal bytes
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(size), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Can not read size {size}; use for instance 500M or 10G")
+    return int(float(match.group(1)) * SIZE_UNITS.get(match.group(2).upper(), 1))
+
+
+class ArtifactCache:
+    """
+    Een content-addressed cache die door meerdere checkouts gedeeld kan worden
+
+    Args:
+        directory: str or Path
+            De directory van de cache
+        max_size: int or str
+            Maximale grootte van de cache, zie :func:`parse_size`
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = Path(directory).expanduser().absolute()
+        self.max_size = parse_size(max_size)
+        self.objects_directory = self.directory / "objects"
+        self.tmp_directory = self.directory / "tmp"
+        self._lock_file = self.directory / "lock"
+        self._versions = dict()
+        self._versions_lock = threading.Lock()
+
+    @contextmanager
+    def locked(self, exclusive=False):
+        """Lock de cache tussen processen; gedeeld voor lezen en schrijven, exclusief voor evict"""
+        if fcntl is None:
+            yield
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self._lock_file, "a") as stream:
+            fcntl.flock(stream.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(stream.fileno(), fcntl.LOCK_UN)
+
+    def key(self, stage, fingerprint, tool_version=None):
+        """De key van een entry: een hash over de stage, de fingerprint en de tool versie"""
+        content = json.dumps([stage, fingerprint, tool_version])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def entry_directory(self, key):
+        return self.objects_directory / key[:2] / key
+
+    def tool_version(self, executable):
+        """
+        De versie van een tool, zoals 'latexml (LaTeXML version 0.8.6)'
+
+        De versie wordt per executable (pad, grootte en modificatie tijd) in de cache bewaard,
+        zodat we latexml niet bij iedere run hoeven te starten om de versie te vragen.
+
+        Args:
+            executable: str
+                Naam van de tool
+
+        Returns: str
+        """
+        path = shutil.which(executable)
+        if path is None:
+            return f"{executable} (not found)"
+        stat = os.stat(path)
+        identity = f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+        with self._versions_lock:
+            if identity in self._versions:
+                return self._versions[identity]
+            versions_file = self.directory / VERSIONS_FILE_NAME
+            try:
+                with open(versions_file, "r", encoding="utf-8") as stream:
+                    stored = json.load(stream)
+            except (OSError, ValueError):
+                stored = dict()
+            if identity not in stored:
+                stored[identity] = self._ask_version(path)
+                self.directory.mkdir(parents=True, exist_ok=True)
+                tmp_file = versions_file.with_name(
+                    f"{VERSIONS_FILE_NAME}.{os.getpid()}.{threading.get_ident()}.tmp")
+                with open(tmp_file, "w", encoding="utf-8") as stream:
+                    json.dump(stored, stream, indent=1)
+                os.replace(tmp_file, versions_file)
+            self._versions[identity] = stored[identity]
+            return stored[identity]
+
+    @staticmethod
+    def _ask_version(path):
+        for option in ("--VERSION", "--version"):
+            try:
+                result = subprocess.run([path, option], stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, timeout=60)
+            except (OSError, subprocess.SubprocessError):
+                continue
+            lines = result.stdout.decode("utf-8", errors="replace").strip().splitlines()
+            if result.returncode == 0 and lines:
+                return lines[0]
+        # zonder versie gebruiken we de hash van de executable zelf
+        with open(path, "rb") as stream:
+            return hashlib.sha256(stream.read()).hexdigest()
+
+    def fetch(self, key, destination):
+        """
+        Haal de files van een entry uit de cache
+
+        Args:
+            key: str
+                De key van de entry
+            destination: dict or Path
+                Per naam in de entry de file waar hij naartoe gekopieerd wordt, of een directory
+                waarin alle files van de entry gezet worden
+
+        Returns: bool
+            True als de entry er was en alle files gekopieerd zijn
+        """
+        entry_directory = self.entry_directory(key)
+        with self.locked():
+            try:
+                with open(entry_directory / ENTRY_FILE_NAME, "r", encoding="utf-8") as stream:
+                    entry = json.load(stream)
+            except (OSError, ValueError):
+                return False
+            if isinstance(destination, dict):
+                targets = destination
+                if set(targets) - set(entry["files"]):
+                    return False
+            else:
+                targets = {name: Path(destination) / name for name in entry["files"]}
+            for name, target in targets.items():
+                target = Path(target)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                tmp_file = target.with_name(
+                    f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                # copyfile en geen copy2: de file moet nieuwer zijn dan zijn inputs voor make
+                shutil.copyfile(entry_directory / "files" / name, tmp_file)
+                os.replace(tmp_file, target)
+            # de modificatie tijd van de entry file is het moment van laatste gebruik
+            os.utime(entry_directory / ENTRY_FILE_NAME)
+        _logger.debug(f"Fetched {len(targets)} files from artifact cache entry {key}")
+        return True
+
+    def store(self, key, sources):
+        """
+        Zet files in de cache
+
+        Args:
+            key: str
+                De key van de entry
+            sources: dict
+                Per naam (mag een relatief pad zijn) de file die bewaard wordt
+
+        Returns: bool
+            True als de entry nu in de cache staat
+        """
+        entry_directory = self.entry_directory(key)
+        if (entry_directory / ENTRY_FILE_NAME).exists():
+            return True
+        self.tmp_directory.mkdir(parents=True, exist_ok=True)
+        tmp_directory = self.tmp_directory / f"{key}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            # ook een entry zonder files heeft zijn directory nodig
+            (tmp_directory / "files").mkdir(parents=True, exist_ok=True)
+            size = 0
+            for name, source in sources.items():
+                target = tmp_directory / "files" / name
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(source, target)
+                size += target.stat().st_size
+            entry = dict(files=sorted(sources), size=size, created=time.time())
+            with open(tmp_directory / ENTRY_FILE_NAME, "w", encoding="utf-8") as stream:
+                json.dump(entry, stream, indent=1)
+            with self.locked():
+                entry_directory.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    os.rename(tmp_directory, entry_directory)
+                except OSError:
+                    # een ander proces heeft dezelfde entry net geschreven
+                    _logger.debug(f"Artifact cache entry {key} already stored")
+        except OSError as err:
+            _logger.warning(f"Could not store artifact cache entry {key}: {err}")
+            return False
+        finally:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+        return True
+
+    def entries(self):
+        """
+        Alle entries in de cache
+
+        Returns: list
+            Tuples (laatste gebruik, grootte, directory)
+        """
+        entries = list()
+        for entry_file in self.objects_directory.glob(f"*/*/{ENTRY_FILE_NAME}"):
+            try:
+                with open(entry_file, "r", encoding="utf-8") as stream:
+                    size = json.load(stream)["size"]
+                entries.append((entry_file.stat().st_mtime, size, entry_file.parent))
+            except (OSError, ValueError, KeyError):
+                continue
+        return entries
+
+    def evict(self):
+        """
+        Verwijder de langst niet gebruikte entries tot de cache kleiner is dan de maximale grootte
+
+        Returns: list
+            De verwijderde entry directories
+        """
+        removed = list()
+        with self.locked(exclusive=True):
+            entries = sorted(self.entries())
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, entry_directory in entries:
+                if total_size <= self.max_size:
+                    break
+                shutil.rmtree(entry_directory, ignore_errors=True)
+                total_size -= size
+                removed.append(entry_directory)
+            # tijdelijke directories van afgebroken runs
+            now = time.time()
+            for tmp_directory in self.tmp_directory.glob("*"):
+                try:
+                    if now - tmp_directory.stat().st_mtime > STALE_TMP_AGE:
+                        shutil.rmtree(tmp_directory, ignore_errors=True)
+                except OSError:
+                    continue
+        if removed:
+            _logger.info(f"Evicted {len(removed)} entries from the artifact cache")
+        return removed
@@ -0,0 +1,508 @@
+"""
+Build many reports in one run on a single pool of workers
+
+``latex2ccn batch`` takes a list of settings files (or glob patterns) and combines them into one
+plan. Makefile directories and pre- and post scripts which are shared by several reports are run
+only once. The plan is executed in waves on one bounded pool: first all makefile directories,
+then the prescripts, then the documents of all reports and finally the postscripts. The scripts
+of all reports form one dependency graph, so a shared script still runs after the scripts listed
+above it and before the scripts listed below it in every report, and the ``inputs``, ``outputs``
+and ``after`` fields of :mod:`latexmlsuite.scripts` work as in a single report. Every
+document is made by a ``latex2ccn`` process in the directory of its report, with ``--no_make``
+and ``--sync_makefiles``, so the figures made in the first wave are still copied to its ccn
+directory. Arguments which are not known to ``latex2ccn batch`` are passed on to these processes.
+
+At the end a summary shows per report which stages failed and how long they took.
+"""
+
+import argparse
+import glob
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from latexmlsuite.build_cache import CACHE_DIRECTORY_NAME, BuildCache
+from latexmlsuite.main_suite import DEFAULT_MODE, MODES, Settings, run_command
+from latexmlsuite.utils import _print_lock
+from latexmlsuite.scripts import (expand_patterns, read_makefiles, read_scripts,
+                                  script_dependencies, topological_order)
+
+STAGES = ("make", "prescripts", "document", "postscripts")
+DEFAULT_LOG_DIRECTORY = "batch_logs"
+
+_logger = logging.getLogger(__name__)
+
+
+class Report:
+    """
+    Een rapport in de batch, met de paden uit zijn settings file absoluut gemaakt
+
+    Args:
+        settings_file: str or Path
+            De settings file van het rapport. De paden in de settings file zijn relatief ten
+            opzichte van de directory van deze file
+        platform_is_windows: bool
+            Gebruik de powershell versies van de scripts
+    """
+
+    def __init__(self, settings_file, platform_is_windows=False):
+        self.settings_file = Path(settings_file).absolute()
+        self.directory = self.settings_file.parent
+        self.name = Path(settings_file).as_posix()
+        settings = Settings(settings_filename=self.settings_file)
+        makefile_directories, _ = read_makefiles(settings.makefile_directories)
+        self.makefile_directories = [self.resolve(makefile_dir) for makefile_dir in
+                                     makefile_directories or []]
+        self.pre_scripts = read_scripts(settings.pre_scripts)
+        self.post_scripts = read_scripts(settings.post_scripts)
+        self.output_directory_html = self.resolve(settings.output_directory_html)
+        self.output_directory_draft = self.resolve(settings.output_directory_draft)
+        # per stage een lijst met (gelukt, duur)
+        self.results = {stage: [] for stage in STAGES}
+
+    def resolve(self, file_name):
+        return Path(os.path.normpath(self.directory / Path(file_name)))
+
+    def resolve_patterns(self, patterns):
+        return [self.directory / Path(pattern) for pattern in patterns]
+
+    def cache_directory(self, mode):
+        """De directory van de build cache, net als in :class:`LaTeXMLSuite`"""
+        output_directory = (self.output_directory_draft if mode == "draft"
+                            else self.output_directory_html)
+        return output_directory / CACHE_DIRECTORY_NAME
+
+    def add_result(self, stage, success, duration):
+        self.results[stage].append((success, duration))
+
+    def stage_success(self, stage):
+        return all(success for success, _ in self.results[stage])
+
+    @property
+    def success(self):
+        return all(self.stage_success(stage) for stage in STAGES)
+
+
+class BatchJob:
+    """
+    Eén commando in de batch, met de rapporten die erop wachten
+
+    Args:
+        stage: str
+            De stage uit :data:`STAGES` waarbij het commando hoort
+        name: str
+            Naam van het commando in de output en de log file
+        command: list
+            Het commando met zijn argumenten
+        cwd: Path
+            Directory waarin het commando gedraaid wordt
+        reports: list
+            De rapporten die dit commando nodig hebben
+    """
+
+    def __init__(self, stage, name, command, cwd, reports):
+        self.stage = stage
+        self.name = name
+        self.command = command
+        self.cwd = cwd
+        self.reports = reports
+        # de jobs die eerst klaar moeten zijn
+        self.depends_on = set()
+        self.success = None
+        self.duration = None
+
+    @property
+    def sequential(self):
+        """True als de job ook draait als een job waarop hij wacht mislukt is"""
+        return True
+
+    def run(self, log_directory=None, quiet=False):
+        """Draai het commando en schrijf de output in één keer naar de terminal"""
+        log_file = None
+        if log_directory is not None:
+            log_name = re.sub(r"[^\w.-]+", "_", f"{self.stage} {self.name}").strip("_")
+            log_file = Path(log_directory) / Path(log_name + ".log")
+        output = list()
+        start = time.perf_counter()
+        result = run_command(command=self.command, cwd=self.cwd, output=output,
+                             log_file=log_file, quiet=quiet, label=self.name)
+        self.duration = time.perf_counter() - start
+        self.success = result.returncode == 0
+        status = "ok" if self.success else f"failed ({result.returncode})"
+        with _print_lock:
+            print(f"[{self.stage}] {self.name}: {status} in {self.duration:.1f} s")
+            for line in output:
+                print(line)
+        for report in self.reports:
+            report.add_result(self.stage, self.success, self.duration)
+        return self.success
+
+    def skip(self, reason):
+        """Sla de job over en tel hem als mislukt voor zijn rapporten"""
+        self.success = False
+        self.duration = 0.0
+        with _print_lock:
+            print(f"[{self.stage}] {self.name}: skipped because {reason}")
+        for report in self.reports:
+            report.add_result(self.stage, self.success, self.duration)
+        return self.success
+
+
+class ScriptJob(BatchJob):
+    """
+    Een pre- of postscript in de batch, met per rapport het :class:`Script` uit zijn settings
+
+    Het script wordt overgeslagen als het in ieder rapport inputs heeft en die inputs in de
+    build cache van ieder rapport niet veranderd zijn, zie :mod:`latexmlsuite.scripts`
+
+    Args:
+        stage: str
+            ``prescripts`` of ``postscripts``
+        script_path: Path
+            Het absolute pad van het script
+        command: list
+            Het commando met zijn argumenten
+        build_caches: dict
+            Per rapport zijn :class:`BuildCache`. Leeg bij een droge run
+    """
+
+    def __init__(self, stage, script_path, command, build_caches):
+        super().__init__(stage, script_path.as_posix(), command, script_path.parent, [])
+        self.script_path = script_path
+        self.build_caches = build_caches
+        self.scripts = list()
+
+    def add_report(self, report, script):
+        self.reports.append(report)
+        self.scripts.append(script)
+
+    @property
+    def sequential(self):
+        return all(script.sequential for script in self.scripts)
+
+    @property
+    def cache_stage(self):
+        return f"script {self.script_path.as_posix()}"
+
+    def fingerprints(self):
+        """Per rapport de fingerprint van de inputs, of None als het script altijd draait"""
+        if not self.build_caches or any(script.inputs is None for script in self.scripts):
+            return None
+        fingerprints = list()
+        for report, script in zip(self.reports, self.scripts):
+            inputs = expand_patterns(report.resolve_patterns(script.inputs))
+            fingerprints.append(self.build_caches[report].fingerprint(
+                inputs=inputs + [self.script_path], settings=dict(outputs=script.outputs)))
+        return fingerprints
+
+    def is_up_to_date(self, fingerprints):
+        up_to_date = True
+        for report, script, fingerprint in zip(self.reports, self.scripts, fingerprints):
+            outputs = expand_patterns(report.resolve_patterns(script.outputs), keep_missing=True)
+            if not self.build_caches[report].is_up_to_date(self.cache_stage, fingerprint,
+                                                           outputs=outputs):
+                up_to_date = False
+        return up_to_date
+
+    def run(self, log_directory=None, quiet=False):
+        fingerprints = self.fingerprints()
+        if fingerprints is not None and self.is_up_to_date(fingerprints):
+            self.success = True
+            self.duration = 0.0
+            with _print_lock:
+                print(f"[{self.stage}] {self.name}: inputs did not change")
+            for report in self.reports:
+                report.add_result(self.stage, self.success, self.duration)
+            return self.success
+        success = super().run(log_directory=log_directory, quiet=quiet)
+        if success and fingerprints is not None:
+            for report, fingerprint in zip(self.reports, fingerprints):
+                self.build_caches[report].update(self.cache_stage, fingerprint)
+        return success
+
+
+def expand_settings_files(patterns):
+    """
+    Zoek de settings files bij de gegeven namen en glob patronen
+
+    Args:
+        patterns: list
+            Namen van settings files of patronen zoals ``rapporten/*/rapport_settings.yml``
+
+    Returns: list
+        De settings files, zonder dubbelen en in de volgorde van de patronen
+    """
+    settings_files = dict()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches:
+            _logger.warning(f"No settings file found for {pattern}")
+        for match in matches:
+            settings_files.setdefault(Path(match).absolute(), Path(match))
+    return list(settings_files.values())
+
+
+class BatchPlan:
+    """
+    Het gecombineerde plan van alle rapporten
+
+    Een makefile directory of script die door meerdere rapporten gebruikt wordt, komt maar één
+    keer in het plan. De scripts van alle rapporten vormen samen één dependency graph: een
+    script wacht op de scripts waarop het in een van zijn rapporten wacht. De rapporten draaien
+    verder naast elkaar.
+
+    Args:
+        reports: list
+            De :class:`Report` objecten
+        mode: str
+            De mode van de documenten, zie :data:`latexmlsuite.main_suite.MODES`
+        report_arguments: list
+            Extra argumenten voor de latex2ccn processen van de rapporten
+        make_exe: str
+            Het make commando
+        jobs_per_report: int
+            Aantal jobs dat ieder rapport zelf mag gebruiken
+        platform_is_windows: bool
+            Draai de scripts met powershell
+        test: bool
+            Laat alleen de commando's zien
+    """
+
+    def __init__(self, reports, mode=DEFAULT_MODE, report_arguments=None, make_exe="make",
+                 jobs_per_report=1, platform_is_windows=False, test=False):
+        self.reports = reports
+        self.mode = mode
+        echo = ["echo"] if test else []
+
+        makefile_reports = dict()
+        for report in reports:
+            for makefile_dir in report.makefile_directories:
+                makefile_reports.setdefault(makefile_dir, []).append(report)
+        make_command = echo + [make_exe] + (["clean"] if mode == "clean" else [])
+        self.make_jobs = [BatchJob("make", makefile_dir.as_posix(), make_command, makefile_dir,
+                                   users)
+                          for makefile_dir, users in makefile_reports.items()]
+
+        self.platform_is_windows = platform_is_windows
+        self.script_command = echo + (["powershell.exe"] if platform_is_windows else ["sh"])
+        # bij een droge run wordt niets overgeslagen en niets in de build cache geschreven
+        self.build_caches = dict()
+        if not test:
+            self.build_caches = {report: BuildCache(report.cache_directory(mode))
+                                 for report in reports}
+        self.pre_script_jobs = list()
+        self.post_script_jobs = list()
+        if mode != "clean":
+            self.pre_script_jobs = self.script_jobs("prescripts", "pre_scripts")
+        if mode in ("html", "all"):
+            self.post_script_jobs = self.script_jobs("postscripts", "post_scripts")
+
+        # ook met mode none draait latex2ccn, om de figuren naar de ccn directory te kopiëren
+        self.document_jobs = list()
+        for report in reports:
+            command = [sys.executable, "-m", "latexmlsuite.main_suite",
+                       "--settings_filename", report.settings_file.name, "--mode", mode,
+                       "--no_make", "--sync_makefiles", "--no_scripts",
+                       "--jobs", str(jobs_per_report)]
+            if test:
+                command.append("--test")
+            command += list(report_arguments or [])
+            self.document_jobs.append(BatchJob("document", report.name, command,
+                                               report.directory, [report]))
+
+    def script_jobs(self, stage, attribute):
+        """
+        Combineer de scripts van alle rapporten in één dependency graph
+
+        Een script dat in meerdere rapporten staat, wordt één job die wacht op de scripts waarop
+        het in ieder van die rapporten wacht, zie :func:`latexmlsuite.scripts.script_dependencies`
+
+        Returns: list
+            De :class:`ScriptJob` objecten in een volgorde waarin iedere job na de jobs komt
+            waarop hij wacht
+
+        Raises:
+            ValueError: als de scripts in verschillende rapporten in een andere volgorde staan,
+                zodat ze op elkaar zouden wachten
+        """
+        jobs = dict()
+        for report in self.reports:
+            scripts = getattr(report, attribute)
+            report_jobs = list()
+            for script in scripts:
+                script_path = report.resolve(script.path(self.platform_is_windows))
+                if script_path not in jobs:
+                    jobs[script_path] = ScriptJob(
+                        stage, script_path, self.script_command + [script_path.as_posix()],
+                        self.build_caches)
+                jobs[script_path].add_report(report, script)
+                report_jobs.append(jobs[script_path])
+            for job, depends_on in zip(report_jobs, script_dependencies(scripts)):
+                job.depends_on.update(report_jobs[index] for index in depends_on)
+        jobs = list(jobs.values())
+        index_of = {job: index for index, job in enumerate(jobs)}
+        dependencies = [{index_of[other] for other in job.depends_on} for job in jobs]
+        return [jobs[index] for index in topological_order(jobs, dependencies)]
+
+    def n_references(self, stage):
+        """Aantal keer dat een stage in alle rapporten samen genoemd wordt"""
+        attribute = dict(make="makefile_directories", prescripts="pre_scripts",
+                         postscripts="post_scripts")[stage]
+        return sum(len(getattr(report, attribute)) for report in self.reports)
+
+    def describe(self):
+        n_pre_scripts = len(self.pre_script_jobs)
+        n_post_scripts = len(self.post_script_jobs)
+        return (f"{len(self.reports)} reports: {len(self.make_jobs)} makefile directories "
+                f"(used {self.n_references('make')} times), {n_pre_scripts} prescripts "
+                f"(used {self.n_references('prescripts')} times), {len(self.document_jobs)} "
+                f"documents and {n_post_scripts} postscripts "
+                f"(used {self.n_references('postscripts')} times)")
+
+
+def run_wave(executor, function, items):
+    """Draai *function* voor alle items op de pool en wacht tot ze allemaal klaar zijn"""
+    futures = [executor.submit(function, item) for item in items]
+    for future in futures:
+        future.result()
+
+
+def run_graph(executor, jobs, log_directory=None, quiet=False, can_run=None):
+    """
+    Draai jobs op de pool, iedere job pas als de jobs waarop hij wacht klaar zijn
+
+    Een job die niet als gewone naam gegeven is, wordt overgeslagen als een job waarop hij wacht
+    mislukt is, net als in :meth:`LaTeXMLSuite.launch_scripts`.
+
+    Args:
+        executor: ThreadPoolExecutor
+            De pool
+        jobs: list
+            De jobs, in een volgorde waarin iedere job na de jobs komt waarop hij wacht
+        log_directory: Path or None
+            Directory voor de log files
+        quiet: bool
+            Laat alleen de status zien
+        can_run: callable or None
+            Geeft False voor een job die niet mag draaien. Die job wordt zonder melding
+            overgeslagen en telt als mislukt voor de jobs die erop wachten
+    """
+    # de jobs worden in volgorde aangeboden, dus een job die op een worker wacht, wacht alleen
+    # op jobs die al draaien of klaar zijn
+    futures = dict()
+
+    def run_job(job):
+        if can_run is not None and not can_run(job):
+            return False
+        if not all(futures[other].result() for other in job.depends_on) and not job.sequential:
+            return job.skip("a script it runs after failed")
+        return job.run(log_directory=log_directory, quiet=quiet)
+
+    for job in jobs:
+        futures[job] = executor.submit(run_job, job)
+    for future in futures.values():
+        future.result()
+
+
+def run_batch(plan, jobs, log_directory=None, quiet=False):
+    """
+    Voer een :class:`BatchPlan` uit op één pool van *jobs* workers
+
+    De waves draaien na elkaar, zodat de documenten altijd de figuren en de resultaten van de
+    prescripts van alle rapporten zien. Postscripts van een rapport waarvan het document mislukt
+    is, worden overgeslagen.
+
+    Returns: list
+        De rapporten met hun resultaten
+    """
+    if log_directory is not None:
+        Path(log_directory).mkdir(parents=True, exist_ok=True)
+    run_job = partial(BatchJob.run, log_directory=log_directory, quiet=quiet)
+    run_scripts = partial(run_graph, log_directory=log_directory, quiet=quiet)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        run_wave(executor, run_job, plan.make_jobs)
+        run_scripts(executor, plan.pre_script_jobs)
+        run_wave(executor, run_job, plan.document_jobs)
+        run_scripts(executor, plan.post_script_jobs, can_run=lambda job: all(
+            report.stage_success("document") for report in job.reports))
+    return plan.reports
+
+
+def report_summary(reports, wall_time):
+    """Print per rapport de status en de duur van iedere stage"""
+    message = "{:50.50s} {:>7} " + " ".join(["{:>11}"] * len(STAGES))
+    print(message.format("Report", "status", *STAGES))
+    for report in reports:
+        durations = list()
+        for stage in STAGES:
+            results = report.results[stage]
+            if not results:
+                durations.append("-")
+                continue
+            duration = f"{sum(duration for _, duration in results):.1f}"
+            if not report.stage_success(stage):
+                duration += "!"
+            durations.append(duration)
+        print(message.format(report.name, "ok" if report.success else "failed", *durations))
+    n_failed = sum(not report.success for report in reports)
+    print(f"{len(reports) - n_failed} of {len(reports)} reports succeeded in {wall_time:.1f} s"
+          f" (shared stages are counted for every report which uses them; ! marks a failure)")
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog="latex2ccn batch",
+        description="Maak meerdere rapporten in één run. Onbekende argumenten worden aan de "
+                    "latex2ccn processen van de rapporten doorgegeven")
+    parser.add_argument("settings_files", nargs="+",
+                        help="Settings files van de rapporten of glob patronen, zoals "
+                             "'rapporten/*/rapport_settings.yml'")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Aantal commando's dat tegelijk draait. Default %(default)s")
+    parser.add_argument("--mode", choices=MODES, default=DEFAULT_MODE,
+                        help="Welke type document wil je maken?")
+    parser.add_argument("--make_exe", default="make",
+                        help="executable naam om Makefile te runnen. Default 'make'")
+    parser.add_argument("--log_directory", default=DEFAULT_LOG_DIRECTORY,
+                        help="Directory voor de log file van ieder commando. "
+                             "Default %(default)s")
+    parser.add_argument("-q", "--quiet", action="store_true", default=False,
+                        help="Laat alleen de status van ieder commando zien; de output staat in "
+                             "de log files")
+    parser.add_argument("--test", action="store_true", default=False,
+                        help="Doe een droge run, dus laat alleen commando's zien")
+    return parser.parse_known_args(args)
+
+
+def batch_main(args):
+    """
+    Het ``latex2ccn batch`` commando
+
+    Args:
+        args: list
+            De command line argumenten na ``batch``
+
+    Returns: list
+        De :class:`Report` objecten met hun resultaten
+    """
+    args, report_arguments = parse_args(args)
+    platform_is_windows = "win" in sys.platform
+    reports = [Report(settings_file, platform_is_windows=platform_is_windows)
+               for settings_file in expand_settings_files(args.settings_files)]
+    if not reports:
+        return reports
+    jobs = max(1, args.jobs)
+    # als er minder rapporten dan workers zijn, mogen de rapporten zelf ook parallel werken
+    plan = BatchPlan(reports, mode=args.mode, report_arguments=report_arguments,
+                     make_exe=args.make_exe, jobs_per_report=max(1, jobs // len(reports)),
+                     platform_is_windows=platform_is_windows, test=args.test)
+    print(plan.describe())
+    start = time.perf_counter()
+    run_batch(plan, jobs=jobs, log_directory=args.log_directory, quiet=args.quiet)
+    report_summary(reports, wall_time=time.perf_counter() - start)
+    return reports
@@ -0,0 +1,452 @@
+"""
+Benchmark of the orchestration by latex2ccn with synthetic reports and stub tools
+
+A synthetic report is generated with a number of chapters, makefile directories and figures.
+The external tools (latexmk, latexml, latexmlpost, latexmlc, make and htmlcleaner) are replaced by small
+Python scripts which sleep for a configurable time and write a configurable number of output
+lines, so the overhead of the Python orchestration itself can be measured on a plain Linux box
+without a TeX installation.
+
+Run it as::
+
+    python -m latexmlsuite.benchmark --chapters 30 --makefiles 10 --latency 0.05 --jobs 4
+
+Per stage the wall time is reported together with the time in which no external tool was
+running, which is the overhead of the orchestration.
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+from latexmlsuite.main_suite import LaTeXMLSuite, setup_logging
+
+LATENCY_VARIABLE = "LATEXMLSUITE_STUB_LATENCY"
+OUTPUT_LINES_VARIABLE = "LATEXMLSUITE_STUB_OUTPUT_LINES"
+
+_logger = logging.getLogger(__name__)
+
+# gemeenschappelijk begin van alle stub scripts
+STUB_HEADER = '''#!{python}
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+time.sleep(float(os.environ.get("{latency}", "0")))
+for i in range(int(os.environ.get("{output_lines}", "0"))):
+    print(f"{{Path(sys.argv[0]).name}}: regel {{i}} van de output")
+
+options = dict(a[2:].split("=", 1) for a in sys.argv[1:] if a.startswith("--") and "=" in a)
+arguments = [a for a in sys.argv[1:] if not a.startswith("-")]
+'''
+
+STUB_LATEXMK = '''
+output_directory = "."
+for argument in sys.argv[1:]:
+    if argument.startswith("-output-directory="):
+        output_directory = argument.split("=", 1)[1]
+if "-c" in sys.argv[1:]:
+    sys.exit(0)
+stem = Path(arguments[0]).stem
+Path(output_directory).mkdir(parents=True, exist_ok=True)
+print("Run number 1 of rule 'xelatex'", flush=True)
+for suffix in (".aux", ".log"):
+    Path(output_directory, stem + suffix).write_text(f"{stem}{suffix}")
+print("Run number 1 of rule 'xdvipdfmx'", flush=True)
+Path(output_directory, stem + ".pdf").write_text(f"{stem}.pdf")
+'''
+
+STUB_LATEXML = '''
+source = Path(arguments[-1])
+if source.suffix == "":
+    source = source.with_suffix(".tex")
+
+
+def expand(tex_file):
+    text = Path(tex_file).read_text()
+    return re.sub(r"\\\\input\\{([^}]*)\\}",
+                  lambda m: expand(m.group(1) if m.group(1).endswith(".tex")
+                                   else m.group(1) + ".tex"), text)
+
+
+if source.suffix == ".bib":
+    body = "<bibliography/>"
+else:
+    # hoofdstukken, figuren en de bibliografie, genummerd met de tellers die het fragment zet
+    counters = dict(chapter=0, figure=0)
+    elements = []
+    in_chapter = False
+    for match in re.finditer(r"\\\\setcounter\\{(\\w+)\\}\\{(\\d+)\\}|\\\\chapter\\{|"
+                             r"\\\\begin\\{figure\\}|\\\\printbibliography", expand(source)):
+        if match.group(1) is not None:
+            counters[match.group(1)] = int(match.group(2))
+        elif "bibliography" in match.group(0):
+            if in_chapter:
+                elements.append("</chapter>")
+            elements.append('<bibliography xml:id="bib"/>')
+            in_chapter = False
+        elif "chapter" in match.group(0):
+            counters["chapter"] += 1
+            counters["figure"] = 0
+            if in_chapter:
+                elements.append("</chapter>")
+            elements.append(f'<chapter xml:id="Ch{counters["chapter"]}"><title>Hoofdstuk '
+                            f'{counters["chapter"]}</title><para><p>{"tekst " * 50}</p></para>')
+            in_chapter = True
+        else:
+            counters["figure"] += 1
+            number = f'{counters["chapter"]}.{counters["figure"]}'
+            elements.append(f'<figure xml:id="Ch{number.replace(".", ".F")}"><tags><tag>'
+                            f'{number}</tag></tags></figure>')
+    if in_chapter:
+        elements.append("</chapter>")
+    body = "".join(elements)
+Path(options["dest"]).write_text(
+    '<?xml version="1.0" encoding="UTF-8"?>\\n<?latexml class="cbsdocs"?>\\n'
+    '<document xmlns="http://dlmf.nist.gov/LaTeXML"><title>Synthetisch</title>'
+    + body + "</document>\\n")
+'''
+
+STUB_LATEXMLPOST = '''
+if "--prescan" in sys.argv[1:]:
+    # alleen de database met de ids vullen, zonder pagina's
+    Path(options["dbfile"]).write_text("ids")
+    sys.exit(0)
+source = Path(arguments[0])
+if source.suffix != ".xml":
+    source = source.with_suffix(".xml")
+chapters = re.findall(r'<chapter xml:id="(Ch\\d+)">(.*?)</chapter>', source.read_text(),
+                      re.DOTALL)
+destination = Path(options["dest"])
+destination.parent.mkdir(parents=True, exist_ok=True)
+destination.write_text("<html>index</html>")
+if "--split" in sys.argv[1:]:
+    for chapter_id, content in chapters:
+        (destination.parent / (chapter_id + ".html")).write_text(f"<html>{content}</html>")
+'''
+
+STUB_LATEXMLC = '''
+source = Path(arguments[-1])
+
+
+def expand(tex_file):
+    text = Path(tex_file).read_text()
+    return re.sub(r"\\\\input\\{([^}]*)\\}",
+                  lambda m: expand(m.group(1) if m.group(1).endswith(".tex")
+                                   else m.group(1) + ".tex"), text)
+
+
+n_chapters = len(re.findall(r"\\\\chapter\\{", expand(source)))
+destination = Path(options["dest"])
+destination.parent.mkdir(parents=True, exist_ok=True)
+destination.write_text("<html>index</html>")
+if "--split" in sys.argv[1:]:
+    for chapter in range(1, n_chapters + 1):
+        (destination.parent / f"Ch{chapter}.html").write_text(f"<html>Ch{chapter}</html>")
+'''
+
+STUB_MAKE = '''
+scripts = sorted(Path(".").glob("fig_*.py"))
+
+
+def target(script):
+    return Path("highcharts") / (script.stem + ".html")
+
+
+def up_to_date(script):
+    return target(script).exists() and target(script).stat().st_mtime >= script.stat().st_mtime
+
+
+if "-q" in sys.argv[1:]:
+    sys.exit(0 if all(up_to_date(script) for script in scripts) else 1)
+if "clean" in arguments:
+    for script in scripts:
+        if target(script).exists():
+            target(script).unlink()
+    sys.exit(0)
+if all(up_to_date(script) for script in scripts):
+    print("make: Nothing to be done for 'all'.")
+    sys.exit(0)
+Path("highcharts").mkdir(exist_ok=True)
+for script in scripts:
+    if not up_to_date(script):
+        print(f"python {script}")
+        target(script).write_text(f"<html>{script.stem}</html>")
+'''
+
+STUB_HTMLCLEANER = '''
+html_file = Path(arguments[0])
+html_file.write_text(html_file.read_text().replace("<html>", "<html><!-- clean -->"))
+'''
+
+STUBS = dict(latexmk=STUB_LATEXMK, latexml=STUB_LATEXML, latexmlpost=STUB_LATEXMLPOST,
+             latexmlc=STUB_LATEXMLC, make=STUB_MAKE, htmlcleaner=STUB_HTMLCLEANER)
+
+
+def create_stub_toolchain(bin_directory):
+    """
+    Schrijf de stub executables in een directory
+
+    De wachttijd en het aantal regels output worden bij het aanroepen uit de environment
+    variabelen LATEXMLSUITE_STUB_LATENCY en LATEXMLSUITE_STUB_OUTPUT_LINES gelezen.
+
+    Args:
+        bin_directory: str or Path
+            Directory waarin de stubs geschreven worden. Zet deze vooraan in het PATH
+
+    Returns: Path
+        De bin directory
+    """
+    bin_directory = Path(bin_directory)
+    bin_directory.mkdir(parents=True, exist_ok=True)
+    header = STUB_HEADER.format(python=sys.executable, latency=LATENCY_VARIABLE,
+                                output_lines=OUTPUT_LINES_VARIABLE)
+    for name, body in STUBS.items():
+        stub = bin_directory / name
+        stub.write_text(header + body)
+        stub.chmod(stub.stat().st_mode | stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH)
+    return bin_directory
+
+
+def generate_report(root, n_chapters=10, n_makefile_directories=4, n_figures=3):
+    """
+    Maak een synthetisch rapport met de structuur van een CBS publicatie
+
+    Args:
+        root: str or Path
+            Directory waarin het rapport gemaakt wordt
+        n_chapters: int
+            Aantal hoofdstukken, ieder in een eigen file onder sections
+        n_makefile_directories: int
+            Aantal directories onder figures met een Makefile
+        n_figures: int
+            Aantal plaatjes per makefile directory
+
+    Returns: Path
+        De root directory van het rapport
+    """
+    root = Path(root)
+    (root / "sections").mkdir(parents=True, exist_ok=True)
+    inputs = []
+    for chapter in range(1, n_chapters + 1):
+        name = f"sections/{chapter:02d}_hoofdstuk"
+        paragraphs = "\n\n".join(f"Alinea {i} van hoofdstuk {chapter}." for i in range(20))
+        (root / f"{name}.tex").write_text(f"\\chapter{{Hoofdstuk {chapter}}}\n{paragraphs}\n")
+        inputs.append(f"    \\input{{{name}}}")
+    main = ["\\documentclass[dutch,publicatie]{cbsdocs}",
+            "\\begin{document}",
+            "    \\beforepreface",
+            "    \\afterpreface"] + inputs + ["\\end{document}", ""]
+    (root / "main.tex").write_text("\n".join(main))
+    (root / "references.bib").write_text("@book{boek, title={Titel}, year={2021}}\n")
+
+    makefile_directories = []
+    for index in range(1, n_makefile_directories + 1):
+        makefile_dir = root / "figures" / f"figuur_{index:02d}"
+        makefile_dir.mkdir(parents=True, exist_ok=True)
+        (makefile_dir / "Makefile").write_text("all:\n\tpython plot.py\n")
+        for figure in range(1, n_figures + 1):
+            (makefile_dir / f"fig_{index:02d}_{figure}.py").write_text(f"print({figure})\n")
+        makefile_directories.append(makefile_dir.relative_to(root).as_posix())
+
+    settings = dict(general=dict(latex_main="main.tex", bibtex_file="references.bib",
+                                 output_filename="synthetisch.pdf", ccn_output_directory="ccn"),
+                    makefiles=makefile_directories,
+                    cache=dict(output_directory="out", output_directory_html="out_html"))
+    with open(root / "rapport_settings.yml", "w") as stream:
+        yaml.dump(settings, stream)
+    return root
+
+
+@contextlib.contextmanager
+def benchmark_environment(report_root, bin_directory, latency, output_lines):
+    """Draai in de report directory met de stubs vooraan in het PATH"""
+    old_cwd = os.getcwd()
+    old_environ = dict(os.environ)
+    os.environ["PATH"] = str(Path(bin_directory).absolute()) + os.pathsep + os.environ["PATH"]
+    os.environ[LATENCY_VARIABLE] = str(latency)
+    os.environ[OUTPUT_LINES_VARIABLE] = str(output_lines)
+    os.chdir(report_root)
+    try:
+        yield
+    finally:
+        os.chdir(old_cwd)
+        os.environ.clear()
+        os.environ.update(old_environ)
+
+
+def idle_time(stage, commands):
+    """
+    De tijd in een stage waarin geen enkel extern commando draaide
+
+    Args:
+        stage: dict
+            Het trace event van de stage
+        commands: list
+            De trace events van alle commando's
+
+    Returns: float
+        De tijd in seconden
+    """
+    start = stage["ts"]
+    end = stage["ts"] + stage["dur"]
+    intervals = sorted((max(start, c["ts"]), min(end, c["ts"] + c["dur"])) for c in commands
+                       if c["ts"] < end and c["ts"] + c["dur"] > start)
+    busy = 0
+    current_start, current_end = None, None
+    for interval_start, interval_end in intervals:
+        if current_end is None or interval_start > current_end:
+            if current_end is not None:
+                busy += current_end - current_start
+            current_start, current_end = interval_start, interval_end
+        else:
+            current_end = max(current_end, interval_end)
+    if current_end is not None:
+        busy += current_end - current_start
+    return (stage["dur"] - busy) / 1e6
+
+
+def stage_statistics(tracer):
+    """
+    Tel per stage de wall tijd, het aantal commando's en de overhead op
+
+    Returns: list
+        Per stage een dict, gesorteerd op de wall tijd
+    """
+    commands = [event for event in tracer.events if event["cat"] == "command"]
+    statistics = dict()
+    for event in tracer.events:
+        if event["cat"] != "stage":
+            continue
+        row = statistics.setdefault(event["name"], dict(name=event["name"], count=0,
+                                                        wall_time=0.0, overhead=0.0, commands=0))
+        row["count"] += 1
+        row["wall_time"] += event["dur"] / 1e6
+        row["overhead"] += idle_time(event, commands)
+        end = event["ts"] + event["dur"]
+        row["commands"] += sum(1 for c in commands if c["ts"] >= event["ts"] and
+                               c["ts"] + c["dur"] <= end and c["tid"] == event["tid"])
+    return sorted(statistics.values(), key=lambda row: row["wall_time"], reverse=True)
+
+
+def run_benchmark(work_directory, n_chapters=10, n_makefile_directories=4, n_figures=3,
+                  latency=0.0, output_lines=10, jobs=1, mode="all", latexml_per_chapter=False,
+                  single_pass=False, parallel_latexmlpost=False, n_runs=2, quiet=True):
+    """
+    Genereer een rapport en draai LaTeXMLSuite er een aantal keer op met de stub tools
+
+    De eerste run is een koude build, de volgende runs laten zien hoe snel een build zonder
+    wijzigingen is.
+
+    Returns: list
+        Per run een dict met de totale wall tijd en de statistieken per stage
+    """
+    work_directory = Path(work_directory)
+    report_root = generate_report(work_directory / "rapport", n_chapters=n_chapters,
+                                  n_makefile_directories=n_makefile_directories,
+                                  n_figures=n_figures)
+    bin_directory = create_stub_toolchain(work_directory / "bin")
+    makefile_directories = sorted(p.parent.relative_to(report_root).as_posix()
+                                  for p in report_root.glob("figures/*/Makefile"))
+
+    results = []
+    with benchmark_environment(report_root, bin_directory, latency, output_lines):
+        for run_index in range(n_runs):
+            suite = LaTeXMLSuite(main_file_name="main.tex",
+                                 bibtex_file="references.bib",
+                                 output_filename="synthetisch.pdf",
+                                 makefile_directories=makefile_directories,
+                                 mode=mode,
+                                 jobs=jobs,
+                                 latexml_per_chapter=latexml_per_chapter,
+                                 single_pass=single_pass,
+                                 parallel_latexmlpost=parallel_latexmlpost,
+                                 quiet=quiet)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                suite.run()
+            wall_time = time.perf_counter() - start
+            pages = len(list(suite.ccn_html_dir.glob("*.html")))
+            results.append(dict(run=run_index, wall_time=wall_time, pages=pages,
+                                stages=stage_statistics(suite.tracer),
+                                cache_hits=sum(suite.build_cache.hits.values()),
+                                cache_misses=sum(suite.build_cache.misses.values())))
+    return results
+
+
+def report_results(results, n_chapters):
+    """Print de resultaten van de benchmark"""
+    for result in results:
+        label = "cold" if result["run"] == 0 else "warm"
+        print(f"Run {result['run']} ({label}): {result['wall_time']:.3f} s, "
+              f"{n_chapters / result['wall_time']:.1f} chapters/s, {result['pages']} pages, "
+              f"cache {result['cache_hits']} hits / {result['cache_misses']} misses")
+        message = "    {:40s} {:>5} {:>9} {:>9} {:>13}"
+        print(message.format("stage", "n", "commands", "wall [s]", "overhead [s]"))
+        for row in result["stages"]:
+            print(message.format(row["name"], row["count"], row["commands"],
+                                 f"{row['wall_time']:.3f}", f"{row['overhead']:.3f}"))
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="Benchmark de orchestratie van latex2ccn met "
+                                                 "een synthetisch rapport en stub tools")
+    parser.add_argument("--chapters", type=int, default=10, help="Aantal hoofdstukken")
+    parser.add_argument("--makefiles", type=int, default=4, help="Aantal makefile directories")
+    parser.add_argument("--figures", type=int, default=3, help="Plaatjes per makefile directory")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Wachttijd van ieder stub commando in seconden")
+    parser.add_argument("--output_lines", type=int, default=10,
+                        help="Aantal regels output van ieder stub commando")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Aantal parallelle jobs")
+    parser.add_argument("--runs", type=int, default=2, help="Aantal runs op hetzelfde rapport")
+    parser.add_argument("--latexml_per_chapter", action="store_true", default=False,
+                        help="Converteer ieder hoofdstuk als aparte latexml job")
+    parser.add_argument("--single_pass", action="store_true", default=False,
+                        help="Maak de html in één latexmlc proces")
+    parser.add_argument("--parallel_latexmlpost", action="store_true", default=False,
+                        help="Maak de html met een latexmlpost proces per hoofdstuk")
+    parser.add_argument("--work_directory", default=None,
+                        help="Directory voor het rapport. Default een tijdelijke directory")
+    parser.add_argument("-v", "--verbose", dest="loglevel", action="store_const",
+                        const=logging.INFO, default=logging.WARNING)
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+    if args.work_directory is None:
+        work_directory = Path(tempfile.mkdtemp(prefix="latexmlsuite_benchmark_"))
+    else:
+        work_directory = Path(args.work_directory)
+    try:
+        results = run_benchmark(work_directory, n_chapters=args.chapters,
+                                n_makefile_directories=args.makefiles, n_figures=args.figures,
+                                latency=args.latency, output_lines=args.output_lines,
+                                jobs=args.jobs, latexml_per_chapter=args.latexml_per_chapter,
+                                single_pass=args.single_pass,
+                                parallel_latexmlpost=args.parallel_latexmlpost, n_runs=args.runs)
+    finally:
+        if args.work_directory is None:
+            shutil.rmtree(work_directory, ignore_errors=True)
+    report_results(results, n_chapters=args.chapters)
+
+
+def run():
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,173 @@
+"""
+Make the pdf and the xml at the same time
+
+In mode ``all`` the pdf branch runs latexmk while the xml branch converts the bibliography and
+waits for the first xelatex pass of the pdf. The files of that pass are copied next to the main
+file of the html variant, so latexml does not read files which the later passes rewrite. The
+stages are methods of :class:`latexmlsuite.main_suite.LaTeXMLSuite` through
+:class:`BranchStages`.
+"""
+
+import logging
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# latexmk meldt iedere run van een regel, zoals "Run number 1 of rule 'xelatex'"
+LATEXMK_RULE_PATTERN = re.compile(r"Run number \d+ of rule '([^']+)'")
+# files van de pdf build die latexml niet leest; de rest wordt na de eerste xelatex pass naar de
+# html output directory gekopieerd
+PDF_ONLY_SUFFIXES = (".pdf", ".xdv", ".log", ".blg", ".fls", ".fdb_latexmk", ".synctex.gz")
+
+_logger = logging.getLogger(__name__)
+
+
+class BranchStages:
+    """
+    De stages van :class:`latexmlsuite.main_suite.LaTeXMLSuite` die de pdf en de xml tegelijk
+    maken. Gebruikt de instellingen en de build cache van de suite
+    """
+
+    def launch_pdf_and_xml_branches(self):
+        """
+        Maak de pdf en de xml tegelijk
+
+        De pdf wordt in de output directory gemaakt en de xml in de html output directory, dus de
+        twee takken delen geen files. De pdf wordt gekopieerd zodra de pdf tak klaar is, ook als de
+        xml tak nog bezig is. Deze methode komt pas terug als beide takken klaar zijn. Als beide
+        takken mislukken, wordt de fout van de pdf tak doorgegeven en die van de xml tak gelogd.
+        """
+        self.first_xelatex_pass = threading.Event()
+        errors = []
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pdf_branch = executor.submit(self.launch_pdf_branch)
+            xml_branch = executor.submit(self.launch_xml_branch)
+            try:
+                pdf_branch.result()
+                self.copy_pdf()
+            except Exception as err:
+                errors.append(err)
+            finally:
+                # wacht altijd op de xml tak, zodat er geen proces achterblijft
+                try:
+                    xml_branch.result()
+                except Exception as err:
+                    errors.append(err)
+                self.first_xelatex_pass = None
+        if len(errors) > 1:
+            _logger.error(f"The xml branch failed as well: {errors[1]}", exc_info=errors[1])
+        if errors:
+            raise errors[0]
+
+    def launch_pdf_branch(self):
+        """Maak de pdf; ook als latexmk mislukt hoeft de xml tak niet langer te wachten"""
+        try:
+            self.launch_latexmk()
+        finally:
+            self.finish_first_xelatex_pass(self.first_xelatex_pass)
+
+    def finish_first_xelatex_pass(self, first_xelatex_pass):
+        """
+        Bewaar de files van de eerste xelatex pass voor latexml en laat de xml tak verder gaan
+
+        De volgende passes van latexmk schrijven de aux file en de andere files in de output
+        directory opnieuw terwijl latexml draait. Daarom krijgt latexml een kopie in de html
+        output directory, naast zijn main file, zoals een eigen latexmk run voor de html variant
+        die ook zou maken. Files die een shell-escape commando buiten de output directory
+        schrijft, worden niet gekopieerd: latexml leest die uit de werkdirectory, dus zo'n
+        commando moet ze in de eerste pass volledig schrijven en in volgende passes ongemoeid
+        laten.
+
+        Args:
+            first_xelatex_pass: threading.Event
+                Het event waarop de xml tak wacht
+        """
+        if first_xelatex_pass.is_set():
+            return
+        if not self.test and not self.latexmk_html:
+            self.copy_first_pass_files()
+        first_xelatex_pass.set()
+
+    def copy_first_pass_files(self):
+        """Kopieer de files van de pdf build die latexml kan lezen naar de html output directory"""
+        out_dir = Path(self.output_directory)
+        out_dir_html = Path(self.output_directory_html)
+        if not out_dir.is_dir():
+            return
+        out_dir_html.mkdir(parents=True, exist_ok=True)
+        for source in out_dir.iterdir():
+            if not source.is_file() or source.name.endswith(PDF_ONLY_SUFFIXES):
+                continue
+            try:
+                shutil.copy2(source, out_dir_html / source.name)
+            except OSError as err:
+                _logger.warning(f"Could not copy {source} for latexml: {err}")
+
+    def latexmk_pass_watcher(self):
+        """
+        Geef een functie die de output van latexmk volgt en first_xelatex_pass zet zodra latexmk
+        na een xelatex run aan een volgende regel begint, zoals bibtex, xdvipdfmx of de tweede
+        xelatex pass
+
+        Returns: callable or None
+            None als er geen xml tak op de eerste pass wacht
+        """
+        first_xelatex_pass = self.first_xelatex_pass
+        if first_xelatex_pass is None:
+            return None
+        xelatex_ran = []
+
+        def watch_line(line):
+            match = LATEXMK_RULE_PATTERN.search(line)
+            if match is None:
+                return
+            if xelatex_ran:
+                self.finish_first_xelatex_pass(first_xelatex_pass)
+            if "latex" in match.group(1):
+                xelatex_ran.append(match.group(1))
+
+        return watch_line
+
+    def launch_xml_branch(self):
+        """Maak de tex file van de html variant en converteer die naar xml"""
+        if self.latexmk_html:
+            self.launch_latexmk_for_html()
+        else:
+            self.prepare_main_for_latexml()
+        self.launch_xml_conversion()
+
+    def launch_xml_only(self):
+        """
+        Maak alleen de xml
+
+        Zonder pdf draait er geen xelatex die de files maakt die via shell-escape geschreven
+        worden, dus dan houdt de html variant zijn eigen latexmk run
+        """
+        self.launch_latexmk_for_html()
+        self.copy_pdf()
+        self.launch_xml_conversion()
+
+    def launch_xml_conversion(self):
+        if self.do_latexml:
+            if self.bibtex_file is not None:
+                self.launch_latexml_bibtex()
+            if self.single_pass and self.mode in ("html", "all"):
+                # latexmlc maakt de html direct van de tex, zonder main.xml
+                return
+            self.wait_for_first_xelatex_pass()
+            self.launch_latexml()
+
+    def wait_for_first_xelatex_pass(self):
+        """
+        Wacht tot de eerste xelatex pass van de pdf klaar is
+
+        Zonder aparte latexmk run voor de html variant maakt de pdf tak de files die via
+        shell-escape gemaakt worden; die zijn er na de eerste pass, dus latexml hoeft niet op de
+        volgende passes en xdvipdfmx te wachten. latexml leest de kopie van de eerste pass, zie
+        :meth:`finish_first_xelatex_pass`. De bibliografie wordt intussen al geconverteerd.
+        """
+        first_xelatex_pass = self.first_xelatex_pass
+        if first_xelatex_pass is not None and not self.latexmk_html:
+            first_xelatex_pass.wait()
@@ -0,0 +1,301 @@
+"""
+Persistent build state used to skip stages of which the inputs did not change
+
+The state is stored as a json file in the cache directory (by default
+``out_html/.latexmlsuite-cache``). For every stage we store a fingerprint: a hash over the
+content of all input files and the settings of that stage. A stage is up to date if the
+fingerprint did not change and all its outputs still exist. Because we compare content instead
+of modification times, a ``git checkout``, a fresh clone or a ``touch`` does not trigger a
+rebuild, while clock skew on network shares cannot hide a changed input.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+CACHE_DIRECTORY_NAME = ".latexmlsuite-cache"
+STATE_FILE_NAME = "state.json"
+STATE_VERSION = 1
+HASH_BLOCK_SIZE = 1 << 20
+MISSING_FILE_HASH = "missing"
+# de grofste resolutie van de modificatie tijd op de file systemen die we tegenkomen (FAT)
+TIMESTAMP_GRANULARITY_NS = 2 * 10 ** 9
+
+_logger = logging.getLogger(__name__)
+
+
+def hash_file(file_name):
+    """
+    Bereken de sha256 hash van de inhoud van een file
+
+    Args:
+        file_name: str or Path
+            Naam van de file
+
+    Returns: str
+        De hex digest van de inhoud
+    """
+    sha = hashlib.sha256()
+    with open(file_name, "rb") as stream:
+        for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class BuildCache:
+    """
+    Bewaar de fingerprints van de build stages tussen verschillende runs
+
+    Args:
+        cache_directory: str or Path
+            Directory waarin de state file geschreven wordt
+        read_only: bool
+            Lees alleen de opgeslagen state, maar schrijf nooit iets weg. Wordt gebruikt voor een
+            droge run
+    """
+
+    def __init__(self, cache_directory, read_only=False):
+        self.cache_directory = Path(cache_directory)
+        self.state_file = self.cache_directory / STATE_FILE_NAME
+        self.read_only = read_only
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        # per stage de inputs die in deze run een rebuild gaven en de outputs van de stage
+        self.triggers = defaultdict(set)
+        self.outputs = defaultdict(set)
+
+        self._lock = threading.RLock()
+        # per file de laatste (size, mtime_ns, inode, ctime_ns, hash), zodat we ongewijzigde files
+        # niet elke keer opnieuw hoeven te hashen
+        self._file_hashes = dict()
+        self._stages = dict()
+        # per stage de hashes van de inputs bij de laatste succesvolle run, en per fingerprint van
+        # deze run de hashes waaruit die berekend is
+        self._stage_inputs = dict()
+        self._fingerprint_inputs = dict()
+        self.load()
+
+    def load(self):
+        """Lees de state file als die bestaat"""
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as stream:
+                state = json.load(stream)
+        except FileNotFoundError:
+            _logger.debug(f"No build state found at {self.state_file}")
+            return
+        except (OSError, ValueError) as err:
+            _logger.warning(f"Could not read build state {self.state_file}: {err}")
+            return
+        if state.get("version") != STATE_VERSION:
+            _logger.info(f"Ignoring build state {self.state_file} with other version")
+            return
+        self._file_hashes = state.get("files", dict())
+        self._stages = state.get("stages", dict())
+        self._stage_inputs = state.get("inputs", dict())
+
+    def save(self):
+        """Schrijf de state atomair weg, zodat een afgebroken run geen kapotte file achterlaat"""
+        if self.read_only:
+            return
+        with self._lock:
+            state = dict(version=STATE_VERSION, files=self._file_hashes, stages=self._stages,
+                         inputs=self._stage_inputs)
+            self.cache_directory.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.state_file.with_name(
+                f"{self.state_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_file, "w", encoding="utf-8") as stream:
+                json.dump(state, stream, indent=1, sort_keys=True)
+            os.replace(tmp_file, self.state_file)
+
+    def file_hash(self, file_name):
+        """
+        Geef de hash van de inhoud van een file
+
+        De hash wordt alleen opnieuw berekend als de grootte, de modificatie tijd, de inode of de
+        change tijd van de file veranderd is. Een aangeraakte file wordt dus opnieuw gehashed, maar
+        geeft dezelfde hash. Een file die binnen de resolutie van de modificatie tijd voor het
+        hashen nog veranderd is, kan daarna ongemerkt nog een keer met dezelfde grootte en tijd
+        veranderen; van zo'n file wordt de hash niet bewaard.
+
+        Args:
+            file_name: str or Path
+                Naam van de file
+
+        Returns: str
+            De hash van de inhoud of MISSING_FILE_HASH als de file niet bestaat
+        """
+        file_name = Path(file_name)
+        key = file_name.as_posix()
+        try:
+            stat = file_name.stat()
+        except OSError:
+            return MISSING_FILE_HASH
+        identity = [stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_ctime_ns]
+        with self._lock:
+            cached = self._file_hashes.get(key)
+        # een entry van een oudere versie zonder inode en change tijd wordt opnieuw gehashed
+        if cached is not None and cached[:-1] == identity:
+            return cached[-1]
+        hashed_at = time.time_ns()
+        try:
+            content_hash = hash_file(file_name)
+        except OSError:
+            return MISSING_FILE_HASH
+        with self._lock:
+            if hashed_at - max(stat.st_mtime_ns, stat.st_ctime_ns) > TIMESTAMP_GRANULARITY_NS:
+                self._file_hashes[key] = identity + [content_hash]
+            else:
+                self._file_hashes.pop(key, None)
+        return content_hash
+
+    def fingerprint(self, inputs, settings=None):
+        """
+        Bereken de fingerprint van een stage
+
+        Args:
+            inputs: list
+                Alle input files van de stage
+            settings: object
+                Alle instellingen die de output van de stage bepalen, zoals het commando. Moet
+                naar json geschreven kunnen worden
+
+        Returns: str
+            Een hash over de inhoud van alle inputs en de settings
+        """
+        sha = hashlib.sha256()
+        input_hashes = dict()
+        for file_name in sorted(set(Path(f).as_posix() for f in inputs)):
+            input_hashes[file_name] = self.file_hash(file_name)
+            sha.update(file_name.encode("utf-8"))
+            sha.update(b"\0")
+            sha.update(input_hashes[file_name].encode("ascii"))
+            sha.update(b"\0")
+        sha.update(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+        fingerprint = sha.hexdigest()
+        with self._lock:
+            self._fingerprint_inputs[fingerprint] = input_hashes
+        return fingerprint
+
+    def changed_inputs(self, stage, fingerprint):
+        """
+        Geef de inputs die veranderd zijn sinds de laatste succesvolle run van een stage
+
+        Args:
+            stage: str
+                Naam van de stage
+            fingerprint: str
+                De huidige fingerprint van de stage
+
+        Returns: list
+            De gewijzigde, nieuwe en verdwenen input files. Als er geen file veranderd is, maar de
+            fingerprint wel, is '(settings)' de reden, en bij de eerste run '(no previous run)'
+        """
+        with self._lock:
+            previous = self._stage_inputs.get(stage)
+            current = self._fingerprint_inputs.get(fingerprint, dict())
+        if previous is None:
+            return ["(no previous run)"]
+        changed = sorted(file_name for file_name in set(previous) | set(current)
+                         if previous.get(file_name) != current.get(file_name))
+        if not changed:
+            with self._lock:
+                settings_changed = self._stages.get(stage) != fingerprint
+            changed = ["(settings)"] if settings_changed else ["(missing output)"]
+        return changed
+
+    def add_trigger(self, stage, reason):
+        """
+        Leg vast waarom een stage opnieuw gedraaid heeft, voor de build history
+
+        Args:
+            stage: str
+                Naam van de stage
+            reason: str or Path
+                De input file die veranderd is, of een andere reden
+        """
+        with self._lock:
+            self.triggers[stage].add(Path(reason).as_posix() if isinstance(reason, Path)
+                                     else str(reason))
+
+    def is_up_to_date(self, stage, fingerprint, outputs=()):
+        """
+        Kijk of een stage overgeslagen kan worden
+
+        Args:
+            stage: str
+                Naam van de stage
+            fingerprint: str
+                De huidige fingerprint van de stage, zie :meth:`fingerprint`
+            outputs: list
+                Files die de stage maakt. Als een van deze files niet bestaat, is de stage niet
+                up to date
+
+        Returns: bool
+            True als de stage niet opnieuw gedraaid hoeft te worden
+        """
+        with self._lock:
+            previous = self._stages.get(stage)
+            self.outputs[stage].update(Path(f).as_posix() for f in outputs)
+        up_to_date = previous == fingerprint and all(Path(f).exists() for f in outputs)
+        self.register(stage, up_to_date)
+        if not up_to_date:
+            for reason in self.changed_inputs(stage, fingerprint):
+                self.add_trigger(stage, reason)
+        return up_to_date
+
+    def register(self, stage, hit):
+        """
+        Tel een hit of miss voor een stage die zijn eigen cache bijhoudt
+
+        Args:
+            stage: str
+                Naam van de stage
+            hit: bool
+                True als het resultaat uit de cache gehaald kon worden
+        """
+        with self._lock:
+            if hit:
+                self.hits[stage] += 1
+            else:
+                self.misses[stage] += 1
+        _logger.debug(f"Build cache {'hit' if hit else 'miss'} for {stage}")
+
+    def update(self, stage, fingerprint):
+        """
+        Sla de fingerprint van een stage op nadat die succesvol gedraaid heeft
+
+        Args:
+            stage: str
+                Naam van de stage
+            fingerprint: str
+                De fingerprint waarmee de stage gedraaid heeft
+        """
+        if self.read_only:
+            return
+        with self._lock:
+            self._stages[stage] = fingerprint
+            if fingerprint in self._fingerprint_inputs:
+                self._stage_inputs[stage] = self._fingerprint_inputs[fingerprint]
+            self.save()
+
+    def reset_statistics(self):
+        """Begin opnieuw met tellen, bijvoorbeeld voor een nieuwe rebuild in --watch"""
+        with self._lock:
+            self.hits.clear()
+            self.misses.clear()
+            self.triggers.clear()
+            self.outputs.clear()
+
+    def report_statistics(self):
+        """Print het aantal hits en misses per stage"""
+        stages = sorted(set(self.hits) | set(self.misses))
+        message = "{:40s} {:>6} {:>6}"
+        print(message.format("Build cache stage", "hits", "misses"))
+        for stage in stages:
+            print(message.format(stage, self.hits[stage], self.misses[stage]))
+        print(message.format("total", sum(self.hits.values()), sum(self.misses.values())))
@@ -0,0 +1,393 @@
+"""
+Split a LaTeX document in parts which can be converted by latexml separately
+
+The body of the main file is split at every top-level ``\\include`` or ``\\input`` line. Each
+chapter becomes a fragment which is converted by latexml with the preamble of the main file, and
+the resulting xml documents are assembled into one document for latexmlpost.
+
+Every fragment starts with the chapter number. A part which continues a chapter also starts with
+the counters of :data:`SEEDED_COUNTERS` as they are at its start, counted in the tex code, so
+numbers and ``xml:id`` values continue over the parts, and its xml is placed inside that chapter
+when the parts are assembled. ``\\ref`` and ``\\cite`` are resolved by latexmlpost in the
+assembled document. Counters which are not in :data:`SEEDED_COUNTERS`, such as those of theorems
+or custom environments, restart in every part, which is why ``latexml_per_chapter`` is an option.
+"""
+
+import hashlib
+import logging
+import re
+import xml.etree.ElementTree as ET
+
+from latexmlsuite.tex_dependencies import strip_comments
+
+LATEXML_NAMESPACE = "http://dlmf.nist.gov/LaTeXML"
+
+BEGIN_DOCUMENT_PATTERN = re.compile(r"\\begin\s*\{document\}")
+END_DOCUMENT_PATTERN = re.compile(r"\\end\s*\{document\}")
+INCLUDE_LINE_PATTERN = re.compile(r"^[ \t]*\\(?:include|input)\s*\{[^}]*\}[ \t]*(?:%.*)?$",
+                                  re.MULTILINE)
+INCLUDE_NAME_PATTERN = re.compile(r"\\(?:include|input)\s*\{([^}]*)\}")
+CHAPTER_PATTERN = re.compile(r"\\chapter(?![A-Za-z@*])")
+SECTION_PATTERN = re.compile(r"\\(?:chapter|(?:sub)*section)\*?\s*(?:\[[^\]]*\])?\s*\{([^}]*)\}")
+LABEL_PATTERN = re.compile(r"\\label\s*\{([^}]*)\}")
+APPENDIX_PATTERN = re.compile(r"\\appendix(?![A-Za-z@])")
+# de tellers die binnen een hoofdstuk doorlopen en die ieder deel van zijn voorganger overneemt
+SEEDED_COUNTERS = dict(
+    section=re.compile(r"\\section(?![A-Za-z@*])"),
+    equation=re.compile(r"\\begin\s*\{equation\}"),
+    figure=re.compile(r"\\begin\s*\{figure\}"),
+    table=re.compile(r"\\begin\s*\{table\}"),
+    footnote=re.compile(r"\\footnote(?![A-Za-z@])"),
+)
+
+# deze elementen maakt latexml in elk deel opnieuw aan vanuit de preamble. We nemen ze alleen
+# over uit het eerste deel
+PAGE_TAGS = ("chapter", "appendix")
+# deze elementen staan naast de hoofdstukken, ook als ze na een hoofdstuk komen
+DOCUMENT_LEVEL_TAGS = ("bibliography", "index", "glossary", "part")
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+# onder deze naam staat de hash van alles buiten de hoofdstukken
+DOCUMENT_FRAGMENT = "document"
+FRONTMATTER_TAGS = ("resource", "title", "toctitle", "subtitle", "creator", "date", "keywords",
+                    "classification", "acknowledgements", "abstract")
+
+_logger = logging.getLogger(__name__)
+
+
+class DocumentPart:
+    """
+    Een deel van de body van het document dat apart geconverteerd wordt
+
+    Args:
+        index: int
+            Volgnummer van het deel in het document
+        text: str
+            De tex code van het deel
+    """
+
+    def __init__(self, index, text):
+        self.index = index
+        self.text = text
+        # wordt ingevuld zodra we weten hoeveel hoofdstukken er voor dit deel staan
+        self.chapters_before = 0
+        self.after_appendix = False
+        # de stand van de tellers van SEEDED_COUNTERS aan het begin van het deel
+        self.counters = dict()
+
+    @property
+    def name(self):
+        return f"part_{self.index:03d}"
+
+    @property
+    def is_empty(self):
+        return strip_comments(self.text).strip() == ""
+
+    def fragment(self):
+        """
+        Geef de tex code van het deel met de tellers zoals die aan het begin van het deel staan
+
+        Returns: str
+            De tex code die aan latexml gegeven wordt
+        """
+        prefix = []
+        if self.after_appendix:
+            prefix.append("\\appendix")
+        prefix.append(f"\\setcounter{{chapter}}{{{self.chapters_before}}}")
+        for name, value in sorted(self.counters.items()):
+            if value:
+                prefix.append(f"\\setcounter{{{name}}}{{{value}}}")
+        return "\n".join(prefix) + "\n" + self.text
+
+    def page_names(self, n_chapters):
+        """
+        De namen van de pagina's die latexmlpost met --splitat chapter van dit deel maakt
+
+        Args:
+            n_chapters: int
+                Het aantal hoofdstukken in dit deel
+
+        Returns: list
+            Namen zoals 'Ch3' of, na \\appendix, 'A1'
+        """
+        prefix = "A" if self.after_appendix else "Ch"
+        return [f"{prefix}{self.chapters_before + number}" for number in range(1, n_chapters + 1)]
+
+
+def split_document(tex_content):
+    """
+    Splits een tex document in preamble, losse delen en postamble
+
+    Args:
+        tex_content: str
+            De inhoud van de main file
+
+    Returns: tuple
+        (preamble, parts, postamble). De preamble eindigt met \\begin{document} en de postamble
+        begint met \\end{document}. Als het document niet gesplitst kan worden, is parts None
+    """
+    begin = BEGIN_DOCUMENT_PATTERN.search(tex_content)
+    end = END_DOCUMENT_PATTERN.search(tex_content)
+    if begin is None or end is None or end.start() < begin.end():
+        return tex_content, None, ""
+    preamble = tex_content[:begin.end()] + "\n"
+    postamble = tex_content[end.start():]
+    body = tex_content[begin.end():end.start()]
+
+    texts = []
+    position = 0
+    for match in INCLUDE_LINE_PATTERN.finditer(body):
+        texts.append(body[position:match.start()])
+        texts.append(match.group(0))
+        position = match.end()
+    texts.append(body[position:])
+
+    parts = []
+    for text in texts:
+        part = DocumentPart(index=len(parts), text=text)
+        if not part.is_empty:
+            parts.append(part)
+    return preamble, parts, postamble
+
+
+def restrict_to_chapters(tex_content, selectors):
+    """
+    Beperk een document tot een paar hoofdstukken met \\includeonly
+
+    \\includeonly werkt alleen voor files die met \\include ingelezen worden, dus de \\input
+    regels in de body worden eerst \\include regels.
+
+    Args:
+        tex_content: str
+            De inhoud van de main file
+        selectors: list
+            Stukken van de namen van de hoofdstukken die gemaakt worden, zoals '02' of
+            'sections/03_conclusies'
+
+    Returns: tuple
+        (nieuwe inhoud, namen van alle ingelezen files, namen van de gekozen files). Als geen
+        enkel hoofdstuk gekozen is, komt de inhoud ongewijzigd terug
+    """
+    begin = BEGIN_DOCUMENT_PATTERN.search(tex_content)
+    if begin is None:
+        return tex_content, [], []
+    names = []
+
+    def to_include(match):
+        name = include_name(match.group(0))
+        names.append(name)
+        indent = match.group(0)[:len(match.group(0)) - len(match.group(0).lstrip())]
+        return f"{indent}\\include{{{name}}}"
+
+    body = INCLUDE_LINE_PATTERN.sub(to_include, tex_content[begin.start():])
+    selected = [name for name in names
+                if any(str(selector) in name for selector in selectors)]
+    if not selected:
+        return tex_content, names, []
+    preamble = tex_content[:begin.start()] + f"\\includeonly{{{','.join(selected)}}}\n"
+    return preamble + body, names, selected
+
+
+def include_name(part_text):
+    """
+    Geef de naam van de file die een \\include of \\input regel inleest, zonder .tex
+
+    Returns: str or None
+        De naam, of None als de tekst geen \\include of \\input regel is
+    """
+    if INCLUDE_LINE_PATTERN.fullmatch(part_text.strip("\n")) is None:
+        return None
+    name = INCLUDE_NAME_PATTERN.search(part_text).group(1).strip()
+    if name.endswith(".tex"):
+        name = name[:-len(".tex")]
+    return name
+
+
+def section_names(tex_content):
+    """
+    Geef de titels en labels van de (sub)secties en hoofdstukken in een tex string
+
+    Returns: list
+        De titels van de \\chapter, \\section en \\subsection commando's en alle labels
+    """
+    tex_content = strip_comments(tex_content)
+    return SECTION_PATTERN.findall(tex_content) + LABEL_PATTERN.findall(tex_content)
+
+
+def count_chapters(tex_content):
+    """Tel het aantal genummerde hoofdstukken in een tex string"""
+    return len(CHAPTER_PATTERN.findall(strip_comments(tex_content)))
+
+
+def advance_counters(counters, tex_content):
+    """
+    Tel de tellers van :data:`SEEDED_COUNTERS` op met de tex code van een deel
+
+    Een \\chapter zet de tellers op nul, net als in de classes met hoofdstukken
+
+    Args:
+        counters: dict
+            De tellers aan het begin van de tex code
+        tex_content: str
+            De tex code
+
+    Returns: dict
+        De tellers aan het einde van de tex code
+    """
+    tex_content = strip_comments(tex_content)
+    chapters = list(CHAPTER_PATTERN.finditer(tex_content))
+    if chapters:
+        counters = dict()
+        tex_content = tex_content[chapters[-1].end():]
+    counters = {name: counters.get(name, 0) + len(pattern.findall(tex_content))
+                for name, pattern in SEEDED_COUNTERS.items()}
+    return counters
+
+
+def continues_chapter(tex_content):
+    """Kijk of een deel voor zijn eerste \\chapter al iets heeft dat een van de tellers ophoogt"""
+    tex_content = strip_comments(tex_content)
+    first_chapter = CHAPTER_PATTERN.search(tex_content)
+    if first_chapter is not None:
+        tex_content = tex_content[:first_chapter.start()]
+    return any(pattern.search(tex_content) for pattern in SEEDED_COUNTERS.values())
+
+
+def contains_appendix(tex_content):
+    """Kijk of er een \\appendix commando in een tex string staat"""
+    return APPENDIX_PATTERN.search(strip_comments(tex_content)) is not None
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _prolog(xml_content):
+    # alles voor het root element, zoals de latexml processing instructions, nemen we letterlijk
+    # over omdat ElementTree die niet bewaart
+    root_match = re.search(r"<(?:\w+:)?document\b", xml_content)
+    return xml_content[:root_match.start()] if root_match is not None else ""
+
+
+def _register_namespaces(xml_file):
+    for _, (prefix, uri) in ET.iterparse(xml_file, events=("start-ns",)):
+        if prefix != "xml":
+            ET.register_namespace(prefix, uri)
+
+
+def assemble_document(part_xml_files, xml_file):
+    """
+    Voeg de xml documenten van alle delen samen tot één document
+
+    De processing instructions en de frontmatter worden uit het eerste deel genomen. Van de
+    overige delen worden alleen de elementen in de body overgenomen. De elementen aan het begin
+    van een deel dat een hoofdstuk voortzet, komen in het laatste hoofdstuk of de laatste
+    appendix.
+
+    Args:
+        part_xml_files: list
+            De xml files van de delen, in de volgorde van het document
+        xml_file: Path
+            De xml file die geschreven wordt
+    """
+    with open(part_xml_files[0], "r", encoding="utf-8") as stream:
+        prolog = _prolog(stream.read())
+
+    for part_xml_file in part_xml_files:
+        _register_namespaces(part_xml_file)
+
+    document = ET.parse(part_xml_files[0]).getroot()
+    for part_xml_file in part_xml_files[1:]:
+        part_root = ET.parse(part_xml_file).getroot()
+        last_page = document[-1] if len(document) and \
+            _local_name(document[-1].tag) in PAGE_TAGS else None
+        for element in part_root:
+            tag = _local_name(element.tag)
+            if tag in FRONTMATTER_TAGS:
+                continue
+            if tag in PAGE_TAGS or tag in DOCUMENT_LEVEL_TAGS:
+                last_page = None
+            (last_page if last_page is not None else document).append(element)
+
+    with open(xml_file, "w", encoding="utf-8") as stream:
+        stream.write(prolog)
+        stream.write(ET.tostring(document, encoding="unicode"))
+        stream.write("\n")
+
+
+def fragment_hashes(xml_file):
+    """
+    Bereken een hash van de xml van ieder hoofdstuk en appendix van het document
+
+    latexmlpost maakt met --splitat chapter een pagina per hoofdstuk. De hash van een hoofdstuk
+    verandert alleen als de xml van dat hoofdstuk verandert. Alles buiten de hoofdstukken, zoals
+    de titel, de frontmatter en de bibliografie, krijgt samen één hash.
+
+    Args:
+        xml_file: Path
+            De xml file van het hele document
+
+    Returns: dict
+        Per xml:id van een hoofdstuk, zoals 'Ch3' of 'A1', en voor 'document' de sha256 hash
+    """
+    document = ET.parse(xml_file).getroot()
+    hashes = dict()
+    rest = hashlib.sha256()
+    rest.update(repr(sorted(document.attrib.items())).encode("utf-8"))
+    for index, element in enumerate(document):
+        content = ET.tostring(element, encoding="utf-8")
+        tag = _local_name(element.tag)
+        if tag in PAGE_TAGS:
+            name = element.get(XML_ID, f"{tag}{index}")
+            hashes[name] = hashlib.sha256(content).hexdigest()
+        else:
+            rest.update(content)
+    hashes[DOCUMENT_FRAGMENT] = rest.hexdigest()
+    return hashes
+
+
+def shard_document(xml_file, shard_directory):
+    """
+    Splits de xml van het document in een shard per hoofdstuk en een shard met de rest
+
+    Iedere shard is een volledig document met de processing instructions en de frontmatter van
+    het document, zodat latexmlpost er apart de pagina's van kan maken.
+
+    Args:
+        xml_file: Path
+            De xml file van het hele document
+        shard_directory: Path
+            De directory waarin de shards geschreven worden
+
+    Returns: list
+        Tuples (naam, xml file): eerst de rest van het document onder de naam 'document', dan
+        de hoofdstukken onder hun xml:id, zoals 'Ch3' of 'A1'
+    """
+    with open(xml_file, "r", encoding="utf-8") as stream:
+        prolog = _prolog(stream.read())
+    _register_namespaces(xml_file)
+    document = ET.parse(xml_file).getroot()
+
+    rest = []
+    chapters = []
+    for index, element in enumerate(document):
+        tag = _local_name(element.tag)
+        if tag in PAGE_TAGS:
+            chapters.append((element.get(XML_ID, f"{tag}{index}"), [element]))
+        else:
+            rest.append(element)
+    frontmatter = [element for element in rest if _local_name(element.tag) in FRONTMATTER_TAGS]
+
+    shard_directory.mkdir(parents=True, exist_ok=True)
+    shards = []
+    for name, elements in [(DOCUMENT_FRAGMENT, rest)] + chapters:
+        if name != DOCUMENT_FRAGMENT:
+            elements = frontmatter + elements
+        shard = ET.Element(document.tag, document.attrib)
+        shard.extend(elements)
+        shard_file = shard_directory / (name + ".xml")
+        with open(shard_file, "w", encoding="utf-8") as stream:
+            stream.write(prolog)
+            stream.write(ET.tostring(shard, encoding="unicode"))
+            stream.write("\n")
+        shards.append((name, shard_file))
+    return shards
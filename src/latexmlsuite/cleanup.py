@@ -0,0 +1,95 @@
+"""
+Remove files matching sets of patterns without starting rm or Remove-Item
+
+The files are removed while the directories are scanned, so no list of files has to be passed on
+a command line. A pattern set maps directories to file name patterns, for instance::
+
+    css:
+      ccn/html: ["*.css"]
+    log:
+      .: ["*.aux", "*.log"]
+      out_html: ["*.aux", "*.log"]
+"""
+
+import fnmatch
+import logging
+import os
+from pathlib import Path
+
+# in de directory van het rapport kunnen ook files van de auteur staan, zoals een eigen .bbl
+LOG_PATTERNS = ["*.aux", "*.log", "*.fls", "*.xdv"]
+# in de output directories staan alleen files die latexmk en latexml maken
+OUTPUT_LOG_PATTERNS = LOG_PATTERNS + ["*.fdb_latexmk", "*.out", "*.toc", "*.bbl", "*.blg",
+                                      "*.bcf", "*.run.xml", "*.synctex.gz"]
+
+_logger = logging.getLogger(__name__)
+
+
+def iter_matching_files(directory, patterns, recursive=False):
+    """
+    Loop over alle files in een directory die aan een van de patronen voldoen
+
+    Args:
+        directory: str or Path
+            De directory die gescand wordt
+        patterns: list
+            Patronen voor de file namen, zoals '*.css'
+        recursive: bool
+            Scan ook de subdirectories
+
+    Yields: Path
+        De gevonden files
+    """
+    to_scan = [Path(directory)]
+    while to_scan:
+        scan_directory = to_scan.pop()
+        try:
+            with os.scandir(scan_directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            to_scan.append(Path(entry.path))
+                    elif any(fnmatch.fnmatch(entry.name, pattern) for pattern in patterns):
+                        yield Path(entry.path)
+        except FileNotFoundError:
+            _logger.debug(f"Directory {scan_directory} does not exist")
+
+
+def remove_files(pattern_set, keep=None, test=False, recursive=False):
+    """
+    Verwijder alle files uit een pattern set
+
+    Args:
+        pattern_set: dict
+            Per directory een lijst met patronen
+        keep: set or None
+            Files die niet verwijderd worden, ook als ze aan een patroon voldoen
+        test: bool
+            Laat alleen zien welke files verwijderd zouden worden
+        recursive: bool
+            Zoek ook in de subdirectories
+
+    Returns: list
+        De verwijderde files
+    """
+    if keep is None:
+        keep = set()
+    keep = set(Path(file_name).absolute() for file_name in keep)
+    removed = list()
+    for directory, patterns in pattern_set.items():
+        for file_name in iter_matching_files(directory, patterns, recursive=recursive):
+            if file_name.absolute() in keep:
+                continue
+            print(f"rm {file_name.as_posix()}")
+            if not test:
+                try:
+                    file_name.unlink()
+                except FileNotFoundError:
+                    continue
+                except OSError as err:
+                    _logger.warning(f"Could not remove {file_name}: {err}")
+                    continue
+            removed.append(file_name)
+    if not removed:
+        _logger.debug(f"No files found matching {pattern_set}")
+    return removed
@@ -0,0 +1,256 @@
+"""
+Draft and partial builds of the pdf
+
+``--mode draft`` makes a pdf in one xelatex pass in its own directory, without graphs and tables
+and with frames instead of pictures. ``--only_chapters`` and ``--only_sections`` make a partial
+build of a few chapters with ``\\includeonly``, which takes the references to the other chapters
+from the aux file of the last full build. The stages are methods of
+:class:`latexmlsuite.main_suite.LaTeXMLSuite` through :class:`DraftStages`.
+"""
+
+import logging
+import re
+from pathlib import Path
+
+from latexmlsuite.chapters import (LABEL_PATTERN, contains_appendix, count_chapters,
+                                   include_name, restrict_to_chapters, section_names,
+                                   split_document)
+from latexmlsuite.tex_dependencies import resolve_reference
+from latexmlsuite.tracing import traced_stage
+from latexmlsuite.utils import write_file_if_changed
+
+DRAFT_CLASS_OPTIONS = "draft,nographs,notables"
+PARTIAL_DIRECTORY_NAME = "partial"
+AUX_LABEL_PATTERN = re.compile(r"^\\(?:newlabel|bibcite)\{([^}@]*)")
+
+_logger = logging.getLogger(__name__)
+
+
+def copy_main_for_draft(tex_input_file: Path, tex_output_file: Path, chapters=None):
+    """
+    Schrijf de main file voor een draft pdf: zonder grafieken en tabellen en met draft plaatjes
+
+    Args:
+        tex_input_file: Path
+            De main file van het rapport
+        tex_output_file: Path
+            De main file in de draft directory
+        chapters: list or None
+            Maak alleen de hoofdstukken waarvan de naam een van deze stukken bevat
+
+    Returns: list
+        De namen van alle files die met \\include ingelezen worden
+    """
+    tex_content, included = draft_main_content(tex_input_file, chapters=chapters)
+    write_file_if_changed(tex_output_file, tex_content)
+    return included
+
+
+def draft_main_content(tex_input_file: Path, chapters=None):
+    """
+    Geef de inhoud van de main file voor een draft pdf, zie :func:`copy_main_for_draft`
+
+    Returns: tuple
+        De inhoud en de namen van alle files die met \\include ingelezen worden
+    """
+    with open(tex_input_file, "r") as in_stream:
+        tex_content = in_stream.read()
+
+    cbsdocs = "]{cbsdocs}"
+    tex_content = re.sub(cbsdocs, "," + DRAFT_CLASS_OPTIONS + cbsdocs, tex_content)
+    included = []
+    if chapters:
+        tex_content, included, selected = restrict_to_chapters(tex_content, chapters)
+        if not selected:
+            _logger.warning(f"No chapter matches {', '.join(chapters)}; making all chapters")
+            included = []
+    return tex_content, included
+
+
+class DraftStages:
+    """
+    De stages van :class:`latexmlsuite.main_suite.LaTeXMLSuite` voor een draft en een
+    gedeeltelijke build. Gebruikt de instellingen en de build cache van de suite
+    """
+
+    @traced_stage
+    def select_partial_chapters(self):
+        """
+        Bepaal de hoofdstukken en de html pagina's van een gedeeltelijke build
+
+        Een hoofdstuk is een file die in de body van de main file met \\include of \\input
+        ingelezen wordt. Het is gekozen als zijn naam een van de only_chapters bevat, of als een
+        titel, label of file naam van een van zijn secties een van de only_sections bevat. Als
+        niets gekozen is, wordt het hele document gemaakt.
+        """
+        with open(self.main_file_name, "r") as stream:
+            _, parts, _ = split_document(stream.read())
+        self.partial_chapters = []
+        self.partial_pages = set()
+        n_chapters = 0
+        after_appendix = False
+        for part in parts or []:
+            if contains_appendix(part.text):
+                after_appendix = True
+                n_chapters = 0
+            part.chapters_before = n_chapters
+            part.after_appendix = after_appendix
+            name = include_name(part.text)
+            files = self.chapter_files(name) if name is not None else []
+            contents = [part.text]
+            for tex_file in files:
+                if tex_file.suffix == ".tex":
+                    with open(tex_file, "r", errors="replace") as stream:
+                        contents.append(stream.read())
+            n_part_chapters = sum(count_chapters(content) for content in contents)
+            n_chapters += n_part_chapters
+            if name is None:
+                continue
+
+            candidates = [tex_file.as_posix() for tex_file in files]
+            for content in contents:
+                candidates.extend(section_names(content))
+            if any(selector in name for selector in self.only_chapters or []) or \
+                    any(selector.lower() in candidate.lower() for selector in
+                        self.only_sections or [] for candidate in candidates):
+                self.partial_chapters.append(name)
+                self.partial_pages.update(part.page_names(n_part_chapters))
+
+        if not self.partial_chapters:
+            selectors = (self.only_chapters or []) + (self.only_sections or [])
+            _logger.warning(f"No chapter matches {', '.join(selectors)}; building the whole "
+                            f"document")
+            self.partial = False
+            return
+        if self.merge_chapters:
+            # er is maar één pagina, met het hele document
+            self.partial_pages = {self.main_file_name.stem}
+        print(f"Partial build of {', '.join(self.partial_chapters)}; updating the pages "
+              f"{', '.join(sorted(self.partial_pages))}")
+
+    def chapter_files(self, name):
+        """De tex file van een hoofdstuk en alle files die erin ingelezen worden"""
+        tex_file = resolve_reference("input", name, [Path(".")])
+        if tex_file is None:
+            return []
+        return self.dependency_scanner.dependencies(tex_file)
+
+    @traced_stage
+    def launch_draft(self):
+        """
+        Maak in één xelatex pass een draft pdf in de draft directory
+
+        De draft heeft geen grafieken en tabellen, plaatjes worden als kader getoond en met
+        draft_chapters worden alleen de gekozen hoofdstukken gezet. Referenties naar de andere
+        hoofdstukken komen uit de aux files van een eerdere draft, als die er zijn. De ccn
+        directory en de andere output directories worden niet aangeraakt. Met test wordt
+        alleen het commando getoond.
+        """
+        draft_dir = self.output_directory_draft
+        main_file = draft_dir / Path(self.main_file_name)
+        tex_file = main_file.with_suffix(".tex")
+        if not self.test:
+            draft_dir.mkdir(parents=True, exist_ok=True)
+            included = copy_main_for_draft(tex_input_file=self.main_file_name,
+                                           tex_output_file=tex_file, chapters=self.draft_chapters)
+            # xelatex schrijft een aux file per ingelezen file, in dezelfde subdirectory
+            for name in included:
+                (draft_dir / Path(name)).parent.mkdir(parents=True, exist_ok=True)
+
+        cmd = []
+        if self.test:
+            cmd.append("echo")
+        cmd += ["xelatex", "-shell-escape", "-interaction=nonstopmode",
+                f"-output-directory={draft_dir.as_posix()}"]
+        if self.preamble_format is not None:
+            format_file = self.preamble_format.ensure(tex_file, execute=self.execute)
+            if format_file is not None:
+                cmd.append(f"-fmt={format_file.absolute().as_posix()}")
+        cmd.append(tex_file.as_posix())
+
+        pdf_file = main_file.with_suffix(".pdf")
+        fingerprint = self.build_cache.fingerprint(
+            inputs=self.dependency_scanner.dependencies(tex_file), settings=dict(cmd=cmd))
+        if self.build_cache.is_up_to_date("xelatex_draft", fingerprint, outputs=[pdf_file]):
+            print(f"Draft {pdf_file} is up to date")
+            return
+        result = self.execute(command=cmd, stage="xelatex_draft")
+        if result.returncode == 0 and not self.test:
+            self.build_cache.update("xelatex_draft", fingerprint)
+        print(f"Draft pdf: {pdf_file}")
+
+    @traced_stage
+    def launch_latexmk_partial(self):
+        """
+        Maak met \\includeonly een pdf van alleen de gekozen hoofdstukken
+
+        De pdf komt in de partial directory van de output directory en wordt niet naar ccn
+        gekopieerd. De referenties naar de andere hoofdstukken komen uit de aux file van de
+        laatste volledige build, zie :meth:`partial_aux_files`. Met test wordt alleen het
+        commando getoond.
+        """
+        partial_dir = self.output_directory_partial
+        tex_file = (partial_dir / Path(self.main_file_name)).with_suffix(".tex")
+        with open(self.main_file_name, "r") as stream:
+            tex_content, included, selected = restrict_to_chapters(stream.read(),
+                                                                   self.partial_chapters)
+        if not self.test:
+            partial_dir.mkdir(parents=True, exist_ok=True)
+            write_file_if_changed(tex_file, tex_content)
+            # xelatex schrijft een aux file per ingelezen file, in dezelfde subdirectory
+            for name in included:
+                (partial_dir / Path(name)).parent.mkdir(parents=True, exist_ok=True)
+            for aux_file, content in self.partial_aux_files(included, selected).items():
+                write_file_if_changed(aux_file, content)
+
+        cmd = []
+        if self.test:
+            cmd.append("echo")
+        cmd += ["latexmk", f"-output-directory={partial_dir.as_posix()}", tex_file.as_posix(),
+                "-xelatex", "-shell-escape"]
+        self.execute_latexmk(command=cmd, stage="latexmk_partial", tex_file=tex_file,
+                             watch_line=self.latexmk_pass_watcher())
+        print(f"Partial pdf: {tex_file.with_suffix('.pdf')}")
+
+    def partial_aux_files(self, included, selected):
+        """
+        Geef de aux files van de weggelaten hoofdstukken met de labels van de laatste volledige
+        build
+
+        Bij \\includeonly leest latex de labels van de weggelaten hoofdstukken uit hun eigen aux
+        files. De labels die de gekozen hoofdstukken zelf definiëren, laten we weg, zodat die
+        niet dubbel gedefinieerd zijn.
+
+        Args:
+            included: list
+                De namen van alle files die met \\include ingelezen worden
+            selected: list
+                De namen van de gekozen files
+
+        Returns: dict
+            Per aux file in de partial directory de inhoud
+        """
+        excluded = [name for name in included if name not in selected]
+        full_aux = self.output_directory / Path(self.main_file_name.stem + ".aux")
+        if not excluded:
+            return dict()
+        if not full_aux.exists():
+            _logger.warning(f"No {full_aux} of a full build; references to the other chapters "
+                            f"are not resolved in the partial pdf")
+            return dict()
+        own_labels = set()
+        for name in selected:
+            for tex_file in self.chapter_files(name):
+                if tex_file.suffix == ".tex":
+                    with open(tex_file, "r", errors="replace") as stream:
+                        own_labels.update(LABEL_PATTERN.findall(stream.read()))
+        lines = []
+        with open(full_aux, "r", errors="replace") as stream:
+            for line in stream:
+                match = AUX_LABEL_PATTERN.match(line)
+                if match is not None and match.group(1) not in own_labels:
+                    lines.append(line)
+        # de labels hoeven maar in één aux file te staan
+        return {self.output_directory_partial / Path(name + ".aux"):
+                "\\relax\n" + ("".join(lines) if index == 0 else "")
+                for index, name in enumerate(excluded)}
@@ -0,0 +1,271 @@
+"""
+Keep the history of all runs in a SQLite database in the cache directory
+
+At the end of every run the stages and commands recorded by the tracer are stored together with
+their duration, exit status and cache hits, the inputs which made a stage run again and the
+outputs of the stages. ``latex2ccn stats`` summarises the database: the slowest stages and
+commands, the trend of the last runs and the inputs which triggered most rebuilds, so it becomes
+clear which figure directory or chapter dominates the build time.
+"""
+
+import argparse
+import datetime
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+HISTORY_FILE_NAME = "history.sqlite"
+DEFAULT_LAST_RUNS = 10
+DEFAULT_TOP = 15
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started TEXT NOT NULL,
+    mode TEXT,
+    wall_time REAL,
+    success INTEGER,
+    cache_hits INTEGER,
+    cache_misses INTEGER
+);
+CREATE TABLE IF NOT EXISTS events (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    start REAL,
+    duration REAL,
+    exit_status INTEGER,
+    cpu_time REAL,
+    max_rss_kb INTEGER,
+    cache_hits INTEGER,
+    cache_misses INTEGER
+);
+CREATE TABLE IF NOT EXISTS triggers (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    stage TEXT NOT NULL,
+    input TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    stage TEXT NOT NULL,
+    file TEXT NOT NULL,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_run ON events(run_id);
+CREATE INDEX IF NOT EXISTS triggers_run ON triggers(run_id);
+"""
+
+_logger = logging.getLogger(__name__)
+
+
+def _exit_status(value):
+    """De exit status van een event als integer; bij htmlcleaner is dat een bool"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 0 if value else 1
+    return int(value)
+
+
+class BuildHistory:
+    """
+    De database met de history van alle runs
+
+    Args:
+        database_file: str or Path
+            De SQLite file, normaal ``history.sqlite`` in de cache directory
+    """
+
+    def __init__(self, database_file):
+        self.database_file = Path(database_file)
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def connect(self):
+        if self._connection is None:
+            self.database_file.parent.mkdir(parents=True, exist_ok=True)
+            # een andere run kan tegelijk schrijven; dan even wachten
+            self._connection = sqlite3.connect(self.database_file, timeout=30,
+                                               check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def record_run(self, tracer, build_cache, mode=None, success=True, wall_time=None,
+                   outputs=None):
+        """
+        Sla een run op
+
+        Args:
+            tracer: Tracer
+                De tracer met alle stages en commando's van de run
+            build_cache: BuildCache
+                De build cache met de hits, misses, triggers en outputs van de run
+            mode: str or None
+                De mode van de run
+            success: bool
+                False als de run met een fout gestopt is
+            wall_time: float or None
+                De duur van de run in seconden
+            outputs: dict or None
+                Extra outputs per stage, zoals de html pagina's
+
+        Returns: int
+            Het id van de run
+        """
+        events = sorted(tracer.events, key=lambda event: event["ts"])
+        all_outputs = {stage: set(files) for stage, files in build_cache.outputs.items()}
+        for stage, files in (outputs or dict()).items():
+            all_outputs.setdefault(stage, set()).update(Path(f).as_posix() for f in files)
+
+        with self._lock:
+            connection = self.connect()
+            with connection:
+                cursor = connection.execute(
+                    "INSERT INTO runs (started, mode, wall_time, success, cache_hits, "
+                    "cache_misses) VALUES (?, ?, ?, ?, ?, ?)",
+                    (datetime.datetime.now().isoformat(timespec="seconds"), mode, wall_time,
+                     int(success), sum(build_cache.hits.values()),
+                     sum(build_cache.misses.values())))
+                run_id = cursor.lastrowid
+                connection.executemany(
+                    "INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(run_id, event["cat"], event["name"], event["ts"] / 1e6,
+                      event["dur"] / 1e6, _exit_status(event["args"].get("exit_status")),
+                      event["args"].get("cpu_time"), event["args"].get("max_rss_kb"),
+                      event["args"].get("cache_hits", 0), event["args"].get("cache_misses", 0))
+                     for event in events])
+                connection.executemany(
+                    "INSERT INTO triggers VALUES (?, ?, ?)",
+                    [(run_id, stage, reason) for stage, reasons in build_cache.triggers.items()
+                     for reason in sorted(reasons)])
+                rows = []
+                for stage, files in all_outputs.items():
+                    for file_name in sorted(files):
+                        try:
+                            size = Path(file_name).stat().st_size
+                        except OSError:
+                            size = None
+                        rows.append((run_id, stage, file_name, size))
+                connection.executemany("INSERT INTO outputs VALUES (?, ?, ?, ?)", rows)
+        _logger.debug(f"Recorded run {run_id} in {self.database_file}")
+        return run_id
+
+    def last_run_ids(self, n_runs=DEFAULT_LAST_RUNS):
+        cursor = self.connect().execute("SELECT id FROM runs ORDER BY id DESC LIMIT ?",
+                                        (n_runs,))
+        return [row[0] for row in cursor]
+
+    def slowest(self, n_runs=DEFAULT_LAST_RUNS, top=DEFAULT_TOP, category=None):
+        """
+        De stages en commando's met de grootste totale duur in de laatste runs
+
+        Returns: list
+            Tuples (category, name, aantal, gemiddelde duur, maximale duur, totale duur)
+        """
+        run_ids = self.last_run_ids(n_runs)
+        if not run_ids:
+            return []
+        query = ("SELECT category, name, COUNT(*), AVG(duration), MAX(duration), SUM(duration) "
+                 "FROM events WHERE run_id >= ? AND name NOT IN ('run', 'rebuild')")
+        parameters = [min(run_ids)]
+        if category is not None:
+            query += " AND category = ?"
+            parameters.append(category)
+        query += " GROUP BY category, name ORDER BY SUM(duration) DESC LIMIT ?"
+        parameters.append(top)
+        return list(self.connect().execute(query, parameters))
+
+    def trend(self, n_runs=DEFAULT_LAST_RUNS):
+        """
+        De laatste runs, de oudste eerst
+
+        Returns: list
+            Tuples (id, gestart, mode, duur, gelukt, cache hits, cache misses, aantal rebuilds)
+        """
+        cursor = self.connect().execute(
+            "SELECT runs.id, started, mode, wall_time, success, cache_hits, cache_misses, "
+            "(SELECT COUNT(DISTINCT stage) FROM triggers WHERE triggers.run_id = runs.id) "
+            "FROM runs ORDER BY runs.id DESC LIMIT ?", (n_runs,))
+        return list(reversed(list(cursor)))
+
+    def triggers(self, n_runs=DEFAULT_LAST_RUNS, top=DEFAULT_TOP):
+        """
+        De inputs die in de laatste runs het vaakst een rebuild gaven
+
+        Returns: list
+            Tuples (input, aantal runs, stages)
+        """
+        run_ids = self.last_run_ids(n_runs)
+        if not run_ids:
+            return []
+        cursor = self.connect().execute(
+            "SELECT input, COUNT(DISTINCT run_id), GROUP_CONCAT(DISTINCT stage) FROM triggers "
+            "WHERE run_id >= ? GROUP BY input ORDER BY COUNT(DISTINCT run_id) DESC, input "
+            "LIMIT ?", (min(run_ids), top))
+        return list(cursor)
+
+    def report(self, n_runs=DEFAULT_LAST_RUNS, top=DEFAULT_TOP):
+        """Print de slowest stages, de trend en de triggers van de laatste runs"""
+        print(f"Slowest stages and commands of the last {n_runs} runs")
+        message = "{:50.50s} {:8s} {:>5} {:>9} {:>9} {:>10}"
+        print(message.format("Stage / command", "type", "n", "mean [s]", "max [s]", "total [s]"))
+        for category, name, count, mean, maximum, total in self.slowest(n_runs, top):
+            print(message.format(name, category, count, f"{mean:.2f}", f"{maximum:.2f}",
+                                 f"{total:.2f}"))
+
+        print(f"\nTrend of the last {n_runs} runs")
+        message = "{:>5} {:20s} {:6s} {:>9} {:>7} {:>11} {:>9}"
+        print(message.format("run", "started", "mode", "wall [s]", "status", "cache h/m",
+                             "rebuilds"))
+        for run_id, started, mode, wall_time, success, hits, misses, rebuilds in \
+                self.trend(n_runs):
+            print(message.format(run_id, started, str(mode), f"{wall_time or 0:.2f}",
+                                 "ok" if success else "failed", f"{hits}/{misses}", rebuilds))
+
+        print(f"\nInputs which triggered rebuilds in the last {n_runs} runs")
+        message = "{:60.60s} {:>5}  {}"
+        print(message.format("Input", "runs", "stages"))
+        for input_file, count, stages in self.triggers(n_runs, top):
+            print(message.format(input_file, count, stages))
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(prog="latex2ccn stats",
+                                     description="Laat de build history van het rapport zien")
+    parser.add_argument("--settings_filename", default="rapport_settings.yml",
+                        help="De settings file van het rapport, voor de cache directory")
+    parser.add_argument("--draft", action="store_true", default=False,
+                        help="Laat de history van de draft builds zien. Die staat in de cache "
+                             "directory van de draft output directory")
+    parser.add_argument("-n", "--last", type=int, default=DEFAULT_LAST_RUNS,
+                        help="Aantal runs dat meegenomen wordt. Default %(default)s")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP,
+                        help="Aantal regels in de tabellen. Default %(default)s")
+    return parser.parse_args(args)
+
+
+def stats_main(args, cache_directory):
+    """
+    Het ``latex2ccn stats`` commando
+
+    Args:
+        args: argparse.Namespace
+            De argumenten van :func:`parse_args`
+        cache_directory: Path
+            De cache directory waarin de database staat
+    """
+    database_file = Path(cache_directory) / HISTORY_FILE_NAME
+    if not database_file.exists():
+        print(f"No build history found at {database_file}")
+        return
+    history = BuildHistory(database_file)
+    try:
+        history.report(n_runs=args.last, top=args.top)
+    finally:
+        history.close()
@@ -0,0 +1,158 @@
+"""
+Clean the split html pages with htmlcleaner on a pool of worker processes
+
+The cleaner is loaded once per worker process via the ``htmlcleaner`` console script entry point,
+so we do not pay the start up of the interpreter and the imports for every page. If the entry
+point can not be found (for instance because htmlcleaner is installed in another environment),
+every page is cleaned by running the ``htmlcleaner`` executable.
+"""
+
+import contextlib
+import io
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+if sys.version_info[:2] >= (3, 8):
+    from importlib.metadata import entry_points  # pragma: no cover
+else:
+    from importlib_metadata import entry_points  # pragma: no cover
+
+HTMLCLEANER = "htmlcleaner"
+
+_logger = logging.getLogger(__name__)
+
+# de cleaner die in een worker proces geladen is
+_cleaner = None
+
+
+def find_cleaner_entry_point():
+    """
+    Zoek het console script entry point van htmlcleaner
+
+    Returns: EntryPoint or None
+        Het entry point of None als htmlcleaner niet in deze omgeving geïnstalleerd is
+    """
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        candidates = eps.select(group="console_scripts", name=HTMLCLEANER)
+    else:
+        candidates = [ep for ep in eps.get("console_scripts", []) if ep.name == HTMLCLEANER]
+    for entry_point in candidates:
+        return entry_point
+    return None
+
+
+def cleaner_version():
+    """Geef de versie van htmlcleaner, zodat een nieuwe versie de cache ongeldig maakt"""
+    entry_point = find_cleaner_entry_point()
+    if entry_point is None:
+        return None
+    dist = getattr(entry_point, "dist", None)
+    if dist is not None:
+        return f"{dist.name} {dist.version}"
+    return entry_point.value
+
+
+def load_cleaner():
+    """
+    Laad de cleaner als een functie die de command line argumenten als lijst krijgt
+
+    Een PyScaffold script heeft een ``main(args)`` functie naast de ``run()`` die sys.argv leest.
+    Als die er is gebruiken we main, anders roepen we het entry point aan met een aangepaste
+    sys.argv.
+
+    Returns: callable or None
+    """
+    entry_point = find_cleaner_entry_point()
+    if entry_point is None:
+        return None
+    function = entry_point.load()
+    module = sys.modules.get(function.__module__)
+    main = getattr(module, "main", None)
+    if callable(main) and main is not function:
+        return main
+
+    def call_with_argv(args):
+        sys.argv = [HTMLCLEANER] + list(args)
+        return function()
+
+    return call_with_argv
+
+
+def _init_worker():
+    global _cleaner
+    _cleaner = load_cleaner()
+
+
+def _clean_in_process(html_file, args):
+    """Clean één pagina met de cleaner die in dit worker proces geladen is"""
+    start = time.perf_counter()
+    output = io.StringIO()
+    success = True
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            _cleaner([html_file] + args)
+        except SystemExit as err:
+            success = err.code in (None, 0)
+        except Exception as err:
+            print(f"Cleaning {html_file} failed: {err}")
+            success = False
+    return html_file, time.perf_counter() - start, success, output.getvalue(), start
+
+
+def _clean_in_subprocess(html_file, args):
+    """Clean één pagina door het htmlcleaner executable te starten"""
+    start = time.perf_counter()
+    try:
+        result = subprocess.run([HTMLCLEANER, html_file] + args, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, env=os.environ)
+    except FileNotFoundError as err:
+        return html_file, time.perf_counter() - start, False, f"{err}\n", start
+    output = result.stdout.decode("utf-8", errors="replace")
+    return html_file, time.perf_counter() - start, result.returncode == 0, output, start
+
+
+def clean_html_files(html_files, overwrite=True, max_workers=None, in_process=True):
+    """
+    Clean een lijst van html files tegelijk
+
+    Args:
+        html_files: list
+            De html files die schoongemaakt worden
+        overwrite: bool
+            Overschrijf de html files met de schoongemaakte versie
+        max_workers: int or None
+            Aantal worker processen. Default het aantal cores
+        in_process: bool
+            Laad de cleaner in de worker processen. Bij False, of als de cleaner niet geladen kan
+            worden, wordt voor iedere file het htmlcleaner executable gestart
+
+    Returns: list
+        Per file een tuple (file, duur in seconden, gelukt, output, start). De start is de
+        time.perf_counter waarde bij het begin, die op linux en macOS tussen processen
+        vergelijkbaar is
+    """
+    html_files = [str(html_file) for html_file in html_files]
+    if not html_files:
+        return []
+    args = ["--overwrite"] if overwrite else []
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(html_files)))
+
+    if in_process and find_cleaner_entry_point() is not None:
+        _logger.debug(f"Cleaning {len(html_files)} files with {max_workers} worker processes")
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker)
+        function = _clean_in_process
+    else:
+        _logger.debug(f"Cleaning {len(html_files)} files with the {HTMLCLEANER} executable")
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        function = _clean_in_subprocess
+
+    with executor:
+        futures = [executor.submit(function, html_file, args) for html_file in html_files]
+        return [future.result() for future in futures]
@@ -0,0 +1,153 @@
+"""
+Convert with a long running LaTeXML server instead of starting latexml for every conversion
+
+Every ``latexml`` process loads Perl, the LaTeXML core and the bindings of the document class,
+which costs a few seconds per call. LaTeXML comes with a socket server, ``latexmls``, which keeps
+all of this loaded, and a light client, ``latexmlc``, which sends a conversion to the server. The
+server is started once and stops by itself when it has been idle for *expire* seconds, so the next
+run of latex2ccn (or the next rebuild in ``--watch`` mode) finds it still running.
+
+The server has its own working directory, so all paths in a request are made absolute.
+"""
+
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+DEFAULT_PORT = 3354
+DEFAULT_EXPIRE = 600
+START_TIMEOUT = 30.0
+
+# opties van latexml waarvan de waarde een pad is
+PATH_OPTIONS = ("--dest", "--preamble", "--postamble", "--bibliography", "--path",
+                "--sitedirectory", "--sourcedirectory", "--log")
+
+_logger = logging.getLogger(__name__)
+
+
+class LaTeXMLServer:
+    """
+    Een lokale latexmls server en het latexmlc commando om er conversies naartoe te sturen
+
+    Args:
+        port: int
+            De poort waarop de server luistert
+        expire: int
+            Aantal seconden zonder conversies waarna de server stopt
+        log_file: str or Path or None
+            File voor de output van de server
+        platform_is_windows: bool
+            Gebruik de .bat versies van de executables
+    """
+
+    def __init__(self, port=DEFAULT_PORT, expire=DEFAULT_EXPIRE, log_file=None,
+                 platform_is_windows=False):
+        self.port = int(port)
+        self.expire = int(expire)
+        self.log_file = log_file
+        self.server_exe = "latexmls"
+        self.client_exe = "latexmlc"
+        if platform_is_windows:
+            self.server_exe += ".bat"
+            self.client_exe += ".bat"
+        self._usable = None
+        self._lock = threading.Lock()
+
+    def available(self):
+        """Kijk of de server en de client geïnstalleerd zijn"""
+        return shutil.which(self.server_exe) is not None and \
+            shutil.which(self.client_exe) is not None
+
+    def is_running(self):
+        """Kijk of er een server op de poort luistert"""
+        try:
+            with socket.create_connection(("127.0.0.1", self.port), timeout=0.5):
+                return True
+        except OSError:
+            return False
+
+    def start(self):
+        """
+        Start de server en wacht tot hij verbindingen aanneemt
+
+        Returns: bool
+            True als de server draait
+        """
+        cmd = [self.server_exe, f"--port={self.port}", f"--expire={self.expire}"]
+        _logger.info(f"Starting LaTeXML server: {' '.join(cmd)}")
+        if self.log_file is not None:
+            Path(self.log_file).parent.mkdir(parents=True, exist_ok=True)
+            log_stream = open(self.log_file, "ab")
+        else:
+            log_stream = subprocess.DEVNULL
+        try:
+            # in een eigen sessie, zodat de server blijft draaien als latex2ccn klaar is
+            subprocess.Popen(cmd, stdout=log_stream, stderr=subprocess.STDOUT,
+                             stdin=subprocess.DEVNULL, start_new_session=True)
+        except OSError as err:
+            _logger.warning(f"Could not start the LaTeXML server: {err}")
+            return False
+        finally:
+            if self.log_file is not None:
+                log_stream.close()
+
+        deadline = time.monotonic() + START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.is_running():
+                return True
+            time.sleep(0.2)
+        _logger.warning(f"The LaTeXML server did not start within {START_TIMEOUT} s")
+        return False
+
+    def ensure_running(self):
+        """
+        Zorg dat de server draait. Als dat een keer mislukt is, proberen we het niet opnieuw
+
+        Returns: bool
+            True als conversies naar de server gestuurd kunnen worden
+        """
+        # de hoofdstukken worden tegelijk geconverteerd, maar de server mag maar één keer starten
+        with self._lock:
+            if self._usable is False:
+                return False
+            if self.is_running():
+                self._usable = True
+            elif not self.available():
+                _logger.warning(f"{self.server_exe} or {self.client_exe} not found. "
+                                f"Using latexml")
+                self._usable = False
+            else:
+                self._usable = self.start()
+            return self._usable
+
+    def client_command(self, arguments, output_format="xml"):
+        """
+        Het latexmlc commando voor een conversie met dezelfde argumenten als latexml
+
+        Args:
+            arguments: list
+                De argumenten die anders aan latexml meegegeven worden
+            output_format: str
+                'xml' voor alleen de conversie, 'html5' om ook de post processing te doen
+
+        Returns: list
+        """
+        cmd = [self.client_exe, f"--port={self.port}", f"--expire={self.expire}",
+               f"--format={output_format}"]
+        for argument in arguments:
+            option, is_option, value = argument.partition("=")
+            if is_option and option in PATH_OPTIONS:
+                argument = f"{option}={Path(value).absolute().as_posix()}"
+            elif not argument.startswith("-"):
+                if Path(argument).suffix == ".bib":
+                    cmd.append("--bibtex")
+                argument = Path(argument).absolute().as_posix()
+            cmd.append(argument)
+        # de sections en plaatjes worden ten opzichte van de report directory gezocht
+        cmd.append(f"--path={Path(os.getcwd()).as_posix()}")
+        return cmd
@@ -0,0 +1,372 @@
+"""
+Make the html pages with latexmlpost and install the pages which changed
+
+latexmlpost renders into a staging directory which replaces the latexmlpost directory only when
+the run succeeded, so a failed run keeps the pages of the last good run. With
+``parallel_latexmlpost`` the document is split in a shard per chapter, which are rendered at the
+same time after one scan of the whole document. Only the pages whose raw html changed are cleaned
+and copied to the ccn html directory. The stages are methods of
+:class:`latexmlsuite.main_suite.LaTeXMLSuite` through :class:`LaTeXMLPostStages`.
+"""
+
+import json
+import logging
+import os
+import shutil
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from latexmlsuite.build_cache import hash_file
+from latexmlsuite.chapters import DOCUMENT_FRAGMENT, fragment_hashes, shard_document
+from latexmlsuite.tracing import traced_stage
+from latexmlsuite.utils import _print_lock
+
+LATEXMLPOST_DIRECTORY_NAME = "latexmlpost"
+LATEXMLPOST_STAGING_NAME = "latexmlpost_new"
+LATEXMLPOST_STATE_FILE_NAME = "latexmlpost.json"
+SHARD_DIRECTORY_NAME = "shards"
+
+_logger = logging.getLogger(__name__)
+
+
+class LaTeXMLPostStages:
+    """
+    De latexmlpost stages van :class:`latexmlsuite.main_suite.LaTeXMLSuite`. Gebruikt de
+    instellingen en de build cache van de suite
+    """
+
+    @traced_stage
+    def install_html_pages(self, pages=None):
+        """
+        Zet de pagina's van latexmlpost die veranderd zijn in de ccn html directory
+
+        De gesplitste pagina's krijgen de naam van de main file als prefix, zoals in
+        :meth:`rename_and_clean_html`. Een pagina die byte voor byte gelijk is aan de ruwe pagina
+        die de vorige keer geïnstalleerd is, wordt niet gekopieerd en niet opnieuw schoongemaakt,
+        zodat de pagina in ccn en zijn modificatie tijd gelijk blijven. Plaatjes die latexmlpost
+        gemaakt heeft, worden alleen gekopieerd als ze veranderd zijn; de css files niet.
+
+        Args:
+            pages: set or None
+                Installeer alleen deze pagina's, zoals 'Ch3', bij een gedeeltelijke build. De
+                andere pagina's in ccn blijven zoals ze waren
+        """
+        fc = self.terminal_colors.foreground_color
+        bc = self.terminal_colors.background_color
+        rs = self.terminal_colors.reset_colors
+        prefix = self.main_file_name.stem
+        state = self.read_latexmlpost_state()
+
+        if self.test and pages is not None:
+            # in een droge run heeft latexmlpost niets gemaakt
+            sources = [self.latexmlpost_dir / Path(page + ".html") for page in sorted(pages)]
+        else:
+            sources = sorted(self.latexmlpost_dir.glob("*.html"))
+        html_files = []
+        changed = dict()
+        for source in sources:
+            if pages is not None and source.stem not in pages:
+                continue
+            if source.stem == prefix:
+                target = self.ccn_html_dir / source.name
+            else:
+                target = self.ccn_html_dir / Path(f"{prefix}_{source.name}")
+            html_files.append(target)
+            if self.test:
+                print(f"{fc}{bc}cp {source} {target}{rs}")
+                continue
+            raw_hash = hash_file(source)
+            unchanged = state["pages"].get(target.name) == raw_hash and target.exists()
+            self.build_cache.register("latexmlpost page", unchanged)
+            if unchanged:
+                continue
+            print(f"{fc}{bc}cp {source} {target}{rs}")
+            shutil.copyfile(source, target)
+            changed[target] = raw_hash
+        if pages is not None and len(html_files) < len(pages):
+            missing = set(pages) - {source.stem for source in sources}
+            _logger.warning(f"latexmlpost did not make the pages {', '.join(sorted(missing))}")
+
+        if not self.test:
+            for resource in self.latexmlpost_dir.rglob("*"):
+                if not resource.is_file() or resource.suffix in (".html", ".css"):
+                    continue
+                target = self.ccn_html_dir / resource.relative_to(self.latexmlpost_dir)
+                if target.exists() and hash_file(target) == hash_file(resource):
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(resource, target)
+
+        # de index pagina wordt net als bij rename_and_clean_html niet schoongemaakt
+        failed = self.clean_html([html for html in changed if html.stem != prefix])
+        for target, raw_hash in changed.items():
+            if target not in failed:
+                state["pages"][target.name] = raw_hash
+        self.write_latexmlpost_state(state)
+        if pages is None:
+            self.produced_html_files = {html for html in html_files if html.stem != prefix}
+        if not self.test:
+            print(f"latexmlpost: {len(changed)} of {len(html_files)} pages changed")
+
+    def read_latexmlpost_state(self):
+        """
+        Lees de hashes van de vorige latexmlpost run uit de cache directory
+
+        Returns: dict
+            Met onder 'fragments' de hashes van de xml van de hoofdstukken, zie
+            :func:`fragment_hashes`, en onder 'pages' per pagina in ccn de hash van de ruwe
+            pagina die daar geïnstalleerd is
+        """
+        state_file = self.build_cache.cache_directory / Path(LATEXMLPOST_STATE_FILE_NAME)
+        try:
+            with open(state_file, "r", encoding="utf-8") as stream:
+                state = json.load(stream)
+        except (OSError, ValueError):
+            state = dict()
+        state.setdefault("fragments", dict())
+        state.setdefault("pages", dict())
+        return state
+
+    def write_latexmlpost_state(self, state):
+        if self.test:
+            return
+        state_file = self.build_cache.cache_directory / Path(LATEXMLPOST_STATE_FILE_NAME)
+        state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = state_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as stream:
+            json.dump(state, stream, indent=1, sort_keys=True)
+        os.replace(tmp_file, state_file)
+
+    @traced_stage
+    def launch_latexml_post(self):
+        """
+        Maak de html pagina's van de xml met latexmlpost in de latexmlpost directory
+
+        Van de xml van ieder hoofdstuk wordt een hash gemaakt. Als geen hoofdstuk, de rest van het
+        document, de bibliografie en het commando veranderd zijn en alle pagina's in ccn er nog
+        zijn, wordt latexmlpost overgeslagen. Welke pagina's daarna naar ccn gaan, bepaalt
+        :meth:`install_html_pages`.
+
+        latexmlpost schrijft de pagina's eerst in een aparte directory, die pas als latexmlpost
+        gelukt is de plaats van de latexmlpost directory inneemt. Een mislukte run laat de
+        pagina's van de vorige run dus staan.
+
+        Returns: bool
+            False als de html up to date was en er niets gedaan is, of als latexmlpost mislukt is
+        """
+        latexmlpost = []
+
+        if self.test:
+            latexmlpost.append("echo")
+
+        latexmlpost.append("latexmlpost")
+        if self.platform_is_windows:
+            latexmlpost[-1] += ".bat"
+
+        out_dir = self.output_directory_html
+        main_file = out_dir / Path(self.main_file_name)
+        staging_dir = self.output_directory_html / Path(LATEXMLPOST_STAGING_NAME)
+        html_file = staging_dir / Path(main_file.stem).with_suffix(".html")
+        self.ccn_html_dir.mkdir(exist_ok=True, parents=True)
+        xml_file = main_file.with_suffix("")
+
+        bibliography = []
+        if self.xml_refs is not None:
+            bibliography.append(f"--bibliography={self.xml_refs.as_posix()}")
+
+        split = []
+        if not self.merge_chapters:
+            split.append("--split")
+            split.append("--splitat")
+            split.append("chapter")
+
+        cmd = latexmlpost + [f"--dest={html_file.as_posix()}", f"{xml_file}"] + bibliography + split
+
+        # de pagina's van latexmlpost hangen af van de xml van de hoofdstukken
+        full_xml_file = main_file.with_suffix(".xml")
+        try:
+            fragments = fragment_hashes(full_xml_file)
+        except (OSError, ET.ParseError):
+            fragments = dict()
+        inputs = [self.xml_refs] if self.xml_refs is not None else []
+        fingerprint = self.build_cache.fingerprint(inputs=inputs,
+                                                   settings=dict(cmd=cmd, fragments=fragments))
+        prefix = main_file.stem
+        outputs = [self.ccn_html_dir / Path(prefix + ".html")] + sorted(
+            self.ccn_html_dir.glob(f"{prefix}_*.html"))
+        if not self.force_html and self.build_cache.is_up_to_date("latexmlpost", fingerprint,
+                                                                  outputs=outputs):
+            _logger.info(f"No update needed for the html pages of {full_xml_file}")
+            self.produced_html_files = set(outputs[1:])
+            return False
+
+        state = self.read_latexmlpost_state()
+        changed = sorted(name for name in set(fragments) | set(state["fragments"])
+                         if fragments.get(name) != state["fragments"].get(name))
+        for name in changed:
+            self.build_cache.add_trigger("latexmlpost", f"{full_xml_file.as_posix()}#{name}")
+        if changed and state["fragments"]:
+            print(f"Changed parts of {full_xml_file}: {', '.join(changed)}")
+
+        success = False
+        if self.parallel_latexmlpost and not self.single_pass and not self.merge_chapters:
+            self.clear_directory(staging_dir)
+            success = self.launch_latexml_post_sharded(xml_file=full_xml_file,
+                                                       latexmlpost=latexmlpost,
+                                                       bibliography=bibliography, split=split,
+                                                       destination=staging_dir)
+        if not success:
+            self.clear_directory(staging_dir)
+            result = self.execute(command=cmd, stage="latexmlpost")
+            if result.returncode != 0:
+                _logger.warning(f"latexmlpost failed with exit status {result.returncode}; the "
+                                f"pages of the previous run in {self.latexmlpost_dir} are kept")
+                self.failed_stages.append("latexmlpost")
+                if not self.test:
+                    shutil.rmtree(staging_dir, ignore_errors=True)
+                return False
+        if self.test:
+            return True
+        self.replace_directory(self.latexmlpost_dir, staging_dir)
+        if self.partial:
+            # alleen een deel van de pagina's gaat naar ccn, dus de volgende volledige build moet
+            # latexmlpost weer draaien
+            self.build_cache.update("latexmlpost", "partial")
+        else:
+            self.build_cache.update("latexmlpost", fingerprint)
+        state["fragments"] = fragments
+        self.write_latexmlpost_state(state)
+        return True
+
+    def clear_directory(self, directory):
+        """Maak een lege directory; een droge run laat de directory met rust"""
+        if not self.test:
+            shutil.rmtree(directory, ignore_errors=True)
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def replace_directory(directory, new_directory):
+        """Zet new_directory op de plaats van directory, die pas daarna weggegooid wordt"""
+        old_directory = directory.with_name(directory.name + "_old")
+        shutil.rmtree(old_directory, ignore_errors=True)
+        if directory.exists():
+            os.replace(directory, old_directory)
+        os.replace(new_directory, directory)
+        shutil.rmtree(old_directory, ignore_errors=True)
+
+    @traced_stage
+    def launch_latexml_post_sharded(self, xml_file, latexmlpost, bibliography, split,
+                                    destination):
+        """
+        Maak de html pagina's met een apart latexmlpost proces per hoofdstuk
+
+        Eerst registreert één latexmlpost run met --prescan de ids en pagina's van het hele
+        document in een database. Daarna wordt de xml gesplitst in een shard per hoofdstuk en een
+        shard met de rest van het document. Ieder latexmlpost proces maakt de pagina's van zijn
+        shard, met een eigen kopie van de database voor de referenties naar de andere pagina's, en
+        schrijft die in de latexmlpost directory, waar :meth:`install_html_pages` ze oppikt. De
+        processen draaien tegelijk op maximaal *jobs* workers. Bij een gedeeltelijke build worden
+        alleen de shards van de gekozen hoofdstukken gemaakt. Alleen de shard met de rest van het
+        document, waarin de bibliografie staat, krijgt de bibliografie mee; de citaties in de
+        hoofdstukken worden via de database van de scan opgezocht.
+
+        Dit werkt alleen met een LaTeXML versie waarin latexmlpost --noscan de pagina van het
+        hoofdstuk bij het splitsen de naam van zijn xml:id geeft, zoals Ch3.html. Als een van die
+        pagina's ontbreekt, wordt latexmlpost alsnog in één keer gedraaid.
+
+        Args:
+            xml_file: Path
+                De xml file van het hele document
+            latexmlpost: list
+                Het latexmlpost commando zonder argumenten
+            bibliography: list
+                De optie voor de bibliografie, of een lege lijst
+            split: list
+                De opties voor het splitsen
+            destination: Path
+                De directory waarin de pagina's gemaakt worden
+
+        Returns: bool
+            True als het gelukt is. Bij False moet latexmlpost in één keer gedraaid worden
+        """
+        if not xml_file.exists():
+            _logger.warning(f"No {xml_file} to split; running latexmlpost in one go")
+            return False
+        shard_dir = self.output_directory_html / Path(SHARD_DIRECTORY_NAME)
+        try:
+            if self.test:
+                # een droge run laat alleen de commando's zien en schrijft geen shards
+                names = [DOCUMENT_FRAGMENT] + [name for name in fragment_hashes(xml_file)
+                                               if name != DOCUMENT_FRAGMENT]
+                shards = [(name, shard_dir / Path(name + ".xml")) for name in names]
+            else:
+                shutil.rmtree(shard_dir, ignore_errors=True)
+                shards = shard_document(xml_file, shard_dir)
+        except (OSError, ET.ParseError) as err:
+            _logger.warning(f"Could not split {xml_file} ({err}); running latexmlpost in one go")
+            return False
+        if self.partial:
+            shards = [(name, shard_file) for name, shard_file in shards
+                      if name in self.partial_pages]
+
+        prefix = self.main_file_name.stem
+        db_file = shard_dir / Path("latexmlpost.db")
+        html_file = destination / Path(prefix + ".html")
+        scan = latexmlpost + ["--prescan", f"--dbfile={db_file.as_posix()}",
+                              f"--dest={html_file.as_posix()}", xml_file.as_posix()] + \
+            bibliography + split
+        if self.execute(command=scan, stage="latexmlpost scan").returncode != 0:
+            _logger.warning("Scanning the document failed; running latexmlpost in one go")
+            return False
+
+        jobs = []
+        for name, shard_file in shards:
+            # latexmlpost kan de database bijwerken, dus ieder proces krijgt een eigen kopie
+            shard_db = shard_file.with_suffix(".db")
+            if db_file.exists() and not self.test:
+                shutil.copyfile(db_file, shard_db)
+            options = list(split)
+            if name == DOCUMENT_FRAGMENT:
+                dest = html_file
+                options += bibliography
+            else:
+                # de pagina van het hoofdstuk krijgt zijn naam van latexmlpost bij het splitsen,
+                # de bovenste pagina van de shard zelf gooien we weg
+                dest = destination / Path(f"shard_{name}.html")
+            cmd = latexmlpost + ["--noscan", f"--dbfile={shard_db.as_posix()}",
+                                 f"--dest={dest.as_posix()}", shard_file.as_posix()] + options
+            jobs.append((name, cmd))
+        print(f"Post processing {len(jobs)} shards of {xml_file} with latexmlpost")
+
+        def render(job, group_output):
+            name, cmd = job
+            output = list() if group_output else None
+            result = self.execute(command=cmd, stage=f"latexmlpost {name}", output=output)
+            if output is not None:
+                with _print_lock:
+                    print("\n".join(output))
+            return result.returncode == 0
+
+        n_workers = max(1, min(self.jobs, len(jobs)))
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(lambda job: render(job, n_workers > 1), jobs))
+        if self.test:
+            return True
+        for name, _ in jobs:
+            top_page = destination / Path(f"shard_{name}.html")
+            if top_page.exists():
+                top_page.unlink()
+        if not all(results):
+            failed = [job[0] for job, ok in zip(jobs, results) if not ok]
+            _logger.warning(f"latexmlpost failed for {', '.join(failed)}; running latexmlpost "
+                            f"in one go")
+            return False
+        missing = [name for name, _ in jobs if name != DOCUMENT_FRAGMENT and
+                   not (destination / Path(name + ".html")).exists()]
+        if missing:
+            _logger.warning(f"latexmlpost did not make the pages {', '.join(missing)} from their "
+                            f"shards; this LaTeXML version names the split pages differently. "
+                            f"Running latexmlpost in one go")
+            return False
+        return True
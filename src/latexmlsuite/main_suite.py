@@ -4,27 +4,65 @@ This tool can be used to automate the process of creating a latex report
 
 import argparse
 import codecs
+import collections
 import datetime
 import colorama
 from colorama import Fore, Back, Style
 from colorama.ansi import AnsiBack, AnsiFore
 import glob
+import hashlib
 import logging
 import os
+import queue
 import re
 import shutil
+import sqlite3
 import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import path
 import yaml
 
 from latexmlsuite import __version__
-
-MODES = ("all", "html", "latex", "clean", "xml", "none")
+from latexmlsuite.artifact_cache import ARTIFACT_CACHE_VARIABLE, DEFAULT_MAX_SIZE, ArtifactCache
+from latexmlsuite.branches import BranchStages
+from latexmlsuite.build_cache import CACHE_DIRECTORY_NAME, BuildCache, hash_file
+from latexmlsuite.chapters import (advance_counters, assemble_document, contains_appendix,
+                                   continues_chapter, count_chapters, include_name,
+                                   split_document)
+from latexmlsuite.cleanup import LOG_PATTERNS, OUTPUT_LOG_PATTERNS, remove_files
+from latexmlsuite.draft import PARTIAL_DIRECTORY_NAME, DraftStages
+from latexmlsuite.history import HISTORY_FILE_NAME, BuildHistory
+from latexmlsuite.history import parse_args as parse_stats_args
+from latexmlsuite.history import stats_main
+from latexmlsuite.html_cleaner import clean_html_files, cleaner_version
+from latexmlsuite.latexml_server import DEFAULT_PORT as DEFAULT_SERVER_PORT
+from latexmlsuite.latexml_server import LaTeXMLServer
+from latexmlsuite.latexmlpost import LATEXMLPOST_DIRECTORY_NAME, LaTeXMLPostStages
+from latexmlsuite.preamble_format import PreambleFormat, count_passes
+from latexmlsuite.scripts import (expand_patterns, normalise_directory, read_makefiles,
+                                  read_scripts, script_dependencies, topological_order)
+from latexmlsuite.sync import scan_tree, synchronise_directories
+from latexmlsuite.tex_dependencies import DependencyScanner
+from latexmlsuite.tracing import Tracer, max_rss_kb, traced_stage
+from latexmlsuite.utils import _print_lock, write_file_if_changed
+from latexmlsuite.watch import DEFAULT_DEBOUNCE, watch_report
+
+MODES = ("all", "html", "latex", "clean", "xml", "none", "draft")
 DEFAULT_MAIN = "main"
 DEFAULT_MODE = "all"
+DEFAULT_JOBS = 1
+
+# van de output van een commando bewaren we alleen het begin en het einde in het geheugen
+OUTPUT_HEAD_LINES = 20
+OUTPUT_TAIL_LINES = 500
+READ_CHUNK_SIZE = 1 << 16
+OUTPUT_QUEUE_SIZE = 64
+LOG_BUFFER_SIZE = 1 << 16
+PROGRESS_INTERVAL = 0.5
 
 FOREGROUND_COLOR_OPTIONS = set([c for c in dir(AnsiFore) if "__" not in c])
 BACKGROUND_COLOR_OPTIONS = set([c for c in dir(AnsiBack) if "__" not in c])
@@ -38,6 +76,7 @@ __license__ = "MIT"
 _logger = logging.getLogger(__name__)
 
 
+
 # ---- Python API ----
 # The functions defined in this section can be imported by users in their
 # Python scripts/interactive interpreter, e.g. via
@@ -62,6 +101,37 @@ def check_make_was_clean(make_result):
     return make_was_clean
 
 
+def query_make_up_to_date(make_exe, makefile_dir):
+    """
+    Vraag aan make of alle targets in een directory up to date zijn
+
+    Hiervoor wordt 'make -q' gebruikt, dat niets bouwt maar alleen via de exit status aangeeft
+    of er iets te doen is. Dit is onafhankelijk van de taal van de make output.
+
+    Args:
+        make_exe: str
+            Naam van het make executable
+        makefile_dir: str or Path
+            Directory met de Makefile
+
+    Returns: bool or None
+        True als alles up to date is, False als er iets gebouwd moet worden en None als make de
+        vraag niet kon beantwoorden (bijvoorbeeld omdat make niet gevonden is of de Makefile
+        een fout bevat)
+    """
+    try:
+        result = subprocess.run([make_exe, "-q"], cwd=makefile_dir, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, env=os.environ)
+    except (FileNotFoundError, NotADirectoryError) as err:
+        _logger.debug(f"Could not query {make_exe} in {makefile_dir}: {err}")
+        return None
+    if result.returncode == 0:
+        return True
+    elif result.returncode == 1:
+        return False
+    return None
+
+
 def parse_args(args):
     """Parse command line parameters
 
@@ -107,6 +177,16 @@ def parse_args(args):
         "--no_make", help="Sla het runnen van de makefiles over",
         action="store_false", default=True, dest="do_make"
     )
+    parser.add_argument(
+        "--sync_makefiles", help="Synchroniseer de makefile directories met de ccn directory, "
+                                 "ook als make met --no_make overgeslagen wordt",
+        action="store_true", default=False
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="Aantal makefile directories dat tegelijk gedraaid wordt. Default "
+                             "uit de settings file of anders 1",
+        type=int, default=None
+    )
     parser.add_argument(
         "--no_scripts", help="Sla het runnen van de alle scripts over",
         action="store_false", default=True, dest="do_scripts"
@@ -135,6 +215,11 @@ def parse_args(args):
         "--background_color", help="Achtergrondkleur van commando's",
         choices=BACKGROUND_COLOR_OPTIONS, default=None
     )
+    parser.add_argument(
+        "-q", "--quiet", help="Laat niet alle output van de commando's zien, maar alleen een "
+                              "voortgangsregel. De volledige output staat in de log files",
+        action="store_true", default=False
+    )
     parser.add_argument(
         "--test", help="Doe een droge run, dus laat alleen commando's zien",
         action="store_true", default=False
@@ -148,10 +233,108 @@ def parse_args(args):
                              "geen update geweest",
         action="store_true", default=False
     )
+    parser.add_argument(
+        "--cache_stats", "--cache-stats", help="Laat aan het einde zien hoeveel stages uit de "
+                                               "build cache gehaald konden worden",
+        action="store_true", default=False
+    )
+    parser.add_argument(
+        "--latexml_per_chapter", help="Converteer ieder hoofdstuk als aparte latexml job en "
+                                      "hergebruik de xml van ongewijzigde hoofdstukken",
+        action="store_true", default=None
+    )
+    parser.add_argument(
+        "--latexml_server", help="Stuur de latexml conversies naar een LaTeXML server "
+                                 "(latexmls) die Perl en de bindings geladen houdt. Zonder "
+                                 "server wordt latexml zelf gedraaid",
+        action="store_true", default=None
+    )
+    parser.add_argument(
+        "--single_pass", help="Maak de html in één latexmlc proces direct van de tex, zonder "
+                              "de tussenliggende main.xml. Default de xml met latexml en "
+                              "daarna de html met latexmlpost",
+        action="store_true", default=None
+    )
+    parser.add_argument(
+        "--latexmk_html", help="Draai latexmk ook voor de html variant in de html output "
+                               "directory. Default gebruikt latexml alleen de tex file en doet "
+                               "de pdf de enige xelatex cyclus, behalve met mode xml",
+        action="store_true", default=None
+    )
+    parser.add_argument(
+        "--precompile_preamble", help="Bewaar de preamble als xelatex format, zodat iedere "
+                                      "xelatex pass van latexmk die niet opnieuw hoeft te lezen",
+        action="store_true", default=None
+    )
+    parser.add_argument(
+        "--parallel_latexmlpost", help="Maak de html pagina's met een latexmlpost proces per "
+                                       "hoofdstuk op maximaal --jobs workers, na één scan van "
+                                       "het hele document voor de referenties",
+        action="store_true", default=None
+    )
+    parser.add_argument(
+        "--sync_delete", help="Verwijder files uit de ccn highcharts en tabellen directories "
+                              "die niet meer door make gemaakt worden",
+        action="store_true", default=None
+    )
+    parser.add_argument(
+        "--sync_hardlinks", help="Gebruik hard links in plaats van kopieën bij het "
+                                 "synchroniseren met de ccn directory",
+        action="store_true", default=None
+    )
+    parser.add_argument(
+        "--artifact_cache", help="Directory van een cache die door meerdere checkouts van het "
+                                 "rapport gedeeld wordt. Default uit de settings file of de "
+                                 f"environment variabele {ARTIFACT_CACHE_VARIABLE}",
+        default=None
+    )
+    parser.add_argument(
+        "--no_history", help="Sla deze run niet op in de build history. Bekijk de history met "
+                             "'latex2ccn stats'",
+        action="store_false", default=True, dest="history"
+    )
+    parser.add_argument(
+        "--trace", help="Schrijf de duur en het resource gebruik van alle stages als Chrome "
+                        "trace naar deze json file en laat aan het einde een samenvatting zien",
+        default=None
+    )
+    parser.add_argument(
+        "--watch", help="Blijf draaien en bouw opnieuw zodra er een file in het rapport "
+                        "verandert. Alleen de stages die van de file afhangen worden gedraaid",
+        action="store_true", default=False
+    )
+    parser.add_argument(
+        "--watch_debounce", help="Aantal seconden zonder wijzigingen voordat er opnieuw "
+                                 "gebouwd wordt. Default %(default)s",
+        type=float, default=DEFAULT_DEBOUNCE
+    )
+    parser.add_argument(
+        "--watch_poll", help="Scan de rapport directory iedere seconde in plaats van inotify "
+                             "te gebruiken, bijvoorbeeld op een netwerkschijf",
+        action="store_true", default=False
+    )
     parser.add_argument(
         "--mode", help="Welke type document wil je maken?",
         choices=MODES, default=DEFAULT_MODE
     )
+    parser.add_argument(
+        "--draft_chapters", help="Maak met --mode draft alleen de hoofdstukken waarvan de naam "
+                                 "een van deze stukken bevat, zoals 02 of conclusies",
+        nargs="+", default=None
+    )
+    parser.add_argument(
+        "--only_chapter", "--only-chapter",
+        help="Bouw alleen de hoofdstukken waarvan de naam een van deze stukken bevat, zoals 02 "
+             "of conclusies. Alleen hun html pagina's in ccn worden bijgewerkt en de pdf komt "
+             "in de partial directory van de output directory",
+        nargs="+", default=None, dest="only_chapters"
+    )
+    parser.add_argument(
+        "--only_section", "--only-section",
+        help="Bouw alleen de hoofdstukken met een sectie waarvan de titel, het label of de "
+             "file naam een van deze stukken bevat",
+        nargs="+", default=None, dest="only_sections"
+    )
     parser.add_argument(
         "--no_overwrite", help="Schrijf de schoongemaakte html's naar een nieuwe file",
         action="store_false", default=True, dest="overwrite"
@@ -214,8 +397,7 @@ def copy_main_for_latexml(tex_input_file: Path, tex_output_file: Path,
     cbsdocs = "]{cbsdocs}"
 
     tex_content_new = re.sub(cbsdocs, options + cbsdocs, tex_content)
-    with open(tex_output_file, "w") as out_stream:
-        out_stream.write(tex_content_new)
+    write_file_if_changed(tex_output_file, tex_content_new)
 
 
 class TerminalColors:
@@ -240,11 +422,12 @@ class TerminalColors:
         return color
 
 
-class LaTeXMLSuite:
+class LaTeXMLSuite(BranchStages, DraftStages, LaTeXMLPostStages):
     def __init__(self,
                  main_file_name="main",
                  make_exe="make",
                  do_make=True,
+                 sync_makefiles=False,
                  do_postscripts=True,
                  do_prescripts=True,
                  do_latexml=True,
@@ -252,11 +435,16 @@ class LaTeXMLSuite:
                  bibtex_file=None,
                  output_directory=None,
                  output_directory_html=None,
+                 output_directory_draft=None,
+                 draft_chapters=None,
+                 only_chapters=None,
+                 only_sections=None,
                  output_directory_highcharts=None,
                  output_directory_tabellen=None,
                  output_filename=None,
                  ccn_output_directory=None,
                  makefile_directories=None,
+                 jobs=None,
                  pre_scripts=None,
                  post_scripts=None,
                  mode=None,
@@ -267,7 +455,23 @@ class LaTeXMLSuite:
                  foreground_color=None,
                  background_color=None,
                  use_terminal_colors=False,
-                 force_html=False
+                 force_html=False,
+                 cache_stats=False,
+                 latexml_per_chapter=False,
+                 sync_delete=False,
+                 sync_hardlinks=False,
+                 clean_patterns=None,
+                 quiet=False,
+                 trace_file=None,
+                 latexml_server=False,
+                 latexml_server_port=None,
+                 single_pass=False,
+                 parallel_latexmlpost=False,
+                 latexmk_html=False,
+                 precompile_preamble=False,
+                 history=True,
+                 artifact_cache=None,
+                 artifact_cache_size=None
                  ):
 
         self.terminal_colors = TerminalColors(foreground_color=foreground_color,
@@ -281,7 +485,12 @@ class LaTeXMLSuite:
             self.ccn_output_directory = Path("ccn")
         self.ccn_html_dir = self.ccn_output_directory / Path("html")
         self.overwrite = overwrite
-        self.makefile_directories = makefile_directories
+        # alleen directories met opgegeven inputs en outputs gebruiken de artifact cache
+        self.makefile_directories, self.makefile_artifacts = read_makefiles(makefile_directories)
+        if jobs is None:
+            self.jobs = DEFAULT_JOBS
+        else:
+            self.jobs = max(1, int(jobs))
         self.pre_scripts = pre_scripts
         self.post_scripts = post_scripts
         self.platform_is_windows = platform_is_windows
@@ -289,6 +498,7 @@ class LaTeXMLSuite:
         self.include_graphs = include_graphs
         self.test = test
         self.do_make = do_make
+        self.sync_makefiles = sync_makefiles
         self.do_prescripts = do_prescripts
         self.do_postscripts = do_postscripts
         self.do_latexml = do_latexml
@@ -309,6 +519,27 @@ class LaTeXMLSuite:
         else:
             self.output_directory_html = Path(output_directory_html)
 
+        if mode is None:
+            self.mode = "all"
+        else:
+            self.mode = mode
+
+        if output_directory_draft is None:
+            self.output_directory_draft = Path("out_draft")
+        else:
+            self.output_directory_draft = Path(output_directory_draft)
+        self.draft_chapters = draft_chapters
+
+        # bij een gedeeltelijke build worden alleen de gekozen hoofdstukken gemaakt
+        self.only_chapters = only_chapters
+        self.only_sections = only_sections
+        self.partial = bool(only_chapters or only_sections) and self.mode in ("all", "html",
+                                                                                "latex", "xml")
+        self.output_directory_partial = self.output_directory / Path(PARTIAL_DIRECTORY_NAME)
+        # de files van de gekozen hoofdstukken en de namen van hun html pagina's
+        self.partial_chapters = []
+        self.partial_pages = set()
+
         if output_directory_highcharts is None:
             self.ccn_highcharts_dir = self.ccn_output_directory / Path("highcharts")
         else:
@@ -319,28 +550,212 @@ class LaTeXMLSuite:
         else:
             self.ccn_tables_dir = self.ccn_output_directory / Path(output_directory_tabellen)
 
+        # de volledige output van iedere stage komt in een eigen log file. Het pad is absoluut
+        # omdat de scripts in hun eigen directory gedraaid worden
+        # een draft komt met zijn logs en zijn build cache in een eigen directory
+        if self.mode == "draft":
+            build_directory = self.output_directory_draft
+        else:
+            build_directory = self.output_directory
+        self.log_directory = (build_directory / Path("logs")).absolute()
+
         self.xml_refs = None
         self.updated_references = False
-        self.merge_chapters = merge_chapters
-
-        if mode is None:
-            self.mode = "all"
+        self.cache_stats = cache_stats
+        self.latexml_per_chapter = latexml_per_chapter
+        self.sync_delete = sync_delete
+        self.sync_hardlinks = sync_hardlinks
+        self.quiet = quiet
+        self.trace_file = trace_file
+        if latexml_server:
+            if latexml_server_port is None:
+                latexml_server_port = DEFAULT_SERVER_PORT
+            self.latexml_server = LaTeXMLServer(port=latexml_server_port,
+                                                log_file=self.log_directory / "latexmls.log",
+                                                platform_is_windows=self.platform_is_windows)
         else:
-            self.mode = mode
+            self.latexml_server = None
+        self.single_pass = single_pass
+        self.latexmk_html = latexmk_html
+        # gezet zodra de eerste xelatex pass van de pdf klaar is, zolang de pdf en de xml tegelijk
+        # gemaakt worden
+        self.first_xelatex_pass = None
+        if self.single_pass and self.partial:
+            _logger.info("single_pass is not used for a partial build")
+            self.single_pass = False
+        if self.single_pass and self.latexml_per_chapter:
+            _logger.info("latexml_per_chapter is not used with single_pass")
+        self.parallel_latexmlpost = parallel_latexmlpost
+        if self.parallel_latexmlpost and (self.single_pass or merge_chapters):
+            _logger.info("parallel_latexmlpost is not used with single_pass or merge_chapters")
+        # de build cache onthoudt de hashes van de inputs van iedere stage
+        if self.mode == "draft":
+            cache_directory = self.output_directory_draft / CACHE_DIRECTORY_NAME
+        else:
+            cache_directory = self.output_directory_html / CACHE_DIRECTORY_NAME
+        self.build_cache = BuildCache(cache_directory, read_only=self.test)
+        self.dependency_scanner = DependencyScanner(self.build_cache)
+        self.tracer = Tracer(build_cache=self.build_cache)
+        if precompile_preamble and not self.test:
+            self.preamble_format = PreambleFormat(self.build_cache)
+        else:
+            self.preamble_format = None
+        if history and not self.test:
+            self.history = BuildHistory(self.build_cache.cache_directory / HISTORY_FILE_NAME)
+        else:
+            self.history = None
+        if artifact_cache is not None:
+            if artifact_cache_size is None:
+                artifact_cache_size = DEFAULT_MAX_SIZE
+            self.artifact_cache = ArtifactCache(artifact_cache, max_size=artifact_cache_size)
+        else:
+            self.artifact_cache = None
+        self.merge_chapters = merge_chapters
 
-        # zorg dat de ccn directory wel aan het begin bestaat
-        if self.mode != "clean":
+        # zorg dat de ccn directory wel aan het begin bestaat; een draft blijft van ccn af
+        if self.mode not in ("clean", "draft"):
             _logger.info(f"Maak output directory {self.ccn_highcharts_dir}")
             self.ccn_highcharts_dir.mkdir(exist_ok=True, parents=True)
             self.ccn_tables_dir.mkdir(exist_ok=True, parents=True)
 
+        # per pattern set de directories en de patronen van de files die we opruimen
+        prefix = self.main_file_name.stem
+        self.clean_patterns = dict(
+            css={self.ccn_html_dir: ["*.css"]},
+            log={Path("."): LOG_PATTERNS,
+                 self.output_directory: OUTPUT_LOG_PATTERNS,
+                 self.output_directory_html: OUTPUT_LOG_PATTERNS},
+            html={self.ccn_html_dir: [f"{prefix}_*.html"]},
+        )
+        if clean_patterns is not None:
+            for name, pattern_set in clean_patterns.items():
+                self.clean_patterns[name] = {Path(directory): list(patterns)
+                                             for directory, patterns in pattern_set.items()}
+        self.produced_html_files = set()
+        # stages die mislukt zijn zonder een exception; de run telt dan als mislukt
+        self.failed_stages = []
+        # latexmlpost schrijft hier alle pagina's; alleen de veranderde gaan naar ccn
+        self.latexmlpost_dir = self.output_directory_html / Path(LATEXMLPOST_DIRECTORY_NAME)
+
         # deze directories proberen we te synchroniseren
         self.synchronise_directories = [self.ccn_highcharts_dir, self.ccn_tables_dir]
 
     def run(self):
+        self.run_traced(self.run_stages, name="run")
 
-        if self.makefile_directories is not None and self.do_make:
-            self.launch_makefiles()
+    def rebuild(self, makefile_directories=(), pre_scripts=False, document=False,
+                post_scripts=False):
+        """
+        Draai alleen de stages die door een wijziging geraakt worden, zoals in --watch
+
+        Args:
+            makefile_directories: list
+                De makefile directories waarin iets veranderd is
+            pre_scripts: bool
+                Draai de prescripts opnieuw
+            document: bool
+                Maak de pdf en de html opnieuw. De postscripts draaien dan ook
+            post_scripts: bool
+                Draai de postscripts opnieuw
+        """
+
+        def stages():
+            if self.mode == "draft":
+                if document:
+                    self.run_document_stages()
+                return
+            if makefile_directories and self.do_make:
+                self.launch_makefiles(makefile_directories=makefile_directories)
+            if pre_scripts and self.pre_scripts is not None and self.do_prescripts:
+                self.launch_scripts(self.pre_scripts)
+            if document and self.mode != "none":
+                self.run_document_stages()
+            elif post_scripts and self.post_scripts is not None and self.do_postscripts:
+                self.launch_scripts(self.post_scripts)
+
+        self.run_traced(stages, name="rebuild")
+
+    def run_traced(self, stages, name):
+        """
+        Draai de stages binnen een span, rapporteer de trace en de cache statistieken en sla de
+        run op in de build history
+        """
+        self.tracer.reset()
+        self.build_cache.reset_statistics()
+        self.failed_stages = []
+        start = time.perf_counter()
+        success = False
+        try:
+            with self.tracer.span(name, mode=self.mode):
+                stages()
+            success = not self.failed_stages
+        finally:
+            if self.trace_file is not None:
+                self.tracer.write_chrome_trace(self.trace_file)
+                self.tracer.report_summary()
+            if self.history is not None:
+                self.record_history(success=success, wall_time=time.perf_counter() - start)
+            if self.artifact_cache is not None and not self.test:
+                self.artifact_cache.evict()
+
+        if self.cache_stats:
+            self.build_cache.report_statistics()
+
+    def record_history(self, success, wall_time):
+        """Sla de run op in de build history. Een fout hierin mag de build niet laten falen"""
+        try:
+            self.history.record_run(self.tracer, self.build_cache, mode=self.mode,
+                                    success=success, wall_time=wall_time,
+                                    outputs=dict(htmlcleaner=self.produced_html_files))
+        except sqlite3.Error as err:
+            _logger.warning(f"Could not write the build history: {err}")
+
+    def artifact_key(self, stage, fingerprint, tool=None):
+        """De key in de artifact cache: de fingerprint van de stage plus de versie van de tool"""
+        version = self.artifact_cache.tool_version(tool) if tool is not None else None
+        return self.artifact_cache.key(stage, fingerprint, version)
+
+    def fetch_artifacts(self, stage, fingerprint, destination, tool=None):
+        """
+        Haal de outputs van een stage uit de gedeelde artifact cache
+
+        Args:
+            stage: str
+                Naam van de stage
+            fingerprint: str
+                Fingerprint van de inputs en settings, zie :meth:`BuildCache.fingerprint`
+            destination: dict or Path
+                Zie :meth:`ArtifactCache.fetch`
+            tool: str or None
+                De tool waarvan de versie in de key komt
+
+        Returns: bool
+            True als de outputs uit de cache gekomen zijn
+        """
+        if self.artifact_cache is None or self.test:
+            return False
+        hit = self.artifact_cache.fetch(self.artifact_key(stage, fingerprint, tool), destination)
+        self.build_cache.register(f"shared {stage}", hit)
+        return hit
+
+    def store_artifacts(self, stage, fingerprint, sources, tool=None):
+        """Zet de outputs van een stage in de gedeelde artifact cache"""
+        if self.artifact_cache is None or self.test:
+            return
+        self.artifact_cache.store(self.artifact_key(stage, fingerprint, tool), sources)
+
+    def run_stages(self):
+
+        if self.mode == "draft":
+            # een draft heeft geen grafieken en tabellen nodig en blijft van ccn af
+            self.run_document_stages()
+            return
+
+        if self.makefile_directories is not None:
+            if self.do_make:
+                self.launch_makefiles()
+            elif self.sync_makefiles and self.mode != "clean":
+                self.synchronise_makefile_directories()
 
         if self.pre_scripts is not None and self.do_prescripts and self.mode != "clean":
             self.launch_scripts(self.pre_scripts)
@@ -349,83 +764,91 @@ class LaTeXMLSuite:
             # met none maken we de documenten niet, alleen de make files worden gerund
             return
 
-        if self.mode in ("clean", "latex", "all"):
+        self.run_document_stages()
+
+    def run_document_stages(self):
+        """Maak de pdf, de xml en de html, afhankelijk van de mode, en draai de postscripts"""
+
+        if self.mode == "draft":
+            self.launch_draft()
+            return
+
+        if self.partial:
+            self.select_partial_chapters()
+
+        if self.mode == "all":
+            self.launch_pdf_and_xml_branches()
+        if self.mode in ("clean", "latex"):
             self.launch_latexmk()
             if self.mode == "clean":
                 self.clean_log()
-        if self.mode in ("xml", "all"):
-            self.launch_latexmk_for_html()
-            self.copy_pdf()
-            if self.do_latexml:
-                if self.bibtex_file is not None:
-                    self.launch_latexml_bibtex()
-                self.launch_latexml()
+        if self.mode == "xml":
+            self.launch_xml_only()
         if self.mode in ("html", "all"):
             if self.do_latexml:
                 # This only works if you have installed latexml
-                self.launch_latexml_post()
-                self.rename_and_clean_html()
-                self.clean_ccs()
+                if self.single_pass:
+                    converted = self.launch_latexmlc()
+                else:
+                    converted = self.launch_latexml_post()
+                if converted and self.partial:
+                    self.install_html_pages(pages=self.partial_pages)
+                elif converted:
+                    if self.single_pass:
+                        self.rename_and_clean_html()
+                    else:
+                        self.install_html_pages()
+                    self.clean_ccs()
+                    self.clean_stale_html()
             if self.post_scripts is not None and self.do_postscripts:
                 self.launch_scripts(self.post_scripts)
 
-    def clean_ccs(self):
+    def clean_files(self, pattern_set_name, keep=None):
+        """
+        Verwijder alle files uit een van de pattern sets
 
-        pattern = f"{self.ccn_html_dir.as_posix()}/*.css"
-        css_files = glob.glob(pattern)
-        if len(css_files) == 0:
-            _logger.debug("No css files found.")
+        Args:
+            pattern_set_name: str
+                Naam van de pattern set, zoals 'css', 'log' of 'html'
+            keep: set or None
+                Files die niet verwijderd worden
+        """
+        pattern_set = self.clean_patterns.get(pattern_set_name)
+        if not pattern_set:
+            _logger.debug(f"No clean patterns defined for {pattern_set_name}")
             return
+        remove_files(pattern_set, keep=keep, test=self.test)
 
-        rm = []
-        if self.test:
-            rm.append("echo")
-        if self.platform_is_windows:
-            rm.append("powershell.exe")
-            rm.append("Remove-Item")
-            rm.append("-recurse")
-            rm.append("-force")
-            rm.append(pattern)
-        else:
-            rm.append("rm")
-            rm.append("-v")
-            for file in css_files:
-                rm.append(file)
-        run_command(rm, terminal_colors=self.terminal_colors)
+    @traced_stage
+    def clean_ccs(self):
+        self.clean_files("css")
 
+    @traced_stage
     def clean_log(self):
-        pattern = f"*.css"
-        log_files = glob.glob(pattern)
-        if len(log_files) == 0:
-            _logger.debug("No log files found.")
-            return
-
-        rm = []
-        if self.test:
-            rm.append("echo")
-        if self.platform_is_windows:
-            rm.append("powershell.exe")
-            rm.append("Remove-Item")
-            rm.append("-recurse")
-            rm.append("-force")
-            rm.append(pattern)
-        else:
-            rm.append("rm")
-            rm.append("-v")
-            for file in log_files:
-                rm.append(file)
+        self.clean_files("log")
 
-        run_command(rm, terminal_colors=self.terminal_colors)
+    @traced_stage
+    def clean_stale_html(self):
+        """
+        Verwijder de gesplitste html pagina's die niet meer door latexmlpost gemaakt worden,
+        bijvoorbeeld van een hoofdstuk dat uit het document gehaald is
+        """
+        if not self.produced_html_files:
+            # als latexmlpost niets gemaakt heeft, weten we niet welke pagina's oud zijn
+            return
+        self.clean_files("html", keep=self.produced_html_files)
 
+    @traced_stage
     def rename_and_clean_html(self):
         """
-        Hernoem alle html files met een prefix
+        Hernoem alle html files met een prefix en maak ze schoon met htmlcleaner
         """
         html_files = glob.glob(f"{self.ccn_html_dir.as_posix()}/*.html")
         fc = self.terminal_colors.foreground_color
         bc = self.terminal_colors.background_color
         rs = self.terminal_colors.reset_colors
 
+        renamed_html_files = []
         for html_file in html_files:
             html = Path(html_file)
 
@@ -439,126 +862,494 @@ class LaTeXMLSuite:
             print(f"{fc}{bc}mv {html} {new_html}{rs}")
             if not self.test:
                 shutil.move(html.as_posix(), new_html.as_posix())
+            renamed_html_files.append(new_html)
 
-            cleaner = []
-            if self.test:
-                cleaner.append("echo")
+        self.produced_html_files = set(renamed_html_files)
+        self.clean_html(renamed_html_files)
 
-            cleaner.append("htmlcleaner")
-            cleaner.append(new_html.as_posix())
+    @traced_stage
+    def clean_html(self, html_files):
+        """
+        Maak de html files schoon op een pool van worker processen
 
-            if self.overwrite:
-                cleaner.append("--overwrite")
+        Als de files overschreven worden, bewaren we de schoongemaakte versie onder de hash van de
+        ruwe pagina. Een pagina die hetzelfde is als bij een vorige run wordt dan niet opnieuw
+        schoongemaakt, maar uit de cache gehaald.
 
-            run_command(command=cleaner, terminal_colors=self.terminal_colors)
+        Args:
+            html_files: list
+                De (hernoemde) html files
 
-    def launch_scripts(self, scripts):
-        """
-        Loop over alle directories die een Makefile bevatten en lanceer het make commando
+        Returns: set
+            De files die niet schoongemaakt konden worden
         """
         fc = self.terminal_colors.foreground_color
         bc = self.terminal_colors.background_color
         rs = self.terminal_colors.reset_colors
-        for script_filename in scripts:
-            cmd = []
-            script = Path(script_filename)
-            if self.test:
-                cmd.append("echo")
-            if self.platform_is_windows:
-                script = script.with_suffix(".ps1")
-                cmd.append("powershell.exe")
+
+        if self.test:
+            for html in html_files:
+                overwrite = " --overwrite" if self.overwrite else ""
+                print(f"{fc}{bc}htmlcleaner {html.as_posix()}{overwrite}{rs}")
+            return set()
+
+        cleaned_cache_dir = self.build_cache.cache_directory / Path("html")
+        version = cleaner_version()
+        to_clean = dict()
+        for html in html_files:
+            if not self.overwrite:
+                to_clean[html] = None
+                continue
+            page_key = self.build_cache.fingerprint(inputs=[], settings=dict(
+                page=hash_file(html), cleaner=version))
+            cached_html = cleaned_cache_dir / Path(page_key + ".html")
+            hit = cached_html.exists()
+            self.build_cache.register("htmlcleaner", hit)
+            if not hit:
+                hit = self.fetch_artifacts("htmlcleaner", page_key, {"page.html": cached_html})
+            if hit:
+                _logger.debug(f"Using cached cleaned version of {html}")
+                shutil.copyfile(cached_html, html)
             else:
-                script = script.with_suffix(".sh")
-                cmd.append("sh")
+                to_clean[html] = cached_html
+                self.build_cache.add_trigger("htmlcleaner", html)
+
+        if not to_clean:
+            return set()
+        print(f"{fc}{bc}htmlcleaner: cleaning {len(to_clean)} of {len(html_files)} pages{rs}")
+        start = time.perf_counter()
+        results = clean_html_files(list(to_clean.keys()), overwrite=self.overwrite)
+        total_time = time.perf_counter() - start
+
+        cleaned_cache_dir.mkdir(parents=True, exist_ok=True)
+        failed = set()
+        message = "{:60s} {:>8}"
+        print(message.format("Cleaned file", "time [s]"))
+        for html_file, duration, success, output, file_start in results:
+            self.tracer.add_event(f"htmlcleaner {html_file}", start=file_start,
+                                  duration=duration, category="command", exit_status=success)
+            if output.strip():
+                print(output.rstrip())
+            if not success:
+                _logger.warning(f"htmlcleaner failed for {html_file}")
+                print(message.format(html_file, "failed"))
+                failed.add(Path(html_file))
+                continue
+            print(message.format(html_file, f"{duration:.2f}"))
+            cached_html = to_clean[Path(html_file)]
+            if cached_html is not None:
+                tmp_html = cached_html.with_suffix(f".{os.getpid()}.tmp")
+                shutil.copyfile(html_file, tmp_html)
+                os.replace(tmp_html, cached_html)
+                self.store_artifacts("htmlcleaner", cached_html.stem,
+                                     {"page.html": cached_html})
+        print(message.format("total", f"{total_time:.2f}"))
+        return failed
+
+    @traced_stage
+    def launch_scripts(self, scripts):
+        """
+        Draai de pre- of postscripts
 
-            print(f"{fc}{bc}cd {script.parent}{rs}", end="; ")
-            with path.Path(script.parent):
-                script_base = Path(script.stem + script.suffix)
-                if not Path(script_base).exists():
-                    _logger.warning(f"{script_base} does not exist")
-                script_full = script_base.absolute()
-                cmd.append(script_full.as_posix())
+        Scripts die als gewone naam gegeven zijn, draaien in de volgorde van de settings file.
+        Scripts met inputs, outputs of after draaien tegelijk op een pool van *jobs* workers, na
+        de scripts waarop ze wachten, en worden overgeslagen als hun inputs niet veranderd zijn.
+        Zie :mod:`latexmlsuite.scripts`
 
-                run_command(command=cmd, terminal_colors=self.terminal_colors)
+        Args:
+            scripts: list
+                De prescripts of postscripts uit de settings file
+        """
+        scripts = read_scripts(scripts)
+        dependencies = script_dependencies(scripts)
+        order = topological_order(scripts, dependencies)
+        if self.jobs == 1 or all(script.sequential for script in scripts):
+            succeeded = set()
+            for index in order:
+                if dependencies[index] <= succeeded or scripts[index].sequential:
+                    if self.launch_script(scripts[index]):
+                        succeeded.add(index)
+                else:
+                    self.skip_failed_dependency(scripts[index])
+            return
 
-    def launch_makefiles(self):
+        # de scripts worden in de volgorde van order aangeboden, dus een script dat op een
+        # worker wacht, wacht alleen op scripts die al draaien of klaar zijn
+        futures = dict()
+
+        def run_script(index):
+            script = scripts[index]
+            if not all(futures[other].result() for other in dependencies[index]):
+                if not script.sequential:
+                    self.skip_failed_dependency(script)
+                    return False
+            return self.launch_script(script, group_output=True)
+
+        n_workers = min(self.jobs, len(scripts))
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            for index in order:
+                futures[index] = executor.submit(run_script, index)
+            for future in futures.values():
+                future.result()
+
+    def skip_failed_dependency(self, script):
+        _logger.warning(f"Skipping script {script.name} because a script it runs after failed")
+
+    def launch_script(self, script, group_output=False):
         """
-        Loop over alle directories die een Makefile bevatten en lanceer het make commando
+        Draai één script in zijn eigen directory
+
+        Args:
+            script: Script
+                Het script uit de settings file
+            group_output: bool
+                Verzamel de output en print die pas als het script klaar is
+
+        Returns: bool
+            True als het script gelukt is of up to date was
         """
         fc = self.terminal_colors.foreground_color
         bc = self.terminal_colors.background_color
         rs = self.terminal_colors.reset_colors
 
+        script_path = script.path(self.platform_is_windows)
+        stage = f"script {script_path}"
+        fingerprint = None
+        if not self.test:
+            inputs = script.input_files(self.platform_is_windows)
+            if inputs is not None:
+                fingerprint = self.build_cache.fingerprint(inputs=inputs, settings=dict(
+                    outputs=script.outputs))
+                if self.build_cache.is_up_to_date(stage, fingerprint,
+                                                  outputs=script.output_files()):
+                    _print_line(f"Skipping {script_path}: inputs did not change")
+                    return True
+
+        cmd = []
+        if self.test:
+            cmd.append("echo")
+        if self.platform_is_windows:
+            cmd.append("powershell.exe")
+        else:
+            cmd.append("sh")
+        if not script_path.exists():
+            _logger.warning(f"{script_path} does not exist")
+        cmd.append(script_path.absolute().as_posix())
+
+        output = list() if group_output else None
+        echo_cd = f"{fc}{bc}cd {script_path.parent}{rs}; "
+        if output is not None:
+            output.append(echo_cd)
+        else:
+            print(echo_cd, end="")
+        result = self.execute(command=cmd, stage=stage, cwd=script_path.parent, output=output)
+        if output is not None:
+            with _print_lock:
+                print(output[0] + "\n".join(output[1:]))
+
+        success = self.test or result.returncode == 0
+        if success and fingerprint is not None:
+            self.build_cache.update(stage, fingerprint)
+        return success
+
+    def execute(self, command, stage, cwd=None, output=None, watch_line=None):
+        """
+        Run een commando van een stage, met de volledige output in de log file van de stage
+
+        Args:
+            command: list
+                Het commando met zijn argumenten
+            stage: str
+                Naam van de stage, wordt gebruikt voor de naam van de log file
+            cwd: str or Path
+                Directory waarin het commando gedraaid wordt
+            output: list or None
+                Lijst waaraan de output toegevoegd wordt in plaats van direct geprint
+            watch_line: callable or None
+                Wordt met iedere regel output aangeroepen, zie :func:`run_command`
+
+        Returns: CommandResult
+        """
+        log_file = None
+        if not self.test:
+            log_name = re.sub(r"[^\w.-]+", "_", stage).strip("_")
+            log_file = self.log_directory / Path(log_name + ".log")
+        with self.tracer.span(stage, category="command", command=" ".join(command)) as info:
+            result = run_command(command=command, terminal_colors=self.terminal_colors, cwd=cwd,
+                                 output=output, log_file=log_file, quiet=self.quiet, label=stage,
+                                 watch_line=watch_line)
+            info["exit_status"] = result.returncode
+            info["output_lines"] = result.n_lines
+            if result.cpu_time is not None:
+                info["cpu_time"] = result.cpu_time
+                info["max_rss_kb"] = result.max_rss_kb
+        return result
+
+    def execute_latexml(self, command, stage, output=None):
+        """
+        Draai een latexml commando, via de LaTeXML server als die gebruikt wordt
+
+        Als de server niet gestart kan worden of de conversie via de server mislukt, wordt het
+        commando zelf gedraaid.
+
+        Args:
+            command: list
+                Het latexml commando, eventueel voorafgegaan door echo
+            stage: str
+                Naam van de stage voor de log file en de trace
+            output: list or None
+                Zie :meth:`execute`
+
+        Returns: CommandResult
+        """
+        if self.latexml_server is not None and (self.test or
+                                                self.latexml_server.ensure_running()):
+            index = [Path(part).stem for part in command].index("latexml")
+            server_command = command[:index] + self.latexml_server.client_command(
+                command[index + 1:])
+            result = self.execute(command=server_command, stage=f"{stage} server", output=output)
+            if self.test or result.returncode == 0:
+                return result
+            _logger.warning(f"Conversion by the LaTeXML server failed for {stage}. "
+                            f"Running latexml itself")
+        return self.execute(command=command, stage=stage, output=output)
+
+    @traced_stage
+    def launch_makefiles(self, makefile_directories=None):
+        """
+        Loop over alle directories die een Makefile bevatten en lanceer het make commando
+
+        Met jobs > 1 worden de directories tegelijk op een pool van workers gedraaid. De output
+        van elke directory wordt dan verzameld en in één keer geprint, zodat de output van
+        verschillende directories niet door elkaar komt.
+
+        Args:
+            makefile_directories: list or None
+                Draai alleen deze directories. Default alle makefile directories
+        """
         # voor we beginnen, checken we eerst of de ccn directory wel bestaat
         self.ccn_output_directory.mkdir(exist_ok=True)
 
-        for makefile_dir in self.makefile_directories:
-            cmd = []
-            if self.test:
-                cmd.append("echo")
-            cmd.append(self.make_exe)
-            if self.mode == "clean":
-                cmd.append("clean")
-            print(f"{fc}{bc}cd {makefile_dir}{rs}", end="; ")
-            with path.Path(makefile_dir) as pp:
-                make_result = run_command(command=cmd, terminal_colors=self.terminal_colors)
-                if not check_make_was_clean(make_result=make_result) and self.mode != "clean":
-                    for sync_dir in self.synchronise_directories:
-                        sync_dir_base = Path(sync_dir.stem)
-                        # als we de make file inderdaad gedraaid hebben en we hebben een sync
-                        # directory, sync deze dan met de ccn output directory
-                        if sync_dir_base.exists():
-                            sync_cmd = self.make_sync_command(parent_path=pp,
-                                                              synchronize_directory=sync_dir_base)
-                            run_command(command=sync_cmd, terminal_colors=self.terminal_colors)
-
-    def make_sync_command(self, parent_path, synchronize_directory):
-        """
-        Maak een commando om een highcharts directory te synchroniseren met de ccn output
+        if makefile_directories is None:
+            makefile_directories = self.makefile_directories
+
+        if self.mode == "clean":
+            # make clean moet altijd gedraaid worden
+            up_to_date = {makefile_dir: None for makefile_dir in makefile_directories}
+        else:
+            up_to_date = self.query_makefiles(makefile_directories)
+
+        dirty_directories = [makefile_dir for makefile_dir in makefile_directories
+                             if not up_to_date[makefile_dir]]
+        for makefile_dir in dirty_directories:
+            self.build_cache.add_trigger("make", makefile_dir)
+        n_skipped = len(makefile_directories) - len(dirty_directories)
+        if n_skipped > 0:
+            print(f"Skipped {n_skipped} of {len(makefile_directories)} makefile directories "
+                  f"which are up to date")
+
+        if self.jobs == 1 or len(dirty_directories) < 2:
+            for makefile_dir in dirty_directories:
+                self.launch_makefile(makefile_dir, up_to_date=up_to_date[makefile_dir])
+            return
+
+        n_workers = min(self.jobs, len(dirty_directories))
+        _logger.info(f"Running {len(dirty_directories)} makefile directories with "
+                     f"{n_workers} jobs")
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(self.launch_makefile, makefile_dir, True,
+                                       up_to_date[makefile_dir])
+                       for makefile_dir in dirty_directories]
+            for future in futures:
+                future.result()
+
+    @traced_stage
+    def query_makefiles(self, makefile_directories=None):
+        """
+        Vraag voor alle makefile directories tegelijk of ze up to date zijn
 
         Args:
-            parent_path: Path
-                Het pad van de makefile, hebben we nodig om te kijken hoeveel niveau we omhoog
-                moeten
-            synchronize_directory: Path
-                Directory we want to synchronise
+            makefile_directories: list or None
+                De directories. Default alle makefile directories
 
+        Returns: dict
+            Per makefile directory het resultaat van :func:`query_make_up_to_date`
         """
-        sync_cmd = []
-        this_parent = Path(parent_path)
-        n_up_dir = Path(".")
-        while this_parent != Path(""):
-            n_up_dir = Path("..") / n_up_dir
-            this_parent = this_parent.parent
 
-        ccn_sync_dir = self.ccn_output_directory / synchronize_directory
+        def query(makefile_dir):
+            with self.tracer.span(f"make -q {makefile_dir}", category="command") as info:
+                info["up_to_date"] = query_make_up_to_date(self.make_exe, makefile_dir)
+            return info["up_to_date"]
+
+        if makefile_directories is None:
+            makefile_directories = self.makefile_directories
+        n_workers = max(1, min(32, len(makefile_directories)))
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            results = executor.map(query, makefile_directories)
+            up_to_date = dict(zip(makefile_directories, results))
+        for makefile_dir, clean in up_to_date.items():
+            _logger.debug(f"Makefile directory {makefile_dir} up to date: {clean}")
+        return up_to_date
+
+    @traced_stage
+    def launch_makefile(self, makefile_dir, group_output=False, up_to_date=None):
+        """
+        Run make in één directory en synchroniseer de highcharts/tabellen als er iets gebouwd is
 
-        if self.test:
-            sync_cmd.append("echo")
+        Args:
+            makefile_dir: str or Path
+                Directory met de Makefile. Het commando wordt in deze directory gedraaid via de
+                *cwd* van het proces, zodat we de werkdirectory van het hele proces niet hoeven te
+                veranderen.
+            group_output: bool
+                Verzamel alle output en print die pas als de directory klaar is
+            up_to_date: bool or None
+                Resultaat van de 'make -q' vraag. Bij False weten we al dat make iets bouwt; bij
+                None kijken we naar de output van make om dat te bepalen
+
+        Returns: bool
+            True als make iets gedaan heeft
+        """
+        fc = self.terminal_colors.foreground_color
+        bc = self.terminal_colors.background_color
+        rs = self.terminal_colors.reset_colors
 
-        # gebruik robocopy op windows, rsync op linux
-        if self.platform_is_windows:
-            sync_cmd.append("Robocopy.exe")
+        output = list() if group_output else None
+        makefile_path = Path(makefile_dir)
+
+        cmd = []
+        if self.test:
+            cmd.append("echo")
+        cmd.append(self.make_exe)
+        if self.mode == "clean":
+            cmd.append("clean")
+        echo_cd = f"{fc}{bc}cd {makefile_dir}{rs}; "
+        if output is not None:
+            output.append(echo_cd)
+        else:
+            print(echo_cd, end="")
+
+        # in de artifact cache staan de outputs van make onder een hash van de files in de
+        # directory en de opgegeven inputs daarbuiten. Zonder opgegeven inputs en outputs weten we
+        # niet wat make leest en schrijft, en gebruiken we de cache niet
+        artifacts = self.makefile_artifacts.get(normalise_directory(makefile_dir))
+        use_artifacts = self.artifact_cache is not None and artifacts is not None and \
+            self.mode != "clean" and not self.test
+        if use_artifacts:
+            fingerprint = self.makefile_fingerprint(makefile_path, artifacts)
+        if use_artifacts and self.fetch_artifacts("make", fingerprint, Path("."),
+                                                  tool=self.make_exe):
+            message = f"make {makefile_dir}: outputs taken from the artifact cache"
+            if output is not None:
+                output.append(message)
+            else:
+                print(message)
+            rebuilt = True
         else:
-            sync_cmd.append("rsync")
-            sync_cmd.append("-arv")
+            make_result = self.execute(command=cmd, stage=f"make {makefile_dir}",
+                                       cwd=makefile_path, output=output)
+            if up_to_date is None:
+                rebuilt = not check_make_was_clean(make_result=make_result)
+            else:
+                rebuilt = not up_to_date
+            if use_artifacts and make_result.returncode == 0:
+                made = {normalise_directory(path): path
+                        for path in expand_patterns(artifacts["outputs"])}
+                if not made or any(name.startswith("../") for name in made):
+                    _logger.warning(f"Not storing the outputs of make {makefile_dir}: the "
+                                    f"outputs {artifacts['outputs']} match no files inside the "
+                                    f"report directory")
+                else:
+                    self.store_artifacts("make", fingerprint, made, tool=self.make_exe)
+        if rebuilt and self.mode != "clean":
+            # als we de make file inderdaad gedraaid hebben en we hebben een sync directory, sync
+            # deze dan met de ccn output directory
+            self.synchronise_makefile_directory(makefile_path, output=output)
+
+        if output is not None:
+            with _print_lock:
+                # de cd regel eindigt op '; ' en hoort op dezelfde regel als het commando
+                print(output[0] + "\n".join(output[1:]))
+        return rebuilt
+
+    def makefile_fingerprint(self, makefile_dir, artifacts):
+        """
+        Geef de fingerprint van een makefile directory voor de artifact cache
 
-        # paden toevoegen
-        sync_cmd.append(synchronize_directory.as_posix() + "/")
-        sync_cmd.append((n_up_dir / ccn_sync_dir).as_posix())
+        Args:
+            makefile_dir: Path
+                De directory met de Makefile
+            artifacts: dict
+                De glob patronen van de inputs en outputs, zie :func:`read_makefiles`
+
+        Returns: str
+            Een hash over alle files in de directory behalve de outputs, de opgegeven inputs en
+            de patronen zelf
+        """
+        outputs = {normalise_directory(path) for path in expand_patterns(artifacts["outputs"])}
+        files = [makefile_dir / relative
+                 for relative in scan_tree(makefile_dir, exclude=(".*", "*.pyc"))]
+        inputs = [path for path in files if normalise_directory(path) not in outputs]
+        inputs += expand_patterns(artifacts["inputs"])
+        return self.build_cache.fingerprint(inputs=inputs, settings=artifacts)
+
+    @traced_stage
+    def synchronise_makefile_directories(self):
+        """
+        Synchroniseer alle makefile directories met de ccn directory zonder make te draaien,
+        bijvoorbeeld omdat make al door ``latex2ccn batch`` gedraaid is
+        """
+        self.ccn_output_directory.mkdir(exist_ok=True)
+        for makefile_dir in self.makefile_directories:
+            self.synchronise_makefile_directory(Path(makefile_dir))
 
-        # Either Robocopy switches or rsync switches to exclude json
-        if self.platform_is_windows:
-            sync_cmd.append("/E")
-            sync_cmd.append("/NDL")
-            sync_cmd.append("/XF")
-        else:
-            sync_cmd.append("--exclude")
+    @traced_stage
+    def synchronise_makefile_directory(self, makefile_dir, output=None):
+        """
+        Synchroniseer de highcharts en tabellen directories van een makefile directory met de ccn
+        output directory
 
-        sync_cmd.append("*.json")
+        Alle directories worden tegelijk gesynchroniseerd. Per paar van bron en doel houden we in
+        de build cache bij welke files gekopieerd zijn, zodat we met sync_delete alleen files
+        verwijderen die vanuit dezelfde bron kwamen.
 
-        return sync_cmd
+        Args:
+            makefile_dir: Path
+                De directory met de Makefile
+            output: list or None
+                Als een lijst gegeven wordt, wordt de output hieraan toegevoegd in plaats van
+                direct geprint
+        """
+        fc = self.terminal_colors.foreground_color
+        bc = self.terminal_colors.background_color
+        rs = self.terminal_colors.reset_colors
 
+        pairs = []
+        for sync_dir in self.synchronise_directories:
+            sync_dir_base = Path(sync_dir.stem)
+            source = Path(makefile_dir) / sync_dir_base
+            if not source.exists():
+                continue
+            destination = self.ccn_output_directory / sync_dir_base
+            manifest_key = hashlib.sha256(
+                f"{source.absolute().as_posix()}:{destination.absolute().as_posix()}".encode(
+                    "utf-8")).hexdigest()
+            manifest_file = self.build_cache.cache_directory / Path("sync") / Path(
+                manifest_key + ".json")
+            pairs.append((source, destination, manifest_file))
+
+        results = synchronise_directories(pairs, delete=self.sync_delete,
+                                          hardlink=self.sync_hardlinks, test=self.test)
+        for result in results:
+            lines = [f"{fc}{bc}{result.summary()}{rs}"] + result.copied
+            lines += [f"deleting {relative}" for relative in result.deleted]
+            for line in lines:
+                if output is not None:
+                    output.append(line)
+                else:
+                    _print_line(line)
+
+    @traced_stage
     def launch_latexmk_for_html(self):
         """
         Run latexmk voor de tex file in de html output directory
@@ -569,7 +1360,6 @@ class LaTeXMLSuite:
             cmd.append("echo")
 
         out_dir = Path(self.output_directory_html)
-        out_dir.mkdir(exist_ok=True)
         main_file = out_dir / Path(self.main_file_name)
         cmd.append("latexmk")
         cmd.append(f"{main_file}")
@@ -577,15 +1367,37 @@ class LaTeXMLSuite:
         cmd.append("-shell-escape")
         cmd.append(f"-output-directory={out_dir}")
 
+        self.prepare_main_for_latexml()
+
+        # latexmk houdt zelf de hashes van alle bronbestanden bij in zijn fdb_latexmk file
+        self.execute_latexmk(command=cmd, stage="latexmk_html",
+                             tex_file=main_file.with_suffix(".tex"))
+
+    @traced_stage
+    def prepare_main_for_latexml(self):
+        """
+        Schrijf de main file van de html variant, zonder grafieken en tabellen
+
+        latexml leest alleen deze tex file en de files die erin ingelezen worden; de aux, bbl en
+        toc files van xelatex gebruikt latexml niet. Daarom is een eigen latexmk run voor de html
+        variant alleen nodig met de optie latexmk_html
+        """
+        out_dir = Path(self.output_directory_html)
+        out_dir.mkdir(exist_ok=True)
+        main_file = out_dir / Path(self.main_file_name)
+
         # lees de inhoud van main en pas de opties aan om grafieken en tabellen weg te laten
-        if update_target_compared_to_source(self.main_file_name, main_file):
+        fingerprint = self.build_cache.fingerprint(
+            inputs=[self.main_file_name], settings=dict(include_graphs=self.include_graphs))
+        if not self.build_cache.is_up_to_date("copy_main_for_latexml", fingerprint,
+                                              outputs=[main_file]):
             copy_main_for_latexml(tex_input_file=self.main_file_name, tex_output_file=main_file,
                                   include_graphics=self.include_graphs)
+            self.build_cache.update("copy_main_for_latexml", fingerprint)
         else:
             _logger.debug(f"No update need for {self.main_file_name} compared to {main_file}")
 
-        run_command(command=cmd, terminal_colors=self.terminal_colors)
-
+    @traced_stage
     def copy_pdf(self):
         """
         Kopieer de volledige pdf voor ccn (dus met de plaatjes)
@@ -594,20 +1406,27 @@ class LaTeXMLSuite:
         main_file = out_dir / Path(self.main_file_name)
 
         pdf_file = main_file.with_suffix(".pdf")
+        if self.partial:
+            print(f"The partial pdf is in {self.output_directory_partial}; the pdf in "
+                  f"{self.ccn_output_directory} is not updated")
+            return
         if not pdf_file.exists():
             self.launch_latexmk()
         ccn_pdf = self.ccn_output_directory / Path(self.output_filename)
 
-        update_pdf = update_target_compared_to_source(pdf_file, ccn_pdf)
+        fingerprint = self.build_cache.fingerprint(inputs=[pdf_file],
+                                                   settings=dict(ccn_pdf=ccn_pdf.as_posix()))
 
-        if update_pdf:
+        if not self.build_cache.is_up_to_date("copy_pdf", fingerprint, outputs=[ccn_pdf]):
             print(f"mkdir {ccn_pdf.parent}; cp {pdf_file} {ccn_pdf}")
             if not self.test:
                 ccn_pdf.parent.mkdir(parents=True, exist_ok=True)
                 shutil.copy2(pdf_file.as_posix(), ccn_pdf.as_posix())
+                self.build_cache.update("copy_pdf", fingerprint)
         else:
             _logger.debug(f"No update need for {ccn_pdf} compared to {pdf_file}")
 
+    @traced_stage
     def launch_latexml_bibtex(self):
         cmd = []
 
@@ -617,20 +1436,33 @@ class LaTeXMLSuite:
         references = self.bibtex_file
         self.xml_refs = self.output_directory_html / Path(references + ".xml")
 
-        if update_target_compared_to_source(references, self.xml_refs):
-            cmd.append("latexml")
-            if self.platform_is_windows:
-                cmd[-1] += ".bat"
-            cmd.append(f"--dest={self.xml_refs.as_posix()}")
-            cmd.append(f"--preload=hyperref.sty")
-            cmd.append(f"{references}")
-
-            run_command(command=cmd, terminal_colors=self.terminal_colors)
-            self.updated_references = True
+        cmd.append("latexml")
+        if self.platform_is_windows:
+            cmd[-1] += ".bat"
+        cmd.append(f"--dest={self.xml_refs.as_posix()}")
+        cmd.append(f"--preload=hyperref.sty")
+        cmd.append(f"{references}")
+
+        fingerprint = self.build_cache.fingerprint(inputs=[references], settings=cmd)
+        if not self.build_cache.is_up_to_date("latexml_bibtex", fingerprint,
+                                              outputs=[self.xml_refs]):
+            outputs = {self.xml_refs.name: self.xml_refs}
+            if self.fetch_artifacts("latexml_bibtex", fingerprint, outputs, tool="latexml"):
+                print(f"Using {self.xml_refs} from the artifact cache")
+                self.build_cache.update("latexml_bibtex", fingerprint)
+                self.updated_references = True
+            else:
+                result = self.execute_latexml(command=cmd, stage="latexml_bibtex")
+                # bij een mislukte conversie zijn de referenties niet bijgewerkt
+                self.updated_references = result.returncode == 0
+                if result.returncode == 0:
+                    self.build_cache.update("latexml_bibtex", fingerprint)
+                    self.store_artifacts("latexml_bibtex", fingerprint, outputs, tool="latexml")
         else:
             _logger.debug(f"No update need for {self.xml_refs} compared to {references}")
             self.updated_references = False
 
+    @traced_stage
     def launch_latexml(self):
         cmd = []
 
@@ -648,43 +1480,262 @@ class LaTeXMLSuite:
         cmd.append(f"--dest={xml_file.as_posix()}")
         cmd.append(f"{main_file.as_posix()}")
 
-        if update_target_compared_to_source(main_file, xml_file) or self.updated_references or \
+        # alle files die via de main file ingelezen worden (secties, tabellen, plaatjes, lokale
+        # class files) bepalen of we opnieuw moeten converteren. De xml van de referenties hoort
+        # ook bij de inputs, zodat een gewijzigde bibliografie een nieuwe conversie geeft
+        tex_file = main_file.with_suffix(".tex")
+        inputs = self.dependency_scanner.dependencies(tex_file)
+        if self.xml_refs is not None:
+            inputs.append(self.xml_refs)
+        fingerprint = self.build_cache.fingerprint(
+            inputs=inputs, settings=dict(cmd=cmd, per_chapter=self.latexml_per_chapter))
+
+        if not self.build_cache.is_up_to_date("latexml", fingerprint, outputs=[xml_file]) or \
                 self.force_html:
-            run_command(command=cmd, terminal_colors=self.terminal_colors)
+            outputs = {xml_file.name: xml_file}
+            if not self.force_html and self.fetch_artifacts("latexml", fingerprint, outputs,
+                                                            tool="latexml"):
+                print(f"Using {xml_file} from the artifact cache")
+                self.build_cache.update("latexml", fingerprint)
+                return
+            partial = False
+            if self.latexml_per_chapter or self.partial:
+                success = self.launch_latexml_per_chapter(main_file=tex_file, xml_file=xml_file)
+                partial = success and self.partial
+            else:
+                success = False
+            if not success:
+                result = self.execute_latexml(command=cmd, stage="latexml")
+                success = result.returncode == 0
+            if partial:
+                # main.xml kan nu oude xml van de andere hoofdstukken bevatten, dus de volgende
+                # volledige build moet de delen opnieuw samenvoegen
+                self.build_cache.update("latexml", "partial")
+            elif success:
+                self.build_cache.update("latexml", fingerprint)
+                self.store_artifacts("latexml", fingerprint, outputs, tool="latexml")
         else:
             _logger.info(f"No update need for {xml_file} compared to {main_file}")
 
-    def launch_latexml_post(self):
-        cmd = []
+    @traced_stage
+    def launch_latexml_per_chapter(self, main_file, xml_file):
+        """
+        Converteer ieder hoofdstuk van het document als een aparte latexml job
 
-        if self.test:
-            cmd.append("echo")
+        De body van het document wordt gesplitst bij elke \\include of \\input regel. Ieder deel
+        wordt met de preamble van het document als fragment geconverteerd, met de tellers zoals
+        die aan het begin van het deel staan, zie :mod:`latexmlsuite.chapters`. De xml van een deel
+        wordt bewaard onder een hash van de preamble, het deel en alle files die het deel inleest,
+        zodat alleen gewijzigde hoofdstukken opnieuw geconverteerd worden. De jobs draaien
+        tegelijk met maximaal *jobs* latexml processen. Daarna worden alle delen samengevoegd tot
+        de xml file die latexmlpost inleest.
 
-        cmd.append("latexmlpost")
+        Bij een gedeeltelijke build worden alleen de gekozen hoofdstukken geconverteerd. Voor een
+        ander deel dat niet in de cache staat, wordt de xml van zijn vorige conversie gebruikt,
+        zodat de referenties naar dat deel blijven werken. Met test worden de delen niet
+        geschreven en worden alleen de commando's getoond.
+
+        Args:
+            main_file: Path
+                De tex file in de html output directory
+            xml_file: Path
+                De xml file voor het hele document
+
+        Returns: bool
+            True als het gelukt is. Bij False moet het document in één keer geconverteerd worden
+        """
+        with open(main_file, "r") as stream:
+            preamble, parts, postamble = split_document(stream.read())
+        if not parts:
+            _logger.warning(f"Could not split {main_file} in chapters. Converting in one go")
+            return False
+
+        parts_dir = self.output_directory_html / Path("chapters")
+        chapter_cache_dir = self.build_cache.cache_directory / Path("chapters")
+        preamble_file = parts_dir / Path("preamble.tex")
+        postamble_file = parts_dir / Path("postamble.tex")
+        if not self.test:
+            parts_dir.mkdir(parents=True, exist_ok=True)
+            chapter_cache_dir.mkdir(parents=True, exist_ok=True)
+            write_file_if_changed(preamble_file, preamble)
+            write_file_if_changed(postamble_file, postamble)
+        # de afhankelijkheden volgen uit de tekst, zodat de delen er met test niet hoeven te zijn
+        preamble_inputs = self.dependency_scanner.text_dependencies(preamble, parts_dir)
+
+        latexml = "latexml"
         if self.platform_is_windows:
-            cmd[-1] += ".bat"
+            latexml += ".bat"
+
+        jobs = []
+        n_chapters = 0
+        counters = dict()
+        after_appendix = False
+        for part in parts:
+            if contains_appendix(part.text):
+                after_appendix = True
+                n_chapters = 0
+            part.chapters_before = n_chapters
+            part.after_appendix = after_appendix
+
+            part_inputs = self.dependency_scanner.text_dependencies(part.text, parts_dir)
+            contents = [part.text]
+            for tex_file in part_inputs:
+                if tex_file.suffix == ".tex":
+                    with open(tex_file, "r", errors="replace") as stream:
+                        contents.append(stream.read())
+            # alleen een deel dat een hoofdstuk voortzet, hangt af van de tellers van de delen
+            # ervoor; de andere delen blijven zo in de cache als een eerder hoofdstuk verandert
+            if continues_chapter("\n".join(contents)):
+                part.counters = counters
+            for content in contents:
+                n_chapters += count_chapters(content)
+                counters = advance_counters(counters, content)
+
+            part_file = parts_dir / Path(part.name + ".tex")
+            if not self.test:
+                write_file_if_changed(part_file, part.fragment())
+
+            fingerprint = self.build_cache.fingerprint(
+                inputs=preamble_inputs + part_inputs,
+                settings=dict(preamble=preamble, fragment=part.fragment(), latexml=latexml))
+            cached_xml = chapter_cache_dir / Path(fingerprint + ".xml")
+            hit = cached_xml.exists() and not self.force_html
+            self.build_cache.register("latexml_chapter", hit)
+            if not hit and not self.force_html:
+                hit = self.fetch_artifacts("latexml_chapter", fingerprint,
+                                           {"part.xml": cached_xml}, tool="latexml")
+            if hit:
+                _logger.debug(f"Using cached xml for {part.name}")
+                jobs.append((part, part_file, cached_xml, None))
+                continue
+            # de xml van de laatste conversie van dit deel
+            part_xml = part_file.with_suffix(".xml")
+            if self.partial and include_name(part.text) not in self.partial_chapters and \
+                    part_xml.exists():
+                _logger.debug(f"Using the previous xml of {part.name}, which is not selected")
+                jobs.append((part, part_file, part_xml, None))
+                continue
+            # de secties van het hoofdstuk zeggen meer dan de gegenereerde part file
+            for tex_file in part_inputs:
+                self.build_cache.add_trigger("latexml_chapter", tex_file)
 
+            cmd = []
+            if self.test:
+                cmd.append("echo")
+            cmd.append(latexml)
+            cmd.append("--whatsin=fragment")
+            cmd.append(f"--preamble={preamble_file.as_posix()}")
+            cmd.append(f"--postamble={postamble_file.as_posix()}")
+            cmd.append(f"--dest={part_xml.as_posix()}")
+            cmd.append(f"{part_file.as_posix()}")
+            jobs.append((part, part_file, cached_xml, cmd))
+
+        to_convert = [job for job in jobs if job[3] is not None]
+        print(f"Converting {len(to_convert)} of {len(jobs)} document parts with latexml")
+
+        def convert(job, group_output):
+            part, part_file, cached_xml, cmd = job
+            output = list() if group_output else None
+            result = self.execute_latexml(command=cmd, stage=f"latexml {part.name}",
+                                          output=output)
+            if output is not None:
+                with _print_lock:
+                    print("\n".join(output))
+            part_xml = part_file.with_suffix(".xml")
+            if self.test or result.returncode != 0 or not part_xml.exists():
+                return False
+            # eerst naar een tijdelijke file kopiëren, zodat de cache nooit een halve file bevat
+            tmp_xml = cached_xml.with_suffix(f".{os.getpid()}.tmp")
+            shutil.copyfile(part_xml, tmp_xml)
+            os.replace(tmp_xml, cached_xml)
+            # de naam van de file in de chapter cache is de fingerprint van het deel
+            self.store_artifacts("latexml_chapter", cached_xml.stem, {"part.xml": cached_xml},
+                                 tool="latexml")
+            return True
+
+        n_workers = max(1, min(self.jobs, len(to_convert)))
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(lambda job: convert(job, n_workers > 1), to_convert))
+
+        if self.test:
+            return True
+        if not all(results):
+            failed = [job[0].name for job, ok in zip(to_convert, results) if not ok]
+            _logger.warning(f"Conversion of {', '.join(failed)} failed. Converting in one go")
+            return False
+
+        assemble_document([job[2] for job in jobs], xml_file)
+        return True
+
+    @traced_stage
+    def launch_latexmlc(self):
+        """
+        Converteer de tex direct naar de gesplitste html pagina's met één latexmlc proces
+
+        De conversie en de post processing gebeuren in hetzelfde proces, zodat de document boom
+        maar één keer opgebouwd wordt en er geen main.xml geschreven en weer ingelezen hoeft te
+        worden. Als de LaTeXML server gebruikt wordt, gaat de conversie naar de server; als die
+        niet gestart kan worden of de conversie via de server mislukt, draait latexmlc zelf.
+
+        Returns: bool
+            False als de html up to date was en er niets gedaan is, of als de conversie mislukt is
+        """
         out_dir = self.output_directory_html
-        main_file = out_dir / Path(self.main_file_name)
+        main_file = (out_dir / Path(self.main_file_name)).with_suffix(".tex")
         html_file = self.ccn_html_dir / Path(main_file.stem).with_suffix(".html")
         self.ccn_html_dir.mkdir(exist_ok=True, parents=True)
-        xml_file = main_file.with_suffix("")
-
-        cmd.append(f"--dest={html_file.as_posix()}")
-        cmd.append(f"{xml_file}")
 
+        arguments = [f"--dest={html_file.as_posix()}"]
         if self.xml_refs is not None:
-            cmd.append(f"--bibliography={self.xml_refs.as_posix()}")
-
+            arguments.append(f"--bibliography={self.xml_refs.as_posix()}")
         if not self.merge_chapters:
-            cmd.append("--split")
-            cmd.append("--splitat")
-            cmd.append("chapter")
-
-        run_command(command=cmd, terminal_colors=self.terminal_colors)
+            arguments.extend(["--split", "--splitat=chapter"])
+        arguments.append(main_file.as_posix())
 
+        inputs = self.dependency_scanner.dependencies(main_file)
+        if self.xml_refs is not None:
+            inputs.append(self.xml_refs)
+        fingerprint = self.build_cache.fingerprint(inputs=inputs,
+                                                   settings=dict(latexmlc=arguments))
+        prefix = main_file.stem
+        outputs = [html_file] + sorted(self.ccn_html_dir.glob(f"{prefix}_*.html"))
+        if not self.force_html and self.build_cache.is_up_to_date("latexmlc", fingerprint,
+                                                                  outputs=outputs):
+            _logger.info(f"No update needed for {html_file} compared to {main_file}")
+            self.produced_html_files = set(outputs[1:])
+            return False
+
+        echo = ["echo"] if self.test else []
+        result = None
+        if self.latexml_server is not None and (self.test or
+                                                self.latexml_server.ensure_running()):
+            cmd = echo + self.latexml_server.client_command(arguments, output_format="html5")
+            result = self.execute(command=cmd, stage="latexmlc server")
+            if result.returncode != 0 and not self.test:
+                _logger.warning("Conversion by the LaTeXML server failed for latexmlc. "
+                                "Running latexmlc itself")
+                result = None
+        if result is None:
+            latexmlc = "latexmlc"
+            if self.platform_is_windows:
+                latexmlc += ".bat"
+            cmd = echo + [latexmlc, "--format=html5"] + arguments
+            result = self.execute(command=cmd, stage="latexmlc")
+        if result.returncode != 0:
+            _logger.warning(f"latexmlc failed for {main_file}; the html in {self.ccn_html_dir} "
+                            f"is not updated")
+            return False
+        if not self.test:
+            self.build_cache.update("latexmlc", fingerprint)
+        return True
+
+    @traced_stage
     def launch_latexmk(self):
 
+        if self.partial and self.mode in ("latex", "all"):
+            self.launch_latexmk_partial()
+            return
+
         cmd = []
 
         main_base = self.main_file_name.stem
@@ -704,10 +1755,244 @@ class LaTeXMLSuite:
         else:
             raise AssertionError("Alleen aanroepen voor all en clean")
 
-        run_command(command=cmd, terminal_colors=self.terminal_colors)
+        self.execute_latexmk(command=cmd, stage="latexmk", tex_file=Path(f"{main_base}.tex"),
+                             watch_line=self.latexmk_pass_watcher())
+
+    def execute_latexmk(self, command, stage, tex_file, watch_line=None):
+        """
+        Draai latexmk, met de format van de preamble als precompile_preamble aan staat
+
+        Args:
+            command: list
+                Het latexmk commando
+            stage: str
+                Naam van de stage
+            tex_file: Path
+                De tex file die gecompileerd wordt
+            watch_line: callable or None
+                Wordt met iedere regel output van latexmk aangeroepen
+
+        Returns: CommandResult
+        """
+        format_file = None
+        if self.preamble_format is not None and self.mode != "clean":
+            with self.tracer.span("preamble_format"):
+                format_file = self.preamble_format.ensure(tex_file, execute=self.execute)
+        if format_file is not None:
+            command = command + self.preamble_format.latexmk_options(format_file)
+        result = self.execute(command=command, stage=stage, watch_line=watch_line)
+        if format_file is not None:
+            self.report_format_saving(stage, tex_file)
+        return result
+
+    def report_format_saving(self, stage, tex_file):
+        """Laat zien hoeveel tijd de format van de preamble in een latexmk run bespaard heeft"""
+        log_name = re.sub(r"[^\w.-]+", "_", stage).strip("_")
+        n_passes = count_passes(self.log_directory / Path(log_name + ".log"))
+        saved = self.preamble_format.saved_per_pass(tex_file)
+        print(f"{stage}: {n_passes} xelatex passes with the precompiled preamble, about "
+              f"{saved:.2f} s saved per pass ({n_passes * saved:.1f} s in total)")
+
+
+def _print_line(line):
+    """Print een regel in één keer, ook als er meerdere processen tegelijk output geven"""
+    with _print_lock:
+        print(line)
+
+
+def _ignore_line(line):
+    pass
+
+
+def wait_for_process(process):
+    """
+    Wacht tot een proces klaar is en geef de exit status en het resource gebruik
+
+    Op posix systemen gebruiken we wait4, zodat we de cpu tijd en het piek geheugen van precies
+    dit proces krijgen, ook als er tegelijk andere processen draaien.
+
+    Args:
+        process: subprocess.Popen
+            Het proces
+
+    Returns: tuple
+        (exit status, cpu tijd in seconden of None, piek rss in kB of None)
+    """
+    if not hasattr(os, "wait4"):
+        return process.wait(), None, None
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return process.wait(), None, None
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+    # laat Popen weten dat het proces al opgeruimd is
+    process.returncode = returncode
+    return returncode, usage.ru_utime + usage.ru_stime, max_rss_kb(usage)
+
+
+class CommandResult(list):
+    """
+    De output regels van een commando, met de exit status van het proces als extra attribuut
+
+    Om het geheugen te begrenzen bevat de lijst alleen de eerste OUTPUT_HEAD_LINES en de laatste
+    OUTPUT_TAIL_LINES regels. De volledige output staat in de log file van de stage. Een exit
+    status van None betekent dat het commando niet gestart kon worden
+    """
+
+    def __init__(self, lines=(), returncode=None, n_lines=None, cpu_time=None, max_rss_kb=None):
+        super().__init__(lines)
+        self.returncode = returncode
+        if n_lines is None:
+            n_lines = len(self)
+        self.n_lines = n_lines
+        # het resource gebruik van het proces zelf, als het platform dat kan geven
+        self.cpu_time = cpu_time
+        self.max_rss_kb = max_rss_kb
 
+    @property
+    def truncated(self):
+        return self.n_lines > len(self)
+
+
+class OutputPipeline:
+    """
+    Verwerk de output van een proces terwijl het proces nog draait
+
+    Een reader thread leest de pipe van het proces in blokken en zet die in een begrensde
+    queue, zodat het proces nooit hoeft te wachten op een trage terminal. De aanroepende thread
+    decodeert de blokken met een incrementele UTF-8 decoder (een teken dat over twee blokken
+    verdeeld is gaat dus niet mis), schrijft alles gebufferd naar de log file en bewaart alleen
+    het begin en het einde van de output in het geheugen.
+
+    Args:
+        stream: file object
+            De stdout pipe van het proces
+        write_line: callable or None
+            Wordt per regel aangeroepen om de regel te laten zien. Bij None wordt een compacte
+            voortgangsregel geprint
+        log_file: Path or None
+            File waarin de volledige output geschreven wordt
+        label: str
+            Naam van de stage in de voortgangsregel
+        watch_line: callable or None
+            Wordt ook per regel aangeroepen, bijvoorbeeld om de voortgang van latexmk te volgen
+    """
+
+    def __init__(self, stream, write_line=None, log_file=None, label="", watch_line=None):
+        self.stream = stream
+        self.write_line = write_line
+        self.watch_line = watch_line
+        self.log_file = log_file
+        self.label = label
+        self.head = list()
+        self.tail = collections.deque(maxlen=OUTPUT_TAIL_LINES)
+        self.n_lines = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._queue = queue.Queue(maxsize=OUTPUT_QUEUE_SIZE)
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._last_progress = 0.0
+
+    def _read(self):
+        read = getattr(self.stream, "read1", self.stream.read)
+        try:
+            for chunk in iter(lambda: read(READ_CHUNK_SIZE), b""):
+                self._queue.put(chunk)
+        finally:
+            self._queue.put(None)
+
+    def _add_line(self, line, log_stream):
+        if log_stream is not None:
+            log_stream.write(line)
+            log_stream.write("\n")
+        clean_line = line.strip()
+        self.n_lines += 1
+        if len(self.head) < OUTPUT_HEAD_LINES:
+            self.head.append(clean_line)
+        else:
+            self.tail.append(clean_line)
+        if self.watch_line is not None:
+            self.watch_line(clean_line)
+        if self.write_line is not None:
+            self.write_line(clean_line)
+        else:
+            self._show_progress()
 
-def run_command(command, shell=False, terminal_colors=None):
+    def _show_progress(self, final=False):
+        now = time.monotonic()
+        if not final and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        with _print_lock:
+            sys.stdout.write(f"\r{self.label}: {self.n_lines} lines")
+            if final:
+                sys.stdout.write("\n")
+            sys.stdout.flush()
+
+    def run(self):
+        """
+        Verwerk alle output tot de pipe gesloten wordt
+
+        Returns: list
+            De bewaarde regels: het begin en het einde van de output
+        """
+        log_stream = None
+        if self.log_file is not None:
+            self.log_file.parent.mkdir(parents=True, exist_ok=True)
+            log_stream = open(self.log_file, "w", encoding="utf-8", buffering=LOG_BUFFER_SIZE)
+        self._reader.start()
+        pending = ""
+        try:
+            for chunk in iter(self._queue.get, None):
+                pending += self._decoder.decode(chunk)
+                *lines, pending = pending.split("\n")
+                for line in lines:
+                    self._add_line(line, log_stream)
+            pending += self._decoder.decode(b"", final=True)
+            if pending:
+                self._add_line(pending, log_stream)
+        finally:
+            if log_stream is not None:
+                log_stream.close()
+        self._reader.join()
+        if self.write_line is None:
+            self._show_progress(final=True)
+        return self.head + list(self.tail)
+
+
+def run_command(command, shell=False, terminal_colors=None, cwd=None, output=None, log_file=None,
+                quiet=False, label=None, watch_line=None):
+    """
+    Run een commando en geef de output regels terug
+
+    Args:
+        command: list
+            Het commando met zijn argumenten
+        shell: bool
+            Run het commando via de shell
+        terminal_colors: TerminalColors
+            Kleuren waarmee het commando geprint wordt
+        cwd: str or Path
+            Directory waarin het commando gedraaid wordt. Default de huidige directory
+        output: list or None
+            Als een lijst gegeven wordt, worden het commando en alle output regels hieraan
+            toegevoegd in plaats van direct geprint. Hiermee kan de output van parallelle
+            processen gegroepeerd worden
+        log_file: str or Path or None
+            File waarin de volledige output van het commando geschreven wordt
+        quiet: bool
+            Laat niet iedere regel zien, maar alleen een regel met het aantal regels output
+        label: str or None
+            Naam in de voortgangsregel van de quiet mode. Default het commando zelf
+        watch_line: callable or None
+            Wordt met iedere regel output aangeroepen, ook in de quiet mode
+
+    Returns: CommandResult
+        Het begin en het einde van de output van het commando, met de exit status in het
+        returncode attribuut
+    """
     if terminal_colors is not None:
         fc = terminal_colors.foreground_color
         bc = terminal_colors.background_color
@@ -716,28 +2001,44 @@ def run_command(command, shell=False, terminal_colors=None):
         fc = ""
         bc = ""
         rs = ""
-    all_output_lines = list()
+
+    if output is not None:
+        write_line = output.append
+    else:
+        write_line = _print_line
+
+    all_output_lines = CommandResult()
     if command[0] != "echo":
-        print(f"{fc}{bc}" + " ".join(command) + f"{rs}")
+        write_line(f"{fc}{bc}" + " ".join(command) + f"{rs}")
+    if log_file is not None:
+        log_file = Path(log_file)
     try:
         process = subprocess.Popen(command,
                                    stdout=subprocess.PIPE,
                                    stderr=subprocess.STDOUT,
                                    env=os.environ,
+                                   cwd=cwd,
                                    shell=shell)
 
     except FileNotFoundError as err:
         _logger.warning(f"Failed for '{command}' with error:\n{err}")
     else:
-        for line in iter(process.stdout.readline, b''):
-            try:
-                clean_line = line.decode('utf-8').strip()
-            except UnicodeDecodeError as err:
-                _logger.warning(err)
-                _logger.warning(line)
-            else:
-                print(clean_line)
-                all_output_lines.append(clean_line)
+        if quiet and output is None:
+            # de voortgangsregel is alleen zinvol als de output direct naar de terminal gaat
+            show_line = None
+        elif quiet:
+            show_line = _ignore_line
+        else:
+            show_line = write_line
+        if label is None:
+            label = command[0]
+        pipeline = OutputPipeline(stream=process.stdout, write_line=show_line,
+                                  log_file=log_file, label=label, watch_line=watch_line)
+        lines = pipeline.run()
+        process.stdout.close()
+        returncode, cpu_time, max_rss = wait_for_process(process)
+        all_output_lines = CommandResult(lines, returncode=returncode, n_lines=pipeline.n_lines,
+                                         cpu_time=cpu_time, max_rss_kb=max_rss)
 
     return all_output_lines
 
@@ -750,10 +2051,24 @@ class Settings:
         self.output_filename = None
         self.ccn_output_directory = None
         self.makefile_directories = None
+        self.jobs = None
+        self.latexml_per_chapter = False
+        self.latexml_server = False
+        self.latexml_server_port = None
+        self.single_pass = False
+        self.parallel_latexmlpost = False
+        self.latexmk_html = False
+        self.precompile_preamble = False
+        self.artifact_cache = None
+        self.artifact_cache_size = None
+        self.sync_delete = False
+        self.sync_hardlinks = False
+        self.clean_patterns = None
         self.post_scripts = None
         self.pre_scripts = None
         self.output_directory = None
         self.output_directory_html = None
+        self.output_directory_draft = None
 
         if settings_filename is not None:
             self.read_settings_file(settings_filename)
@@ -768,16 +2083,37 @@ class Settings:
         self.bibtex_file = general_settings.get("bibtex_file", self.main_name)
         self.ccn_output_directory = general_settings.get("ccn_output_directory", "ccn")
         self.makefile_directories = settings.get("makefiles")
+        self.jobs = general_settings.get("jobs", self.jobs)
+        self.latexml_per_chapter = general_settings.get("latexml_per_chapter",
+                                                        self.latexml_per_chapter)
+        self.latexml_server = general_settings.get("latexml_server", self.latexml_server)
+        self.latexml_server_port = general_settings.get("latexml_server_port",
+                                                        self.latexml_server_port)
+        self.single_pass = general_settings.get("single_pass", self.single_pass)
+        self.parallel_latexmlpost = general_settings.get("parallel_latexmlpost",
+                                                         self.parallel_latexmlpost)
+        self.latexmk_html = general_settings.get("latexmk_html", self.latexmk_html)
+        self.precompile_preamble = general_settings.get("precompile_preamble",
+                                                        self.precompile_preamble)
+        self.artifact_cache = general_settings.get("artifact_cache", self.artifact_cache)
+        self.artifact_cache_size = general_settings.get("artifact_cache_size",
+                                                        self.artifact_cache_size)
+        self.sync_delete = general_settings.get("sync_delete", self.sync_delete)
+        self.sync_hardlinks = general_settings.get("sync_hardlinks", self.sync_hardlinks)
         self.post_scripts = settings.get("postscripts")
+        self.clean_patterns = settings.get("clean")
         self.pre_scripts = settings.get("prescripts")
         out_def = Path(self.main_name).with_suffix(".pdf")
         self.output_filename = general_settings.get("output_filename", out_def)
         if cache_settings is not None:
             self.output_directory = cache_settings.get("output_directory", "out")
             self.output_directory_html = cache_settings.get("output_directory_html", "out_html")
+            self.output_directory_draft = cache_settings.get("output_directory_draft",
+                                                             "out_draft")
         else:
             self.output_directory = "out"
             self.output_directory_html = "out_html"
+            self.output_directory_draft = "out_draft"
 
     def report_settings(self):
         message = "{:40s} : {}"
@@ -785,8 +2121,21 @@ class Settings:
         _logger.debug(message.format("output_file_name", self.output_filename))
         _logger.debug(message.format("ccn_output_directory", self.ccn_output_directory))
         _logger.debug(message.format("makefile_directories", self.makefile_directories))
+        _logger.debug(message.format("jobs", self.jobs))
+        _logger.debug(message.format("latexml_per_chapter", self.latexml_per_chapter))
+        _logger.debug(message.format("latexml_server", self.latexml_server))
+        _logger.debug(message.format("latexml_server_port", self.latexml_server_port))
+        _logger.debug(message.format("single_pass", self.single_pass))
+        _logger.debug(message.format("parallel_latexmlpost", self.parallel_latexmlpost))
+        _logger.debug(message.format("latexmk_html", self.latexmk_html))
+        _logger.debug(message.format("precompile_preamble", self.precompile_preamble))
+        _logger.debug(message.format("artifact_cache", self.artifact_cache))
+        _logger.debug(message.format("artifact_cache_size", self.artifact_cache_size))
+        _logger.debug(message.format("sync_delete", self.sync_delete))
+        _logger.debug(message.format("sync_hardlinks", self.sync_hardlinks))
         _logger.debug(message.format("prescripts", self.pre_scripts))
         _logger.debug(message.format("postscripts", self.post_scripts))
+        _logger.debug(message.format("clean_patterns", self.clean_patterns))
 
 
 def main(args):
@@ -799,10 +2148,58 @@ def main(args):
       args (List[str]): command line parameters as list of strings
           (for example  ``["--verbose", "42"]``).
     """
+    if args and args[0] == "batch":
+        # batch maakt zelf gebruik van deze module, dus pas hier importeren
+        from latexmlsuite.batch import batch_main
+        setup_logging(logging.WARNING)
+        results = batch_main(args[1:])
+        if not all(result.success for result in results):
+            sys.exit(1)
+        return
+
+    if args and args[0] == "stats":
+        stats_args = parse_stats_args(args[1:])
+        setup_logging(logging.WARNING)
+        settings = Settings()
+        if Path(stats_args.settings_filename).exists():
+            settings.read_settings_file(stats_args.settings_filename)
+        # net als in LaTeXMLSuite heeft een draft zijn eigen build cache
+        if stats_args.draft:
+            output_directory = settings.output_directory_draft or "out_draft"
+        else:
+            output_directory = settings.output_directory_html or "out_html"
+        stats_main(stats_args, cache_directory=Path(output_directory) / CACHE_DIRECTORY_NAME)
+        return
+
     args = parse_args(args)
     setup_logging(args.loglevel)
-    settings = Settings(settings_filename=args.settings_filename)
     _logger.debug("Start here")
+
+    if not args.do_scripts:
+        args.do_prescripts = False
+        args.do_postscripts = False
+
+    if args.watch:
+        watch_report(lambda: create_suite(args), settings_filename=args.settings_filename,
+                     debounce=args.watch_debounce, poll=args.watch_poll)
+    else:
+        suite = create_suite(args)
+        suite.run()
+
+    _logger.info("Script ends here")
+
+
+def create_suite(args):
+    """
+    Lees de settings file en maak de suite met de command line argumenten
+
+    Args:
+        args: argparse.Namespace
+            De command line argumenten
+
+    Returns: LaTeXMLSuite
+    """
+    settings = Settings(settings_filename=args.settings_filename)
     settings.report_settings()
 
     if "win" in sys.platform:
@@ -810,14 +2207,22 @@ def main(args):
     else:
         platform_is_windows = False
 
-    if not args.do_scripts:
-        args.do_prescripts = False
-        args.do_postscripts = False
-
-    suite = LaTeXMLSuite(mode=args.mode,
+    # opties die niet op de command line gegeven zijn, komen uit de settings file
+    options = dict()
+    for name in ("jobs", "latexml_per_chapter", "sync_delete", "sync_hardlinks",
+                 "latexml_server", "single_pass", "parallel_latexmlpost", "latexmk_html",
+                 "precompile_preamble", "artifact_cache"):
+        options[name] = getattr(args, name)
+        if options[name] is None:
+            options[name] = getattr(settings, name)
+    if options["artifact_cache"] is None:
+        options["artifact_cache"] = os.environ.get(ARTIFACT_CACHE_VARIABLE) or None
+
+    return LaTeXMLSuite(mode=args.mode,
                          test=args.test,
                          make_exe=args.make_exe,
                          do_make=args.do_make,
+                         sync_makefiles=args.sync_makefiles,
                          do_postscripts=args.do_postscripts,
                          do_prescripts=args.do_prescripts,
                          do_latexml=args.do_latexml,
@@ -826,9 +2231,14 @@ def main(args):
                          bibtex_file=settings.bibtex_file,
                          output_directory=settings.output_directory,
                          output_directory_html=settings.output_directory_html,
+                         output_directory_draft=settings.output_directory_draft,
+                         draft_chapters=args.draft_chapters,
+                         only_chapters=args.only_chapters,
+                         only_sections=args.only_sections,
                          output_filename=settings.output_filename,
                          ccn_output_directory=settings.ccn_output_directory,
                          makefile_directories=settings.makefile_directories,
+                         jobs=options["jobs"],
                          pre_scripts=settings.pre_scripts,
                          post_scripts=settings.post_scripts,
                          include_graphs=args.include_graphs,
@@ -836,13 +2246,25 @@ def main(args):
                          foreground_color=args.foreground_color,
                          background_color=args.background_color,
                          use_terminal_colors=args.use_terminal_colors,
-                         force_html=args.force_html
+                         force_html=args.force_html,
+                         cache_stats=args.cache_stats,
+                         latexml_per_chapter=options["latexml_per_chapter"],
+                         sync_delete=options["sync_delete"],
+                         sync_hardlinks=options["sync_hardlinks"],
+                         clean_patterns=settings.clean_patterns,
+                         quiet=args.quiet,
+                         trace_file=args.trace,
+                         latexml_server=options["latexml_server"],
+                         latexml_server_port=settings.latexml_server_port,
+                         single_pass=options["single_pass"],
+                         parallel_latexmlpost=options["parallel_latexmlpost"],
+                         latexmk_html=options["latexmk_html"],
+                         precompile_preamble=options["precompile_preamble"],
+                         history=args.history,
+                         artifact_cache=options["artifact_cache"],
+                         artifact_cache_size=settings.artifact_cache_size
                          )
 
-    suite.run()
-
-    _logger.info("Script ends here")
-
 
 def run():
     """Calls :func:`main` passing the CLI arguments extracted from :obj:`sys.argv`
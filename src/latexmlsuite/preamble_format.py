@@ -0,0 +1,232 @@
+"""
+Precompile the preamble of a document into a xelatex format file
+
+Every xelatex pass reads the document class, the font setup and all packages of the preamble
+again, and latexmk does two to four passes per build. With ``precompile_preamble`` the preamble is
+dumped once into a format file with the ``mylatexformat`` package, and latexmk starts xelatex with
+``-fmt`` so the preamble is loaded from the format instead. When the document is compiled with
+the format, mylatexformat skips the preamble in the tex file.
+
+The format is stored in the cache directory and is made again when the text of the preamble,
+one of the class or package files it loads or the version of xelatex changes. When the format is
+made, the time to load the preamble with and without the format is measured once, so after each
+latexmk run the time saved per pass can be reported.
+
+Not every preamble can be dumped: fonts loaded by fontspec are not kept in a xetex format, for
+instance. If dumping fails, latexmk simply runs without the format until the preamble changes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from latexmlsuite.tex_dependencies import find_references, resolve_reference
+
+FORMAT_DIRECTORY_NAME = "formats"
+BEGIN_DOCUMENT_PATTERN = re.compile(r"^[^%\n]*?\\begin\s*\{document\}", re.MULTILINE)
+PASS_PATTERN = re.compile(r"Run number \d+ of rule '(?:pdf|xe|lua)?latex")
+PREAMBLE_KINDS = ("documentclass", "usepackage", "RequirePackage")
+
+_logger = logging.getLogger(__name__)
+
+
+def extract_preamble(tex_content):
+    """
+    Geef de preamble van een tex document: alles voor ``\\begin{document}``
+
+    Returns: str or None
+        De preamble, of None als het document geen ``\\begin{document}`` heeft
+    """
+    match = BEGIN_DOCUMENT_PATTERN.search(tex_content)
+    if match is None:
+        return None
+    return tex_content[:match.start() + match.group(0).index("\\begin")]
+
+
+def count_passes(log_file):
+    """
+    Tel het aantal latex passes in de log file van een latexmk run
+
+    Returns: int
+    """
+    try:
+        with open(log_file, "r", encoding="utf-8", errors="replace") as stream:
+            return sum(1 for line in stream if PASS_PATTERN.search(line))
+    except OSError:
+        return 0
+
+
+class PreambleFormat:
+    """
+    Maak en bewaar de format files van de preambles
+
+    Args:
+        build_cache: BuildCache
+            Voor de hashes van de files; de formats komen in de cache directory
+        engine: str
+            De latex engine
+        shell_escape: bool
+            Sta shell escape toe bij het maken van de format
+    """
+
+    def __init__(self, build_cache, engine="xelatex", shell_escape=True):
+        self.build_cache = build_cache
+        self.engine = engine
+        self.shell_escape = shell_escape
+        self.format_directory = build_cache.cache_directory / FORMAT_DIRECTORY_NAME
+        self._engine_version = None
+
+    def engine_version(self):
+        """De eerste regel van ``xelatex --version``, of None als xelatex er niet is"""
+        if self._engine_version is None:
+            try:
+                result = subprocess.run([self.engine, "--version"], stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, timeout=60)
+            except (OSError, subprocess.SubprocessError):
+                return None
+            lines = result.stdout.decode("utf-8", errors="replace").splitlines()
+            self._engine_version = lines[0] if lines else ""
+        return self._engine_version
+
+    def preamble_files(self, preamble, tex_file):
+        """
+        De class en package files die de preamble laadt
+
+        Lokale files worden net als door de dependency scanner gezocht, de rest met kpsewhich.
+
+        Returns: list
+            De gevonden files
+        """
+        files = set()
+        missing = list()
+        for kind, name in find_references(preamble):
+            if kind not in PREAMBLE_KINDS:
+                continue
+            found = resolve_reference(kind, name, [Path(tex_file).parent, Path(".")])
+            if found is not None:
+                files.add(found)
+            else:
+                extension = ".cls" if kind == "documentclass" else ".sty"
+                missing.append(name + extension)
+        if missing and shutil.which("kpsewhich") is not None:
+            result = subprocess.run(["kpsewhich"] + missing, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL)
+            files.update(Path(line) for line in
+                         result.stdout.decode("utf-8", errors="replace").splitlines() if line)
+        return sorted(files)
+
+    def format_name(self, tex_file):
+        """De naam van de format van een tex file; out/main en out_html/main krijgen er elk een"""
+        key = hashlib.sha256(Path(tex_file).absolute().as_posix().encode("utf-8")).hexdigest()
+        return f"{Path(tex_file).stem}_{key[:12]}"
+
+    def metadata_file(self, tex_file):
+        return self.format_directory / Path(self.format_name(tex_file) + ".json")
+
+    def read_metadata(self, tex_file):
+        try:
+            with open(self.metadata_file(tex_file), "r", encoding="utf-8") as stream:
+                return json.load(stream)
+        except (OSError, ValueError):
+            return dict()
+
+    def ensure(self, tex_file, execute):
+        """
+        Zorg dat er een actuele format voor de preamble van een tex file is
+
+        Args:
+            tex_file: Path
+                De tex file die door latexmk gecompileerd wordt
+            execute: callable
+                Draait een commando: ``execute(command=..., stage=...)``, zie
+                :meth:`LaTeXMLSuite.execute`
+
+        Returns: Path or None
+            De format file, of None als er geen format gebruikt kan worden
+        """
+        try:
+            with open(tex_file, "r", encoding="utf-8") as stream:
+                preamble = extract_preamble(stream.read())
+        except OSError:
+            return None
+        version = self.engine_version()
+        if preamble is None or version is None:
+            return None
+
+        name = self.format_name(tex_file)
+        format_file = self.format_directory / Path(name + ".fmt")
+        fingerprint = self.build_cache.fingerprint(
+            inputs=self.preamble_files(preamble, tex_file),
+            settings=dict(preamble=preamble, engine=version, shell_escape=self.shell_escape))
+        metadata = self.read_metadata(tex_file)
+        up_to_date = metadata.get("fingerprint") == fingerprint and (
+            format_file.exists() or not metadata.get("success"))
+        self.build_cache.register("preamble_format", up_to_date)
+        if up_to_date:
+            if metadata["success"]:
+                return format_file
+            _logger.debug(f"The preamble of {tex_file} could not be dumped before")
+            return None
+        self.build_cache.add_trigger("preamble_format", Path(tex_file).as_posix())
+
+        self.format_directory.mkdir(parents=True, exist_ok=True)
+        cmd = [self.engine, "-ini", "-interaction=nonstopmode", "-halt-on-error",
+               f"-jobname={name}", f"-output-directory={self.format_directory.as_posix()}"]
+        if self.shell_escape:
+            cmd.append("-shell-escape")
+        cmd += [f"&{self.engine}", "mylatexformat.ltx", Path(tex_file).as_posix()]
+        result = execute(command=cmd, stage=f"preamble_format {tex_file}")
+        success = result.returncode == 0 and format_file.exists()
+        metadata = dict(fingerprint=fingerprint, success=success)
+        if success:
+            metadata["saved_per_pass"] = self.measure_saving(preamble, format_file)
+            print(f"Precompiled the preamble of {tex_file} into {format_file}; about "
+                  f"{metadata['saved_per_pass']:.2f} s saved per pass")
+        else:
+            _logger.warning(f"Could not precompile the preamble of {tex_file}. Running latexmk "
+                            f"without a format until the preamble changes")
+        tmp_file = self.metadata_file(tex_file).with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as stream:
+            json.dump(metadata, stream, indent=1)
+        os.replace(tmp_file, self.metadata_file(tex_file))
+        return format_file if success else None
+
+    def measure_saving(self, preamble, format_file):
+        """
+        Meet hoeveel sneller een lege pagina met de format is dan met de volledige preamble
+
+        Returns: float
+            De besparing in seconden per pass
+        """
+        durations = list()
+        with tempfile.TemporaryDirectory(dir=self.format_directory) as probe_directory:
+            for use_format in (False, True):
+                probe_file = Path(probe_directory) / Path(f"probe_{int(use_format)}.tex")
+                content = "" if use_format else preamble
+                probe_file.write_text(content + "\\begin{document}\\end{document}\n",
+                                      encoding="utf-8")
+                cmd = [self.engine, "-no-pdf", "-interaction=batchmode",
+                       f"-output-directory={probe_directory}"]
+                if use_format:
+                    cmd.append(f"-fmt={format_file.absolute().as_posix()}")
+                if self.shell_escape:
+                    cmd.append("-shell-escape")
+                cmd.append(probe_file.as_posix())
+                start = time.perf_counter()
+                subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                durations.append(time.perf_counter() - start)
+        return max(0.0, durations[0] - durations[1])
+
+    def latexmk_options(self, format_file):
+        """De latexmk optie om xelatex met de format te starten"""
+        return [f"-{self.engine}={self.engine} -fmt={format_file.absolute().as_posix()} %O %S"]
+
+    def saved_per_pass(self, tex_file):
+        return self.read_metadata(tex_file).get("saved_per_pass", 0.0)
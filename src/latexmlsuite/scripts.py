@@ -0,0 +1,224 @@
+"""
+Pre- and post scripts with declared inputs, outputs and dependencies
+
+A script in the ``prescripts`` or ``postscripts`` list of ``rapport_settings.yml`` is either a
+plain name, which runs in the listed order as before, or a mapping::
+
+    postscripts:
+      - script: figures/iris/sync_htmls
+        inputs: ["figures/iris/highcharts/*.html"]
+        outputs: ["ccn/highcharts/iris*.html"]
+      - script: figures/iris_via_hc/sync_htmls
+        inputs: ["figures/iris_via_hc/highcharts/*.html"]
+      - script: publish
+        after: [figures/iris/sync_htmls, figures/iris_via_hc/sync_htmls]
+
+Scripts given as a mapping run at the same time as the other mappings around them, after the
+scripts named in ``after``. A plain name waits for all scripts above it, and all scripts below it
+wait for the plain name. A script with ``inputs`` is skipped when the content of its inputs and
+of the script itself has not changed since its last successful run and all its ``outputs``
+exist. The patterns are relative to the report directory.
+
+An entry in the ``makefiles`` list is a directory, or a mapping that also declares which files
+make reads outside the directory and which files it makes::
+
+    makefiles:
+      - directory: figures/iris
+        inputs: ["data/afmetingen_bloem.csv"]
+        outputs: ["figures/iris/highcharts/*.html", "figures/iris/*.pdf"]
+      - tables
+
+Only makefile directories with declared ``inputs`` and ``outputs`` share their outputs through
+the artifact cache, because only for those the suite knows what make depends on.
+"""
+
+import glob
+import os
+from pathlib import Path
+
+SCRIPT_FIELDS = ("script", "inputs", "outputs", "after")
+MAKEFILE_FIELDS = ("directory", "inputs", "outputs")
+
+
+class Script:
+    """
+    Een pre- of postscript uit de settings file
+
+    Args:
+        name: str
+            De naam van het script zonder extensie, zoals in de settings file
+        inputs: list or None
+            Glob patronen van de files die het script leest. Zonder inputs draait het script
+            altijd
+        outputs: list or None
+            Glob patronen van de files die het script maakt
+        after: list or None
+            Namen van de scripts die eerst klaar moeten zijn
+        sequential: bool
+            True voor een script dat als gewone naam gegeven is
+    """
+
+    def __init__(self, name, inputs=None, outputs=None, after=None, sequential=False):
+        self.name = str(name)
+        self.inputs = inputs
+        self.outputs = list(outputs or [])
+        self.after = [str(other) for other in after or []]
+        self.sequential = sequential
+
+    @classmethod
+    def from_setting(cls, entry):
+        """Maak een script van een regel uit de settings file"""
+        if not isinstance(entry, dict):
+            return cls(entry, sequential=True)
+        unknown = set(entry) - set(SCRIPT_FIELDS)
+        if unknown or "script" not in entry:
+            raise ValueError(f"Script entry {entry} needs a 'script' and may only have the "
+                             f"fields {', '.join(SCRIPT_FIELDS)}")
+        return cls(entry["script"], inputs=entry.get("inputs"), outputs=entry.get("outputs"),
+                   after=entry.get("after"))
+
+    def path(self, platform_is_windows=False):
+        """Het script dat gedraaid wordt: de naam met .ps1 of .sh"""
+        return Path(self.name).with_suffix(".ps1" if platform_is_windows else ".sh")
+
+    def input_files(self, platform_is_windows=False):
+        """De inputs inclusief het script zelf, of None als er geen inputs gegeven zijn"""
+        if self.inputs is None:
+            return None
+        return expand_patterns(self.inputs) + [self.path(platform_is_windows)]
+
+    def output_files(self):
+        return expand_patterns(self.outputs, keep_missing=True)
+
+
+def expand_patterns(patterns, keep_missing=False):
+    """
+    Zoek de files bij een lijst met glob patronen
+
+    Args:
+        patterns: list
+            Glob patronen, ``**`` zoekt ook in subdirectories
+        keep_missing: bool
+            Geef een pattern zonder wildcards terug, ook als de file niet bestaat
+
+    Returns: list
+        De gesorteerde files
+    """
+    files = set()
+    for pattern in patterns:
+        matches = glob.glob(str(pattern), recursive=True)
+        if not matches and keep_missing and not glob.has_magic(str(pattern)):
+            matches = [pattern]
+        files.update(Path(match) for match in matches if not Path(match).is_dir())
+    return sorted(files)
+
+
+def normalise_directory(directory):
+    """De directory als posix pad zonder ./ of .., zodat verschillende schrijfwijzen gelijk zijn"""
+    return Path(os.path.normpath(directory)).as_posix()
+
+
+def read_makefiles(entries):
+    """
+    Lees de makefile directories uit de settings file
+
+    Args:
+        entries: list or None
+            De ``makefiles`` uit de settings file
+
+    Returns: tuple
+        De lijst met directories (None zonder makefiles) en per genormaliseerde directory met
+        inputs en outputs een dict met de glob patronen van de inputs en outputs
+    """
+    if entries is None:
+        return None, dict()
+    directories = list()
+    artifacts = dict()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            directories.append(entry)
+            continue
+        unknown = set(entry) - set(MAKEFILE_FIELDS)
+        if unknown or "directory" not in entry:
+            raise ValueError(f"Makefile entry {entry} needs a 'directory' and may only have the "
+                             f"fields {', '.join(MAKEFILE_FIELDS)}")
+        directories.append(entry["directory"])
+        if entry.get("inputs") is not None and entry.get("outputs"):
+            artifacts[normalise_directory(entry["directory"])] = dict(
+                inputs=list(entry["inputs"]), outputs=list(entry["outputs"]))
+    return directories, artifacts
+
+
+def read_scripts(entries):
+    """
+    Lees de scripts uit de settings file
+
+    Args:
+        entries: list
+            De ``prescripts`` of ``postscripts`` uit de settings file
+
+    Returns: list
+        :class:`Script` objecten in de volgorde van de settings file
+    """
+    scripts = [Script.from_setting(entry) for entry in entries or []]
+    names = {script.name for script in scripts}
+    for script in scripts:
+        for other in script.after:
+            if other not in names:
+                raise ValueError(f"Script {script.name} runs after unknown script {other}")
+    return scripts
+
+
+def script_dependencies(scripts):
+    """
+    Bepaal welke scripts eerst klaar moeten zijn
+
+    Args:
+        scripts: list
+            De scripts van :func:`read_scripts`
+
+    Returns: list
+        Per script de set met de indices van de scripts waarop het wacht
+    """
+    index_of = {script.name: index for index, script in enumerate(scripts)}
+    dependencies = list()
+    barrier = None
+    for index, script in enumerate(scripts):
+        if script.sequential:
+            depends_on = set(range(index))
+            barrier = index
+        else:
+            depends_on = {index_of[other] for other in script.after}
+            if barrier is not None:
+                depends_on.add(barrier)
+        dependencies.append(depends_on)
+    return dependencies
+
+
+def topological_order(scripts, dependencies):
+    """
+    Sorteer de scripts zo dat ieder script na de scripts komt waarop het wacht
+
+    Args:
+        scripts: list
+            De scripts van :func:`read_scripts`
+        dependencies: list
+            De afhankelijkheden van :func:`script_dependencies`
+
+    Returns: list
+        De indices van de scripts
+
+    Raises:
+        ValueError: als scripts via ``after`` op elkaar wachten
+    """
+    order = list()
+    done = set()
+    while len(order) < len(scripts):
+        ready = [index for index, depends_on in enumerate(dependencies)
+                 if index not in done and depends_on <= done]
+        if not ready:
+            waiting = [script.name for index, script in enumerate(scripts) if index not in done]
+            raise ValueError(f"The scripts {', '.join(waiting)} wait for each other")
+        order.extend(ready)
+        done.update(ready)
+    return order
@@ -0,0 +1,260 @@
+"""
+Synchronise directory trees without starting rsync or Robocopy
+
+Both trees are scanned once. A file is copied if it is missing in the destination, if its size
+differs, or if the modification time differs and the content hash differs as well. Files are
+cloned (reflink) or hard linked where the file system allows it and copied otherwise.
+
+Several source directories may be synchronised to the same destination, such as the highcharts
+directories of all makefile directories which go to ``ccn/highcharts``. Therefore stale files
+are only deleted if they were delivered by the same source before, which is recorded in a
+manifest file per source and destination pair.
+"""
+
+import fnmatch
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # niet beschikbaar op windows
+    fcntl = None
+
+from latexmlsuite.build_cache import hash_file
+
+DEFAULT_EXCLUDE = ("*.json",)
+
+# ioctl om een file als copy-on-write kloon te maken (btrfs, xfs)
+FICLONE = 0x40049409
+
+_logger = logging.getLogger(__name__)
+
+
+class SyncResult:
+    """
+    Resultaat van het synchroniseren van een directory
+
+    Args:
+        source: Path
+            De bron directory
+        destination: Path
+            De doel directory
+    """
+
+    def __init__(self, source, destination):
+        self.source = source
+        self.destination = destination
+        self.copied = []
+        self.unchanged = []
+        self.deleted = []
+
+    @property
+    def files(self):
+        """Alle files die nu vanuit de bron in de doel directory staan"""
+        return sorted(self.copied + self.unchanged)
+
+    def summary(self):
+        return (f"sync {self.source.as_posix()}/ {self.destination.as_posix()}: "
+                f"{len(self.copied)} copied, {len(self.unchanged)} unchanged, "
+                f"{len(self.deleted)} deleted")
+
+
+def scan_tree(directory, exclude=DEFAULT_EXCLUDE):
+    """
+    Geef alle files in een directory boom met hun stat
+
+    Args:
+        directory: Path
+            De directory die gescand wordt
+        exclude: tuple
+            Patronen van file namen die overgeslagen worden
+
+    Returns: dict
+        Per relatief pad (met forward slashes) het os.stat_result van de file
+    """
+    files = dict()
+    to_scan = [(Path(directory), "")]
+    while to_scan:
+        scan_directory, prefix = to_scan.pop()
+        try:
+            entries = list(os.scandir(scan_directory))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            relative = prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                to_scan.append((Path(entry.path), relative + "/"))
+            elif entry.is_file():
+                if any(fnmatch.fnmatch(entry.name, pattern) for pattern in exclude):
+                    continue
+                files[relative] = entry.stat()
+    return files
+
+
+def files_differ(source, destination, source_stat, destination_stat):
+    """
+    Kijk of de doel file bijgewerkt moet worden
+
+    Een verschillende grootte betekent altijd een wijziging. Bij dezelfde grootte en
+    modificatie tijd nemen we aan dat de files gelijk zijn. Alleen als de tijden verschillen
+    vergelijken we de inhoud.
+    """
+    if source_stat.st_size != destination_stat.st_size:
+        return True
+    if source_stat.st_mtime_ns == destination_stat.st_mtime_ns:
+        return False
+    return hash_file(source) != hash_file(destination)
+
+
+def _reflink(source, destination):
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    with open(source, "rb") as in_stream, open(destination, "wb") as out_stream:
+        try:
+            fcntl.ioctl(out_stream.fileno(), FICLONE, in_stream.fileno())
+        except OSError:
+            return False
+    return True
+
+
+def copy_file(source, destination, hardlink=False):
+    """
+    Kopieer een file, via een tijdelijke file zodat de doel file nooit half geschreven is
+
+    Args:
+        source: Path
+            De bron file
+        destination: Path
+            De doel file
+        hardlink: bool
+            Maak een hard link in plaats van een kopie als dat kan. Let op: de bron en het doel
+            zijn dan dezelfde file
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    # ook de thread in de naam, want meerdere bronnen kunnen tegelijk naar hetzelfde doel gaan
+    tmp_file = destination.with_name(
+        f".{destination.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    if hardlink:
+        try:
+            os.link(source, tmp_file)
+        except OSError:
+            hardlink = False
+    if not hardlink:
+        if _reflink(source, tmp_file):
+            shutil.copystat(source, tmp_file)
+        else:
+            shutil.copy2(source, tmp_file)
+    os.replace(tmp_file, destination)
+
+
+def read_manifest(manifest_file):
+    if manifest_file is None:
+        return []
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as stream:
+            return json.load(stream)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as err:
+        _logger.warning(f"Could not read sync manifest {manifest_file}: {err}")
+        return []
+
+
+def write_manifest(manifest_file, files):
+    manifest_file = Path(manifest_file)
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = manifest_file.with_name(f"{manifest_file.name}.{os.getpid()}.tmp")
+    with open(tmp_file, "w", encoding="utf-8") as stream:
+        json.dump(files, stream, indent=1)
+    os.replace(tmp_file, manifest_file)
+
+
+def synchronise_directory(source, destination, exclude=DEFAULT_EXCLUDE, delete=False,
+                          manifest_file=None, hardlink=False, test=False):
+    """
+    Synchroniseer een bron directory met een doel directory
+
+    Args:
+        source: str or Path
+            De bron directory
+        destination: str or Path
+            De doel directory
+        exclude: tuple
+            Patronen van file namen die niet gesynchroniseerd worden
+        delete: bool
+            Verwijder files uit de doel directory die bij de vorige synchronisatie vanuit deze
+            bron gekopieerd zijn, maar niet meer in de bron staan. Hiervoor is een manifest file
+            nodig
+        manifest_file: str or Path or None
+            File waarin bijgehouden wordt welke files vanuit deze bron gekopieerd zijn
+        hardlink: bool
+            Maak hard links in plaats van kopieën waar dat kan
+        test: bool
+            Laat alleen zien wat er zou gebeuren
+
+    Returns: SyncResult
+    """
+    source = Path(source)
+    destination = Path(destination)
+    result = SyncResult(source=source, destination=destination)
+
+    source_files = scan_tree(source, exclude=exclude)
+    destination_files = scan_tree(destination, exclude=exclude)
+
+    for relative, source_stat in sorted(source_files.items()):
+        source_file = source / relative
+        destination_file = destination / relative
+        destination_stat = destination_files.get(relative)
+        if destination_stat is not None and not files_differ(source_file, destination_file,
+                                                             source_stat, destination_stat):
+            result.unchanged.append(relative)
+            continue
+        if not test:
+            copy_file(source_file, destination_file, hardlink=hardlink)
+        result.copied.append(relative)
+
+    if delete:
+        for relative in read_manifest(manifest_file):
+            if relative in source_files or relative not in destination_files:
+                continue
+            if not test:
+                (destination / relative).unlink()
+            result.deleted.append(relative)
+
+    if manifest_file is not None and not test:
+        write_manifest(manifest_file, result.files)
+
+    return result
+
+
+def synchronise_directories(pairs, max_workers=None, **kwargs):
+    """
+    Synchroniseer een lijst van (bron, doel, manifest) tuples tegelijk
+
+    Args:
+        pairs: list
+            Tuples met de bron directory, de doel directory en de manifest file (of None)
+        max_workers: int or None
+            Maximaal aantal directories dat tegelijk gesynchroniseerd wordt
+        **kwargs:
+            Worden doorgegeven aan :func:`synchronise_directory`
+
+    Returns: list
+        Een SyncResult per paar, in dezelfde volgorde
+    """
+    if not pairs:
+        return []
+    if max_workers is None:
+        max_workers = min(32, len(pairs))
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(synchronise_directory, source, destination,
+                                   manifest_file=manifest_file, **kwargs)
+                   for source, destination, manifest_file in pairs]
+        return [future.result() for future in futures]
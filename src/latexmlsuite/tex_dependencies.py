@@ -0,0 +1,240 @@
+"""
+Scanner for all local files a LaTeX document depends on
+
+Starting from the main file, the scanner follows ``\\input``, ``\\include``,
+``\\includegraphics``, ``\\bibliography``, ``\\addbibresource`` and references to local
+``.cls`` and ``.sty`` files. Files which can not be found locally (such as packages from the TeX
+distribution) are ignored. The references found in a file are cached together with the content
+hash of the file, so a file is only parsed again after it changed.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+DEPENDENCIES_FILE_NAME = "dependencies.json"
+
+GRAPHICS_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg", ".eps", ".svg")
+
+# per soort referentie de extensies die we proberen als er geen extensie gegeven is
+EXTENSIONS = {
+    "input": (".tex",),
+    "include": (".tex",),
+    "includegraphics": GRAPHICS_EXTENSIONS,
+    "bibliography": (".bib",),
+    "addbibresource": (),
+    "documentclass": (".cls",),
+    "usepackage": (".sty",),
+    "RequirePackage": (".sty",),
+}
+
+# soorten referenties waarin meerdere namen gescheiden door komma's mogen staan
+COMMA_SEPARATED = ("bibliography", "usepackage", "RequirePackage")
+
+# de kinderen van deze referenties zijn zelf ook weer tex files die we moeten scannen
+RECURSIVE = ("input", "include", "documentclass", "usepackage", "RequirePackage")
+
+COMMENT_PATTERN = re.compile(r"(?<!\\)%.*$", re.MULTILINE)
+REFERENCE_PATTERN = re.compile(
+    r"\\(?P<kind>" + "|".join(EXTENSIONS.keys()) + r")(?![A-Za-z@])\*?"
+    r"(?:\s*\[[^\]]*\])*\s*"
+    r"(?:\{(?P<name>[^}]*)\}|(?P<bare>[^\s{}\[\\]+))"
+)
+
+_logger = logging.getLogger(__name__)
+
+
+def strip_comments(tex_content):
+    """Verwijder alle commentaar uit een tex string"""
+    return COMMENT_PATTERN.sub("", tex_content)
+
+
+def find_references(tex_content):
+    """
+    Zoek alle referenties naar andere files in een tex string
+
+    Args:
+        tex_content: str
+            De inhoud van een tex file
+
+    Returns: list
+        Lijst van (soort, naam) paren, bijvoorbeeld ("input", "sections/01_introductie")
+    """
+    references = list()
+    for match in REFERENCE_PATTERN.finditer(strip_comments(tex_content)):
+        kind = match.group("kind")
+        name = match.group("name")
+        if name is None:
+            # alleen \input mag zonder accolades gebruikt worden
+            if kind != "input":
+                continue
+            name = match.group("bare")
+        if kind in COMMA_SEPARATED:
+            names = name.split(",")
+        else:
+            names = [name]
+        for name in names:
+            name = name.strip()
+            if name:
+                references.append((kind, name))
+    return references
+
+
+def resolve_reference(kind, name, search_directories):
+    """
+    Zoek de file die bij een referentie hoort
+
+    Args:
+        kind: str
+            Soort referentie, zoals 'input' of 'includegraphics'
+        name: str
+            De naam zoals die in de tex file staat
+        search_directories: list
+            Directories waarin gezocht wordt, in volgorde
+
+    Returns: Path or None
+        Het pad van de gevonden file of None als de file niet lokaal bestaat
+    """
+    name_path = Path(name)
+    candidates = [name_path]
+    if name_path.suffix == "" or kind in ("documentclass", "usepackage", "RequirePackage"):
+        candidates = [Path(name + ext) for ext in EXTENSIONS[kind]] + candidates
+    for directory in search_directories:
+        for candidate in candidates:
+            file_name = Path(directory) / candidate
+            if file_name.is_file():
+                return Path(os.path.normpath(file_name))
+    return None
+
+
+class DependencyScanner:
+    """
+    Bepaal de transitieve afhankelijkheden van een tex file
+
+    Args:
+        build_cache: BuildCache
+            Wordt gebruikt om de inhoud van de files te hashen en bepaalt de directory waarin de
+            dependency graph bewaard wordt
+    """
+
+    def __init__(self, build_cache):
+        self.build_cache = build_cache
+        self.graph_file = build_cache.cache_directory / DEPENDENCIES_FILE_NAME
+        self._lock = threading.Lock()
+        self._graph = dict()
+        self._modified = False
+        self.load()
+
+    def load(self):
+        """Lees de dependency graph van de vorige run"""
+        try:
+            with open(self.graph_file, "r", encoding="utf-8") as stream:
+                self._graph = json.load(stream)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as err:
+            _logger.warning(f"Could not read dependency graph {self.graph_file}: {err}")
+
+    def save(self):
+        """Schrijf de dependency graph weg als er iets veranderd is"""
+        if self.build_cache.read_only or not self._modified:
+            return
+        with self._lock:
+            self.graph_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.graph_file.with_name(f"{self.graph_file.name}.{os.getpid()}.tmp")
+            with open(tmp_file, "w", encoding="utf-8") as stream:
+                json.dump(self._graph, stream, indent=1, sort_keys=True)
+            os.replace(tmp_file, self.graph_file)
+            self._modified = False
+
+    def references(self, file_name):
+        """
+        Geef de referenties in een file, uit de cache als de inhoud niet veranderd is
+
+        Args:
+            file_name: Path
+                De tex file
+
+        Returns: list
+            Lijst van (soort, naam) paren
+        """
+        key = Path(file_name).as_posix()
+        content_hash = self.build_cache.file_hash(file_name)
+        with self._lock:
+            cached = self._graph.get(key)
+        if cached is not None and cached["hash"] == content_hash:
+            return [tuple(reference) for reference in cached["references"]]
+
+        _logger.debug(f"Scanning {file_name} for dependencies")
+        try:
+            with open(file_name, "r", encoding="utf-8", errors="replace") as stream:
+                references = find_references(stream.read())
+        except FileNotFoundError:
+            _logger.warning(f"Could not find {file_name} to scan for dependencies")
+            return []
+        with self._lock:
+            self._graph[key] = dict(hash=content_hash, references=references)
+            self._modified = True
+        return references
+
+    def dependencies(self, main_file, root_directory="."):
+        """
+        Geef alle lokale files waar een tex file van afhangt, inclusief de file zelf
+
+        Referenties worden eerst gezocht ten opzichte van de file waarin ze staan en daarna ten
+        opzichte van de root directory, van waaruit latex en latexml gedraaid worden.
+
+        Args:
+            main_file: str or Path
+                De tex file waarmee we beginnen
+            root_directory: str or Path
+                De directory van waaruit het document gecompileerd wordt
+
+        Returns: list
+            Gesorteerde lijst met de paden van alle afhankelijkheden
+        """
+        main_file = Path(os.path.normpath(main_file))
+        found = {main_file}
+        to_scan = [main_file]
+        while to_scan:
+            tex_file = to_scan.pop()
+            search_directories = [tex_file.parent, Path(root_directory)]
+            for kind, name in self.references(tex_file):
+                dependency = resolve_reference(kind, name, search_directories)
+                if dependency is None or dependency in found:
+                    continue
+                found.add(dependency)
+                if kind in RECURSIVE:
+                    to_scan.append(dependency)
+        self.save()
+        return sorted(found)
+
+    def text_dependencies(self, tex_content, directory, root_directory="."):
+        """
+        Geef alle lokale files waar een stuk tex code van afhangt dat (nog) niet in een file staat
+
+        Args:
+            tex_content: str
+                De tex code
+            directory: str or Path
+                De directory waarin de tex code gecompileerd zou worden
+            root_directory: str or Path
+                De directory van waaruit het document gecompileerd wordt
+
+        Returns: list
+            Gesorteerde lijst met de paden van alle afhankelijkheden
+        """
+        found = set()
+        search_directories = [Path(directory), Path(root_directory)]
+        for kind, name in find_references(tex_content):
+            dependency = resolve_reference(kind, name, search_directories)
+            if dependency is None or dependency in found:
+                continue
+            if kind in RECURSIVE:
+                found.update(self.dependencies(dependency, root_directory=root_directory))
+            else:
+                found.add(dependency)
+        return sorted(found)
@@ -0,0 +1,204 @@
+"""
+Record the duration and resource usage of every stage and command of a run
+
+The events can be written in the Chrome trace format (open the file in ``chrome://tracing`` or
+https://ui.perfetto.dev) and summarised in a table sorted by wall time.
+"""
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # niet beschikbaar op windows
+    resource = None
+
+_logger = logging.getLogger(__name__)
+
+
+def children_rusage():
+    """
+    Geef de cpu tijd en het piek geheugen van alle beëindigde child processen
+
+    Returns: tuple
+        (cpu tijd in seconden, piek rss in kB), of (None, None) als dit niet beschikbaar is
+    """
+    if resource is None:
+        return None, None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, max_rss_kb(usage)
+
+
+def max_rss_kb(usage):
+    """Het piek geheugen uit een rusage in kB (macOS geeft bytes, linux kB)"""
+    if sys.platform == "darwin":
+        return usage.ru_maxrss // 1024
+    return usage.ru_maxrss
+
+
+class Tracer:
+    """
+    Verzamel de duur, cpu tijd en het geheugengebruik van stages en commando's
+
+    Args:
+        build_cache: BuildCache or None
+            Als gegeven, worden de cache hits en misses tijdens iedere stage bijgehouden
+    """
+
+    def __init__(self, build_cache=None):
+        self.build_cache = build_cache
+        self.events = list()
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._thread_ids = dict()
+
+    def reset(self):
+        """Vergeet alle events, bijvoorbeeld voor een nieuwe rebuild in --watch"""
+        with self._lock:
+            self.events = list()
+
+    def _thread_id(self):
+        ident = threading.get_ident()
+        with self._lock:
+            return self._thread_ids.setdefault(ident, len(self._thread_ids) + 1)
+
+    def _cache_counts(self):
+        if self.build_cache is None:
+            return 0, 0
+        return sum(self.build_cache.hits.values()), sum(self.build_cache.misses.values())
+
+    @contextlib.contextmanager
+    def span(self, name, category="stage", **args):
+        """
+        Meet een stuk van de run
+
+        De context levert een dict op waar de aanroeper extra informatie aan toe kan voegen,
+        zoals de exit status of de cpu tijd van een commando.
+
+        Args:
+            name: str
+                Naam van de stage of het commando
+            category: str
+                'stage' of 'command'
+            **args:
+                Extra informatie die bij het event bewaard wordt
+        """
+        info = dict(args)
+        cpu_start, _ = children_rusage()
+        hits_start, misses_start = self._cache_counts()
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            end = time.perf_counter()
+            cpu_end, max_rss = children_rusage()
+            hits_end, misses_end = self._cache_counts()
+            # bij parallelle stages tellen ook de children van de andere threads mee; voor
+            # commando's wordt de exacte waarde van het proces zelf ingevuld
+            if "cpu_time" not in info and cpu_start is not None:
+                info["cpu_time"] = cpu_end - cpu_start
+            if "max_rss_kb" not in info and max_rss is not None:
+                info["max_rss_kb"] = max_rss
+            if hits_end > hits_start:
+                info["cache_hits"] = hits_end - hits_start
+            if misses_end > misses_start:
+                info["cache_misses"] = misses_end - misses_start
+            self.add_event(name, start=start, duration=end - start, category=category, **info)
+
+    def add_event(self, name, start, duration, category="command", **args):
+        """
+        Voeg een event toe dat buiten een span gemeten is, zoals een pagina die in een worker
+        proces schoongemaakt is
+
+        Args:
+            name: str
+                Naam van de stage of het commando
+            start: float
+                De time.perf_counter waarde bij het begin
+            duration: float
+                De duur in seconden
+            category: str
+                'stage' of 'command'
+            **args:
+                Extra informatie die bij het event bewaard wordt
+        """
+        event = dict(name=name, cat=category, ph="X",
+                     ts=round((start - self._start) * 1e6), dur=round(duration * 1e6),
+                     pid=os.getpid(), tid=self._thread_id(), args=args)
+        with self._lock:
+            self.events.append(event)
+
+    def write_chrome_trace(self, file_name):
+        """
+        Schrijf alle events als Chrome trace
+
+        Args:
+            file_name: str or Path
+                De json file die geschreven wordt
+        """
+        file_name = Path(file_name)
+        file_name.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            trace = dict(traceEvents=list(self.events), displayTimeUnit="ms")
+        with open(file_name, "w", encoding="utf-8") as stream:
+            json.dump(trace, stream, indent=1)
+        _logger.info(f"Wrote trace with {len(trace['traceEvents'])} events to {file_name}")
+
+    def summary(self):
+        """
+        Tel de events per naam op
+
+        Returns: list
+            Per naam een dict met category, count, wall_time, cpu_time en max_rss_kb, gesorteerd
+            op de totale wall tijd
+        """
+        totals = defaultdict(lambda: dict(count=0, wall_time=0.0, cpu_time=0.0, max_rss_kb=0,
+                                          cache_hits=0, cache_misses=0))
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            total = totals[(event["cat"], event["name"])]
+            total["count"] += 1
+            total["wall_time"] += event["dur"] / 1e6
+            total["cpu_time"] += event["args"].get("cpu_time") or 0.0
+            total["max_rss_kb"] = max(total["max_rss_kb"], event["args"].get("max_rss_kb") or 0)
+            total["cache_hits"] += event["args"].get("cache_hits", 0)
+            total["cache_misses"] += event["args"].get("cache_misses", 0)
+        rows = [dict(category=category, name=name, **total)
+                for (category, name), total in totals.items()]
+        return sorted(rows, key=lambda row: row["wall_time"], reverse=True)
+
+    def report_summary(self):
+        """Print de samenvatting als een tabel"""
+        message = "{:50.50s} {:8s} {:>5} {:>9} {:>9} {:>10} {:>7}"
+        print(message.format("Stage / command", "type", "n", "wall [s]", "cpu [s]", "rss [MB]",
+                             "cache"))
+        for row in self.summary():
+            cache = ""
+            if row["cache_hits"] or row["cache_misses"]:
+                cache = f"{row['cache_hits']}/{row['cache_misses']}"
+            print(message.format(row["name"], row["category"], row["count"],
+                                 f"{row['wall_time']:.2f}", f"{row['cpu_time']:.2f}",
+                                 f"{row['max_rss_kb'] / 1024:.1f}", cache))
+
+
+def traced_stage(method):
+    """
+    Decorator die een stage methode van LaTeXMLSuite meet met de tracer van de suite
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.tracer.span(method.__name__, category="stage"):
+            return method(self, *args, **kwargs)
+
+    return wrapper
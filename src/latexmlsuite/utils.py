@@ -0,0 +1,41 @@
+"""
+Small helpers which are shared by the stages of the suite
+"""
+
+import logging
+import threading
+from pathlib import Path
+
+_logger = logging.getLogger(__name__)
+
+# voorkomt dat de output van parallelle processen door elkaar op de terminal komt
+_print_lock = threading.Lock()
+
+
+def write_file_if_changed(file_name: Path, content: str):
+    """
+    Schrijf een tekst file, maar alleen als de inhoud anders is dan wat er al staat
+
+    Zo blijft de modificatie tijd van een ongewijzigde file gelijk en gaan latexmk en latexml niet
+    onnodig opnieuw draaien
+
+    Args:
+        file_name: Path
+            De file die geschreven wordt
+        content: str
+            De nieuwe inhoud
+
+    Returns: bool
+        True als de file geschreven is
+    """
+    try:
+        with open(file_name, "r") as in_stream:
+            content_old = in_stream.read()
+    except FileNotFoundError:
+        content_old = None
+    if content == content_old:
+        _logger.debug(f"Content of {file_name} did not change")
+        return False
+    with open(file_name, "w") as out_stream:
+        out_stream.write(content)
+    return True
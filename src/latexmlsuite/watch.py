@@ -0,0 +1,393 @@
+"""
+Watch the report tree and rebuild only the stages touched by a change
+
+On linux the tree is watched with inotify, elsewhere (or with ``--watch_poll``) the tree is
+scanned every second. Bursts of saves are collected until nothing changed for the debounce time,
+and then every changed file is mapped to the stages which depend on it:
+
+* a file in a makefile directory reruns make and the sync of that directory only
+* a file read by the main tex file (sections, tables, graphics, bibliography) reruns the pdf and
+  the html, for which the build cache takes care that only the changed chapters and pages are
+  converted again
+* a pre or post script reruns that group of scripts
+* the settings file restarts with a full build
+
+The suite object, and with it the build cache, the dependency graph and the settings, is kept
+between rebuilds.
+"""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+from latexmlsuite.cleanup import LOG_PATTERNS
+from latexmlsuite.scripts import read_scripts
+
+DEFAULT_DEBOUNCE = 0.5
+POLL_INTERVAL = 1.0
+
+# files van editors en tools die nooit een rebuild moeten geven
+IGNORE_FILE_PATTERNS = [".*", "*~", "*.swp", "*.swx", "*.tmp", "*.pyc", "4913"] + LOG_PATTERNS
+IGNORE_DIRECTORIES = [".git", "__pycache__", ".idea", ".vscode"]
+
+# inotify event masks, zie inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+_logger = logging.getLogger(__name__)
+
+
+class TreeFilter:
+    """
+    Bepaal welke files en directories van de report boom bekeken worden
+
+    Args:
+        root: Path
+            De root directory van het rapport
+        ignore_directories: list
+            Directories (relatief ten opzichte van de root) die niet bekeken worden, zoals de
+            output directories en de highcharts directories die door make gevuld worden
+    """
+
+    def __init__(self, root, ignore_directories=()):
+        self.root = Path(root).absolute()
+        self.ignore_directories = set()
+        for directory in ignore_directories:
+            directory = Path(directory)
+            if not directory.is_absolute():
+                directory = self.root / directory
+            self.ignore_directories.add(Path(os.path.normpath(directory)))
+
+    def skip_directory(self, directory):
+        directory = Path(directory)
+        if directory.name in IGNORE_DIRECTORIES:
+            return True
+        return Path(os.path.normpath(directory.absolute())) in self.ignore_directories
+
+    def skip_file(self, file_name):
+        name = Path(file_name).name
+        return any(fnmatch.fnmatch(name, pattern) for pattern in IGNORE_FILE_PATTERNS)
+
+    def relative(self, file_name):
+        return Path(os.path.relpath(file_name, self.root))
+
+
+class PollingWatcher:
+    """
+    Vind wijzigingen door de boom iedere interval opnieuw te scannen
+
+    Args:
+        tree_filter: TreeFilter
+            Bepaalt welke files bekeken worden
+        interval: float
+            Seconden tussen twee scans
+    """
+
+    def __init__(self, tree_filter, interval=POLL_INTERVAL):
+        self.tree_filter = tree_filter
+        self.interval = interval
+        self._snapshot = self.scan()
+
+    def scan(self):
+        snapshot = dict()
+        to_scan = [self.tree_filter.root]
+        while to_scan:
+            directory = to_scan.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not self.tree_filter.skip_directory(entry.path):
+                        to_scan.append(entry.path)
+                elif not self.tree_filter.skip_file(entry.name):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def read_changes(self, timeout=None):
+        """
+        Wacht maximaal *timeout* seconden en geef de gewijzigde files
+
+        Returns: set
+            De gewijzigde, nieuwe en verwijderde files, relatief ten opzichte van de root
+        """
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        snapshot = self.scan()
+        changed = {name for name in set(snapshot) | set(self._snapshot)
+                   if snapshot.get(name) != self._snapshot.get(name)}
+        self._snapshot = snapshot
+        return {self.tree_filter.relative(name) for name in changed}
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Vind wijzigingen met inotify, zonder extra packages via ctypes
+
+    Raises:
+        OSError: als inotify niet beschikbaar is
+    """
+
+    def __init__(self, tree_filter):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on linux")
+        self.tree_filter = tree_filter
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directories = dict()
+        self._overflow = False
+        self.add_tree(self.tree_filter.root)
+
+    def add_tree(self, directory):
+        """Voeg een directory met al zijn subdirectories toe"""
+        to_watch = [Path(directory)]
+        while to_watch:
+            directory = to_watch.pop()
+            if self.tree_filter.skip_directory(directory):
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                _logger.debug(f"Could not watch {directory}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self._directories[wd] = directory
+            try:
+                to_watch.extend(Path(entry.path) for entry in os.scandir(directory)
+                                if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def read_changes(self, timeout=None):
+        """
+        Wacht maximaal *timeout* seconden en geef de gewijzigde files
+
+        Returns: set or None
+            De gewijzigde files relatief ten opzichte van de root, of None als de kernel events
+            kwijtgeraakt is en alles opnieuw gebouwd moet worden
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        while True:
+            try:
+                buffer = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(buffer[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    self._overflow = True
+                    continue
+                directory = self._directories.get(wd)
+                if directory is None or not name:
+                    continue
+                file_name = directory / name
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.add_tree(file_name)
+                    continue
+                if not self.tree_filter.skip_file(name):
+                    changed.add(self.tree_filter.relative(file_name))
+        if self._overflow:
+            self._overflow = False
+            return None
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+def create_watcher(tree_filter, poll=False):
+    """Maak een inotify watcher, of een polling watcher als dat niet kan of gevraagd wordt"""
+    if not poll:
+        try:
+            return InotifyWatcher(tree_filter)
+        except (OSError, AttributeError) as err:
+            _logger.info(f"Falling back to polling the report tree: {err}")
+    return PollingWatcher(tree_filter)
+
+
+class RebuildPlan:
+    """De stages die na een aantal wijzigingen opnieuw gedraaid moeten worden"""
+
+    def __init__(self):
+        self.settings = False
+        self.makefile_directories = set()
+        self.pre_scripts = False
+        self.document = False
+        self.post_scripts = False
+
+    def __bool__(self):
+        return bool(self.settings or self.makefile_directories or self.pre_scripts or
+                    self.document or self.post_scripts)
+
+    def describe(self):
+        if self.settings:
+            return "full build (settings changed)"
+        parts = [f"make {directory}" for directory in sorted(self.makefile_directories)]
+        if self.pre_scripts:
+            parts.append("prescripts")
+        if self.document:
+            parts.append("pdf and html")
+        if self.post_scripts:
+            parts.append("postscripts")
+        return ", ".join(parts)
+
+
+def script_files(suite, scripts):
+    if not scripts:
+        return set()
+    return {Path(os.path.normpath(script.path(suite.platform_is_windows)))
+            for script in read_scripts(scripts)}
+
+
+def plan_rebuild(suite, changed_files, settings_filename=None):
+    """
+    Bepaal de kleinste set stages die de gewijzigde files nodig hebben
+
+    Args:
+        suite: LaTeXMLSuite
+            De suite waarvan de settings en de dependency graph gebruikt worden
+        changed_files: set or None
+            Gewijzigde files relatief ten opzichte van de root. None betekent alles
+        settings_filename: str or None
+            De settings file van het rapport
+
+    Returns: RebuildPlan
+    """
+    plan = RebuildPlan()
+    if changed_files is None:
+        plan.settings = True
+        return plan
+    changed_files = {Path(os.path.normpath(file_name)) for file_name in changed_files}
+
+    if settings_filename is not None and Path(os.path.normpath(settings_filename)) in \
+            changed_files:
+        plan.settings = True
+        return plan
+
+    main_file = suite.main_file_name.with_suffix(".tex")
+    document_inputs = set(suite.dependency_scanner.dependencies(main_file))
+    if suite.bibtex_file is not None:
+        document_inputs.add(Path(os.path.normpath(suite.bibtex_file)))
+    pre_scripts = script_files(suite, suite.pre_scripts)
+    post_scripts = script_files(suite, suite.post_scripts)
+    makefile_directories = [Path(os.path.normpath(directory))
+                            for directory in suite.makefile_directories or []]
+
+    for file_name in changed_files:
+        if file_name in document_inputs:
+            plan.document = True
+        elif file_name in pre_scripts:
+            plan.pre_scripts = True
+        elif file_name in post_scripts:
+            plan.post_scripts = True
+        else:
+            for directory in makefile_directories:
+                if directory == Path(".") or directory in file_name.parents:
+                    plan.makefile_directories.add(directory)
+                    break
+            else:
+                _logger.debug(f"No stage depends on {file_name}")
+    return plan
+
+
+def ignored_directories(suite):
+    """De directories waarin de suite zelf schrijft en die dus niet bekeken worden"""
+    directories = [suite.output_directory, suite.output_directory_html,
+                   suite.output_directory_draft, suite.ccn_output_directory]
+    for makefile_dir in suite.makefile_directories or []:
+        for sync_dir in suite.synchronise_directories:
+            directories.append(Path(makefile_dir) / sync_dir.stem)
+    return directories
+
+
+def watch_report(create_suite, settings_filename=None, debounce=DEFAULT_DEBOUNCE, poll=False,
+                 max_rebuilds=None):
+    """
+    Bouw het rapport en bouw het opnieuw zodra er een file verandert
+
+    Args:
+        create_suite: callable
+            Maakt een nieuwe LaTeXMLSuite met de actuele settings
+        settings_filename: str or None
+            De settings file; bij een wijziging wordt de suite opnieuw gemaakt
+        debounce: float
+            Seconden zonder wijzigingen voordat er gebouwd wordt
+        poll: bool
+            Gebruik altijd de polling watcher
+        max_rebuilds: int or None
+            Stop na dit aantal rebuilds. Default blijf draaien tot ctrl-c
+    """
+    suite = create_suite()
+    try:
+        suite.run()
+    except Exception as err:
+        # ook als de eerste build mislukt, blijven we kijken zodat de fout hersteld kan worden
+        _logger.error(f"Build failed: {err}")
+    watcher = create_watcher(TreeFilter(".", ignored_directories(suite)), poll=poll)
+    print(f"Watching {watcher.tree_filter.root} for changes (ctrl-c to stop)")
+    n_rebuilds = 0
+    pending = set()
+    last_change = None
+    try:
+        while max_rebuilds is None or n_rebuilds < max_rebuilds:
+            changes = watcher.read_changes(timeout=debounce if pending != set() else None)
+            if changes is None or changes:
+                pending = None if (changes is None or pending is None) else pending | changes
+                last_change = time.monotonic()
+                continue
+            if pending == set() or time.monotonic() - last_change < debounce:
+                continue
+
+            plan = plan_rebuild(suite, pending, settings_filename=settings_filename)
+            pending = set()
+            if not plan:
+                continue
+            n_rebuilds += 1
+            print(f"Rebuilding: {plan.describe()}")
+            try:
+                if plan.settings:
+                    suite = create_suite()
+                    suite.run()
+                    watcher.close()
+                    watcher = create_watcher(TreeFilter(".", ignored_directories(suite)),
+                                             poll=poll)
+                else:
+                    suite.rebuild(makefile_directories=sorted(plan.makefile_directories),
+                                  pre_scripts=plan.pre_scripts, document=plan.document,
+                                  post_scripts=plan.post_scripts)
+            except Exception as err:
+                # een fout in een rebuild mag het watchen niet stoppen
+                _logger.error(f"Rebuild failed: {err}")
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        watcher.close()
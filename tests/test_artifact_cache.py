@@ -0,0 +1,134 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from latexmlsuite.artifact_cache import ArtifactCache, parse_size
+from latexmlsuite.main_suite import LaTeXMLSuite
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+
+def test_parse_size():
+    assert parse_size(1000) == 1000
+    assert parse_size("500M") == 500 * 1024 ** 2
+    assert parse_size("10G") == 10 * 1024 ** 3
+    assert parse_size("1.5 KiB") == 1536
+    with pytest.raises(ValueError):
+        parse_size("veel")
+
+
+def test_store_and_fetch(tmp_path):
+    """Een entry komt terug onder dezelfde key, ook in een directory"""
+    cache = ArtifactCache(tmp_path / "cache")
+    source = tmp_path / "refs.xml"
+    source.write_text("<bibliography/>")
+    key = cache.key("latexml_bibtex", "abc", "latexml 0.8.6")
+    assert key != cache.key("latexml_bibtex", "abc", "latexml 0.8.7")
+
+    assert not cache.fetch(key, {"refs.xml": tmp_path / "out.xml"})
+    assert cache.store(key, {"refs.xml": source, "sub/plot.html": source})
+    assert cache.fetch(key, {"refs.xml": tmp_path / "out.xml"})
+    assert (tmp_path / "out.xml").read_text() == "<bibliography/>"
+    assert not cache.fetch(key, {"other.xml": tmp_path / "other.xml"})
+
+    assert cache.fetch(key, tmp_path / "checkout")
+    assert (tmp_path / "checkout" / "sub" / "plot.html").read_text() == "<bibliography/>"
+
+
+def test_concurrent_store(tmp_path):
+    """Meerdere writers van dezelfde entry laten een complete entry achter"""
+    cache = ArtifactCache(tmp_path / "cache")
+    source = tmp_path / "part.xml"
+    source.write_text("x" * 100000)
+    key = cache.key("latexml_chapter", "abc")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: cache.store(key, {"part.xml": source}), range(16)))
+    assert all(results)
+    assert len(cache.entries()) == 1
+    assert not list(cache.tmp_directory.iterdir())
+    assert cache.fetch(key, {"part.xml": tmp_path / "fetched.xml"})
+    assert (tmp_path / "fetched.xml").read_text() == "x" * 100000
+
+
+def test_evict_least_recently_used(tmp_path):
+    """Boven de maximale grootte gaan de entries die het langst niet gebruikt zijn eruit"""
+    cache = ArtifactCache(tmp_path / "cache", max_size=250)
+    source = tmp_path / "figure.html"
+    source.write_text("x" * 100)
+    keys = [cache.key("make", str(index)) for index in range(3)]
+    now = time.time()
+    for age, key in zip((30, 20, 10), keys):
+        cache.store(key, {"figure.html": source})
+        entry_file = cache.entry_directory(key) / "entry.json"
+        os.utime(entry_file, (now - age, now - age))
+    # de oudste entry is net gebruikt en blijft dus staan
+    assert cache.fetch(keys[0], {"figure.html": tmp_path / "fetched.html"})
+
+    removed = cache.evict()
+    assert removed == [cache.entry_directory(keys[1])]
+    assert not cache.fetch(keys[1], {"figure.html": tmp_path / "fetched.html"})
+    assert cache.fetch(keys[2], {"figure.html": tmp_path / "fetched.html"})
+
+
+def test_store_without_files(tmp_path):
+    """Een entry zonder files kan ook bewaard en opgehaald worden"""
+    cache = ArtifactCache(tmp_path / "cache")
+    key = cache.key("make", "abc")
+    assert cache.store(key, {})
+    assert cache.fetch(key, tmp_path / "checkout")
+
+
+def make_checkouts(tmp_path):
+    """Twee checkouts met een Makefile die een data file buiten de directory leest"""
+    makefile = ("plot.html: plot.py ../data/iris.csv\n\techo run >> ../../make.log\n"
+                "\tcat plot.py ../data/iris.csv > plot.html\n")
+    for checkout in ("main", "branch"):
+        figures = tmp_path / checkout / "figures"
+        figures.mkdir(parents=True)
+        (figures / "Makefile").write_text(makefile)
+        (figures / "plot.py").write_text("print('plot')\n")
+        (tmp_path / checkout / "data").mkdir()
+        (tmp_path / checkout / "data" / "iris.csv").write_text("5.1,3.5\n")
+
+
+def test_makefile_outputs_shared_between_checkouts(tmp_path, monkeypatch):
+    """De tweede checkout krijgt de figuren uit de cache zonder make te draaien"""
+    make_checkouts(tmp_path)
+    makefiles = [dict(directory="figures", inputs=["data/*.csv"], outputs=["figures/*.html"])]
+
+    def build(checkout):
+        monkeypatch.chdir(tmp_path / checkout)
+        suite = LaTeXMLSuite(mode="none", makefile_directories=makefiles, history=False,
+                             artifact_cache=tmp_path / "shared")
+        suite.run()
+        return suite
+
+    for checkout in ("main", "branch"):
+        suite = build(checkout)
+        assert (tmp_path / checkout / "figures" / "plot.html").read_text() == \
+               "print('plot')\n5.1,3.5\n"
+    assert (tmp_path / "make.log").read_text().splitlines() == ["run"]
+    assert suite.build_cache.hits["shared make"] == 1
+
+    # een gewijzigde input buiten de makefile directory geeft een nieuwe figuur
+    (tmp_path / "branch" / "data" / "iris.csv").write_text("4.9,3.0\n")
+    build("branch")
+    assert (tmp_path / "branch" / "figures" / "plot.html").read_text() == \
+           "print('plot')\n4.9,3.0\n"
+    assert (tmp_path / "make.log").read_text().splitlines() == ["run", "run"]
+
+
+def test_makefile_without_declared_outputs_not_shared(tmp_path, monkeypatch):
+    """Zonder opgegeven inputs en outputs draait make in iedere checkout zelf"""
+    make_checkouts(tmp_path)
+    for checkout in ("main", "branch"):
+        monkeypatch.chdir(tmp_path / checkout)
+        suite = LaTeXMLSuite(mode="none", makefile_directories=["figures"], history=False,
+                             artifact_cache=tmp_path / "shared")
+        suite.run()
+    assert (tmp_path / "make.log").read_text().splitlines() == ["run", "run"]
+    assert not list((tmp_path / "shared").rglob("entry.json"))
@@ -0,0 +1,129 @@
+import pytest
+
+from latexmlsuite.batch import BatchPlan, Report, batch_main
+from latexmlsuite.main_suite import main
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+MAKEFILE = """all: highcharts/plot.html
+
+highcharts/plot.html: plot.py
+\techo make >> {log}
+\tmkdir -p highcharts
+\tcp plot.py highcharts/plot.html
+"""
+
+SETTINGS = """general:
+  latex_main: main.tex
+makefiles:
+  - "../gedeeld/figures"
+  - "figures"
+prescripts:
+  - "../gedeeld/prepare"
+cache:
+  output_directory: out
+"""
+
+
+def create_reports(root, n_reports=2):
+    """Rapporten die een figuren directory en een prescript delen"""
+    shared = root / "gedeeld"
+    for directory in [shared] + [root / f"rapport_{index}" for index in range(n_reports)]:
+        figures = directory / "figures"
+        figures.mkdir(parents=True)
+        (figures / "Makefile").write_text(MAKEFILE.format(log=root / "make.log"))
+        (figures / "plot.py").write_text(f"print('{directory.name}')\n")
+        if directory != shared:
+            (directory / "rapport_settings.yml").write_text(SETTINGS)
+    (shared / "prepare.sh").write_text(f"echo prepare >> {root / 'scripts.log'}\n")
+
+
+def test_plan_deduplicates_shared_stages(tmp_path):
+    create_reports(tmp_path, n_reports=3)
+    reports = [Report(tmp_path / f"rapport_{index}" / "rapport_settings.yml")
+               for index in range(3)]
+    plan = BatchPlan(reports, mode="all")
+    assert len(plan.make_jobs) == 4
+    shared = [job for job in plan.make_jobs if "gedeeld" in job.name]
+    assert len(shared) == 1 and shared[0].reports == reports
+    assert len(plan.pre_script_jobs) == 1
+    assert len(plan.document_jobs) == 3
+    assert "--sync_makefiles" in plan.document_jobs[0].command
+
+
+def test_batch_run(tmp_path, monkeypatch):
+    """De gedeelde directory draait één keer en de figuren komen in de ccn van ieder rapport"""
+    create_reports(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    reports = batch_main(["rapport_*/rapport_settings.yml", "--mode", "none", "-j", "4",
+                          "--no_colors"])
+    assert [report.name for report in reports] == ["rapport_0/rapport_settings.yml",
+                                                   "rapport_1/rapport_settings.yml"]
+    assert all(report.success for report in reports)
+    assert (tmp_path / "make.log").read_text().splitlines() == ["make"] * 3
+    assert (tmp_path / "scripts.log").read_text().splitlines() == ["prepare"]
+    for index in range(2):
+        plot = tmp_path / f"rapport_{index}" / "ccn" / "highcharts" / "plot.html"
+        # beide directories maken een plot.html; die van het rapport zelf is de laatste
+        assert plot.read_text() == f"print('rapport_{index}')\n"
+    assert (tmp_path / "batch_logs").is_dir()
+
+
+def test_batch_failure_exit_status(tmp_path, monkeypatch):
+    create_reports(tmp_path, n_reports=1)
+    (tmp_path / "gedeeld" / "figures" / "Makefile").write_text("all:\n\texit 2\n")
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(SystemExit) as err:
+        main(["batch", "rapport_0/rapport_settings.yml", "--mode", "none", "-q"])
+    assert err.value.code == 1
+
+
+def create_shared_prescript(root, settings):
+    """Twee rapporten die een langzaam prescript delen; rapport_1 heeft ook een eigen script"""
+    create_reports(root)
+    log = root / "scripts.log"
+    (root / "gedeeld" / "prepare.sh").write_text(f"sleep 0.5\necho prepare >> {log}\n")
+    (root / "rapport_1" / "data.csv").write_text("1,2\n")
+    (root / "rapport_1" / "tabel.sh").write_text(f"echo tabel >> {log}\n")
+    (root / "rapport_1" / "rapport_settings.yml").write_text(settings)
+
+
+def test_shared_prescript_runs_before_later_scripts(tmp_path, monkeypatch):
+    """Het eigen script van rapport_1 wacht op het gedeelde script, ook met meerdere workers"""
+    create_shared_prescript(tmp_path, SETTINGS.replace("cache:", '  - "tabel"\ncache:'))
+    monkeypatch.chdir(tmp_path)
+    reports = batch_main(["rapport_*/rapport_settings.yml", "--mode", "none", "-j", "4", "-q",
+                          "--no_colors"])
+    assert all(report.success for report in reports)
+    assert (tmp_path / "scripts.log").read_text().splitlines() == ["prepare", "tabel"]
+
+
+def test_mapped_prescripts_in_batch(tmp_path, monkeypatch):
+    """Een script met inputs en after wacht op het gedeelde script en wordt overgeslagen"""
+    mapped = SETTINGS.replace("cache:", '  - script: "tabel"\n    inputs: ["data.csv"]\n'
+                                        '    after: ["../gedeeld/prepare"]\ncache:')
+    create_shared_prescript(tmp_path, mapped)
+    monkeypatch.chdir(tmp_path)
+    arguments = ["rapport_*/rapport_settings.yml", "--mode", "none", "-j", "4", "-q",
+                 "--no_colors"]
+    batch_main(arguments)
+    assert (tmp_path / "scripts.log").read_text().splitlines() == ["prepare", "tabel"]
+    reports = batch_main(arguments)
+    assert all(report.success for report in reports)
+    # het gedeelde script heeft geen inputs en draait dus opnieuw, tabel is up to date
+    assert (tmp_path / "scripts.log").read_text().splitlines() == ["prepare", "tabel",
+                                                                   "prepare"]
+
+
+def test_conflicting_script_order(tmp_path):
+    create_reports(tmp_path)
+    for index, scripts in enumerate([("a", "b"), ("b", "a")]):
+        (tmp_path / f"rapport_{index}" / "rapport_settings.yml").write_text(
+            SETTINGS.replace('  - "../gedeeld/prepare"\n', "".join(
+                f'  - "../gedeeld/{name}"\n' for name in scripts)))
+    reports = [Report(tmp_path / f"rapport_{index}" / "rapport_settings.yml")
+               for index in range(2)]
+    with pytest.raises(ValueError):
+        BatchPlan(reports, test=True)
@@ -0,0 +1,49 @@
+from latexmlsuite.benchmark import idle_time, run_benchmark
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+
+def test_idle_time():
+    """Overlappende commando's worden maar één keer van de stage afgetrokken"""
+    stage = dict(ts=0, dur=1000000)
+    commands = [dict(ts=100000, dur=300000), dict(ts=200000, dur=300000),
+                dict(ts=900000, dur=500000)]
+    assert idle_time(stage, commands) == 0.5
+
+
+def test_run_benchmark(tmp_path):
+    """Een koude en een warme build van een synthetisch rapport met de stub tools"""
+    results = run_benchmark(tmp_path, n_chapters=3, n_makefile_directories=2, n_figures=2,
+                            output_lines=5, jobs=2)
+    cold, warm = results
+    # index pagina plus een pagina per hoofdstuk
+    assert cold["pages"] == warm["pages"] == 4
+    assert (tmp_path / "rapport" / "ccn" / "highcharts" / "fig_02_2.html").exists()
+    assert warm["cache_misses"] == 0
+    stages = {row["name"]: row for row in cold["stages"]}
+    assert stages["launch_makefile"]["count"] == 2
+    assert all(row["overhead"] <= row["wall_time"] for row in cold["stages"])
+
+
+def test_run_benchmark_single_pass(tmp_path):
+    """In één latexmlc proces ontstaan dezelfde pagina's, zonder main.xml"""
+    results = run_benchmark(tmp_path, n_chapters=3, n_makefile_directories=1, n_figures=1,
+                            single_pass=True)
+    assert [result["pages"] for result in results] == [4, 4]
+    assert not (tmp_path / "rapport" / "out_html" / "main.xml").exists()
+    assert "launch_latexml" not in {row["name"] for row in results[0]["stages"]}
+
+
+def test_run_benchmark_parallel_latexmlpost(tmp_path):
+    """Een latexmlpost proces per hoofdstuk geeft dezelfde pagina's als één proces"""
+    results = run_benchmark(tmp_path, n_chapters=3, n_makefile_directories=1, n_figures=1,
+                            jobs=3, parallel_latexmlpost=True)
+    assert [result["pages"] for result in results] == [4, 4]
+    html_dir = tmp_path / "rapport" / "ccn" / "html"
+    assert (html_dir / "main_Ch2.html").read_text().startswith("<html><!-- clean --><title>")
+    assert not list(html_dir.glob("*shard*"))
+    assert (tmp_path / "rapport" / "out_html" / "shards" / "Ch3.xml").exists()
+    stages = {row["name"] for row in results[0]["stages"]}
+    assert "launch_latexml_post_sharded" in stages
@@ -0,0 +1,83 @@
+import os
+
+from latexmlsuite.build_cache import BuildCache
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+
+def test_build_cache_uses_content(tmp_path):
+    """Een touch geeft een hit, een gewijzigde inhoud een miss"""
+    source = tmp_path / "main.tex"
+    target = tmp_path / "main.xml"
+    source.write_text("\\documentclass{cbsdocs}")
+    target.write_text("<document/>")
+
+    cache = BuildCache(tmp_path / "cache")
+    fingerprint = cache.fingerprint(inputs=[source], settings=["latexml"])
+    assert not cache.is_up_to_date("latexml", fingerprint, outputs=[target])
+    cache.update("latexml", fingerprint)
+
+    # een nieuwe instantie leest de opgeslagen state
+    cache = BuildCache(tmp_path / "cache")
+    os.utime(source, ns=(0, 0))
+    fingerprint = cache.fingerprint(inputs=[source], settings=["latexml"])
+    assert cache.is_up_to_date("latexml", fingerprint, outputs=[target])
+
+    source.write_text("\\documentclass{article}")
+    fingerprint = cache.fingerprint(inputs=[source], settings=["latexml"])
+    assert not cache.is_up_to_date("latexml", fingerprint, outputs=[target])
+    assert cache.hits["latexml"] == 1
+    assert cache.misses["latexml"] == 1
+
+
+def test_file_hash_same_size_and_mtime(tmp_path):
+    """Een nieuwe inhoud met dezelfde grootte en modificatie tijd wordt toch opnieuw gehashed"""
+    source = tmp_path / "main.tex"
+    source.write_text("versie 1")
+    os.utime(source, ns=(1000, 1000))
+    cache = BuildCache(tmp_path / "cache")
+    first_hash = cache.file_hash(source)
+    # de change tijd van de file ligt nog binnen de resolutie, dus de hash is niet bewaard
+    assert source.as_posix() not in cache._file_hashes
+
+    source.write_text("versie 2")
+    os.utime(source, ns=(1000, 1000))
+    assert cache.file_hash(source) != first_hash
+
+    # een oude entry met dezelfde grootte en tijd, maar een andere change tijd telt niet
+    cache._file_hashes[source.as_posix()] = [source.stat().st_size, 1000, source.stat().st_ino,
+                                             0, first_hash]
+    assert cache.file_hash(source) != first_hash
+
+
+def test_build_cache_missing_output(tmp_path):
+    """Als een output ontbreekt moet de stage opnieuw draaien"""
+    source = tmp_path / "references.bib"
+    source.write_text("@book{a}")
+    cache = BuildCache(tmp_path / "cache")
+    fingerprint = cache.fingerprint(inputs=[source])
+    cache.update("latexml_bibtex", fingerprint)
+    assert cache.is_up_to_date("latexml_bibtex", fingerprint)
+    assert not cache.is_up_to_date("latexml_bibtex", fingerprint,
+                                   outputs=[tmp_path / "references.bib.xml"])
+
+
+def test_build_cache_triggers(tmp_path):
+    """De input die veranderd is wordt als reden van de rebuild bewaard"""
+    chapter_1 = tmp_path / "h1.tex"
+    chapter_2 = tmp_path / "h2.tex"
+    chapter_1.write_text("een")
+    chapter_2.write_text("twee")
+    cache = BuildCache(tmp_path / "cache")
+    fingerprint = cache.fingerprint(inputs=[chapter_1, chapter_2])
+    assert not cache.is_up_to_date("latexml", fingerprint)
+    assert cache.triggers["latexml"] == {"(no previous run)"}
+    cache.update("latexml", fingerprint)
+
+    cache = BuildCache(tmp_path / "cache")
+    chapter_2.write_text("twee, aangepast")
+    fingerprint = cache.fingerprint(inputs=[chapter_1, chapter_2])
+    assert not cache.is_up_to_date("latexml", fingerprint)
+    assert cache.triggers["latexml"] == {chapter_2.as_posix()}
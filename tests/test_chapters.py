@@ -0,0 +1,188 @@
+import os
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from latexmlsuite.benchmark import create_stub_toolchain, generate_report
+from latexmlsuite.chapters import (DOCUMENT_FRAGMENT, XML_ID, assemble_document, count_chapters,
+                                   fragment_hashes, include_name, restrict_to_chapters,
+                                   section_names, shard_document, split_document)
+from latexmlsuite.main_suite import LaTeXMLSuite, copy_main_for_latexml
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+MAIN_TEX = r"""\documentclass[dutch]{cbsdocs}
+\begin{document}
+    \beforepreface
+    % \input{sections/voorwoord}
+    \afterpreface
+    \input{sections/01_introductie}
+    \include{sections/02_latex_voorbeelden}
+    \printbibliography
+\end{document}
+"""
+
+
+def test_split_document():
+    """Iedere include wordt een apart deel, de tekst ertussen ook"""
+    preamble, parts, postamble = split_document(MAIN_TEX)
+    assert preamble.strip().endswith(r"\begin{document}")
+    assert postamble.startswith(r"\end{document}")
+    assert [part.text.strip() for part in parts][1:] == [
+        r"\input{sections/01_introductie}",
+        r"\include{sections/02_latex_voorbeelden}",
+        r"\printbibliography",
+    ]
+    parts[2].chapters_before = 3
+    assert r"\setcounter{chapter}{3}" in parts[2].fragment()
+    assert count_chapters("\\chapter{Een}\n\\chapter*{Geen}\n% \\chapter{Weg}\n") == 1
+
+
+def test_assemble_document(tmp_path):
+    """De frontmatter komt alleen uit het eerste deel en de processing instructions blijven"""
+    part_xml = """<?xml version="1.0" encoding="UTF-8"?>
+<?latexml class="cbsdocs"?>
+<document xmlns="http://dlmf.nist.gov/LaTeXML">
+<title>Titel</title>
+<chapter xml:id="{id}"><title>{id}</title></chapter>
+</document>
+"""
+    part_files = []
+    for chapter_id in ("Ch1", "Ch2"):
+        part_file = tmp_path / f"{chapter_id}.xml"
+        part_file.write_text(part_xml.replace("{id}", chapter_id))
+        part_files.append(part_file)
+
+    xml_file = tmp_path / "main.xml"
+    assemble_document(part_files, xml_file)
+    content = xml_file.read_text()
+    assert content.count("<title>Titel</title>") == 1
+    assert '<?latexml class="cbsdocs"?>' in content
+    assert content.index('xml:id="Ch1"') < content.index('xml:id="Ch2"')
+
+
+def test_restrict_to_chapters():
+    """De \\input regels worden \\include regels met een \\includeonly voor de gekozen delen"""
+    tex = ("\\documentclass{cbsdocs}\n\\begin{document}\n    \\input{sections/01_introductie}\n"
+           "\\input{sections/02_voorbeelden.tex} % commentaar\n\\end{document}\n")
+    new_tex, names, selected = restrict_to_chapters(tex, ["02"])
+    assert names == ["sections/01_introductie", "sections/02_voorbeelden"]
+    assert selected == ["sections/02_voorbeelden"]
+    assert "\\includeonly{sections/02_voorbeelden}\n\\begin{document}" in new_tex
+    assert "    \\include{sections/01_introductie}\n\\include{sections/02_voorbeelden}\n" in new_tex
+    assert restrict_to_chapters(tex, ["bestaat_niet"])[0] == tex
+
+
+def test_include_name_and_section_names():
+    """De naam van een ingelezen hoofdstuk en de titels en labels van zijn secties"""
+    assert include_name("    \\input{sections/01_introductie.tex} % commentaar") == \
+        "sections/01_introductie"
+    assert include_name("\\include{sections/02_voorbeelden}\n") == "sections/02_voorbeelden"
+    assert include_name("\\afterpreface\n") is None
+    tex = "\\chapter{Voorbeelden}\n\\section*{Tabellen}\\label{sec:tabellen}\n% \\section{Oud}\n"
+    assert section_names(tex) == ["Voorbeelden", "Tabellen", "sec:tabellen"]
+    _, parts, _ = split_document(MAIN_TEX)
+    parts[0].chapters_before = 2
+    assert parts[0].page_names(2) == ["Ch3", "Ch4"]
+    parts[0].after_appendix = True
+    parts[0].chapters_before = 0
+    assert parts[0].page_names(1) == ["A1"]
+
+
+def test_shard_document(tmp_path):
+    """Iedere shard heeft de frontmatter en één hoofdstuk; de rest komt in de document shard"""
+    xml_file = tmp_path / "main.xml"
+    xml_file.write_text('<?xml version="1.0" encoding="UTF-8"?>\n<?latexml class="cbsdocs"?>\n'
+                        '<document xmlns="http://dlmf.nist.gov/LaTeXML"><title>Titel</title>'
+                        '<chapter xml:id="Ch1"><p>een</p></chapter>'
+                        '<chapter xml:id="Ch2"><p>twee</p></chapter>'
+                        '<bibliography xml:id="bib"/></document>\n')
+    shards = dict(shard_document(xml_file, tmp_path / "shards"))
+    assert sorted(shards) == ["Ch1", "Ch2", "document"]
+    chapter = shards["Ch2"].read_text()
+    assert '<?latexml class="cbsdocs"?>' in chapter
+    assert "<title>Titel</title>" in chapter and "twee" in chapter and "een" not in chapter
+    assert "bibliography" in shards["document"].read_text()
+    assert "Ch1" not in shards["document"].read_text()
+
+    hashes = fragment_hashes(xml_file)
+    xml_file.write_text(xml_file.read_text().replace("twee", "drie"))
+    changed = fragment_hashes(xml_file)
+    assert [name for name in hashes if hashes[name] != changed[name]] == ["Ch2"]
+
+
+def test_latexml_per_chapter(tmp_path, monkeypatch, capsys):
+    """Alleen een gewijzigd hoofdstuk wordt opnieuw geconverteerd en alles wordt samengevoegd"""
+    generate_report(tmp_path, n_chapters=3, n_makefile_directories=0)
+    bin_dir = create_stub_toolchain(tmp_path / "bin")
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    monkeypatch.chdir(tmp_path)
+    main_file = Path("out_html") / "main.tex"
+    xml_file = main_file.with_suffix(".xml")
+    (tmp_path / "out_html").mkdir()
+    copy_main_for_latexml(tex_input_file=Path("main.tex"), tex_output_file=main_file)
+
+    def convert(test=False):
+        suite = LaTeXMLSuite(main_file_name="main.tex", latexml_per_chapter=True, jobs=2,
+                             test=test, history=False)
+        assert suite.launch_latexml_per_chapter(main_file, xml_file)
+        return suite, capsys.readouterr().out
+
+    # een droge run laat alleen de commando's zien
+    suite, output = convert(test=True)
+    assert "Converting 4 of 4 document parts" in output
+    assert not (tmp_path / "out_html" / "chapters").exists()
+    assert not xml_file.exists()
+
+    suite, output = convert()
+    assert "Converting 4 of 4 document parts" in output
+    assert sorted(fragment_hashes(xml_file)) == ["Ch1", "Ch2", "Ch3", DOCUMENT_FRAGMENT]
+
+    section = tmp_path / "sections" / "02_hoofdstuk.tex"
+    section.write_text(section.read_text() + "Een nieuwe alinea.\n")
+    suite, output = convert()
+    assert "Converting 1 of 4 document parts" in output
+    assert suite.build_cache.hits["latexml_chapter"] == 3
+    assert "Hoofdstuk 2" in xml_file.read_text()
+    assert sorted(fragment_hashes(xml_file)) == ["Ch1", "Ch2", "Ch3", DOCUMENT_FRAGMENT]
+
+
+def test_per_chapter_numbering(tmp_path, monkeypatch):
+    """Een hoofdstuk dat over twee delen loopt, houdt unieke ids en doorlopende nummers"""
+    bin_dir = create_stub_toolchain(tmp_path / "bin")
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    monkeypatch.chdir(tmp_path)
+    figure = "\\begin{figure}\\caption{Figuur}\\end{figure}\n"
+    sections = dict(een="\\chapter{Een}\n" + 2 * figure,
+                    twee="\\chapter{Twee}\n" + figure,
+                    twee_vervolg="\\section{Vervolg}\n" + 2 * figure,
+                    drie="\\chapter{Drie}\n" + figure)
+    (tmp_path / "sections").mkdir()
+    for name, text in sections.items():
+        (tmp_path / "sections" / f"{name}.tex").write_text(text)
+    (tmp_path / "main.tex").write_text(
+        "\\documentclass{cbsdocs}\n\\begin{document}\n"
+        + "".join(f"\\input{{sections/{name}}}\n" for name in sections)
+        + "\\printbibliography\n\\end{document}\n")
+    main_file = Path("out_html") / "main.tex"
+    xml_file = main_file.with_suffix(".xml")
+    (tmp_path / "out_html").mkdir()
+    copy_main_for_latexml(tex_input_file=Path("main.tex"), tex_output_file=main_file)
+    suite = LaTeXMLSuite(main_file_name="main.tex", latexml_per_chapter=True, history=False)
+    assert suite.launch_latexml_per_chapter(main_file, xml_file)
+
+    parts_dir = tmp_path / "out_html" / "chapters"
+    assert (parts_dir / "part_002.tex").read_text() == (
+        "\\setcounter{chapter}{2}\n\\setcounter{figure}{1}\n\\input{sections/twee_vervolg}")
+    assert "figure" not in (parts_dir / "part_003.tex").read_text()
+    document = ET.parse(xml_file).getroot()
+    ids = [element.get(XML_ID) for element in document.iter() if element.get(XML_ID)]
+    assert len(ids) == len(set(ids))
+    namespace = "{http://dlmf.nist.gov/LaTeXML}"
+    assert [tag.text for tag in document.iter(namespace + "tag")] == [
+        "1.1", "1.2", "2.1", "2.2", "2.3", "3.1"]
+    # het vervolg van hoofdstuk 2 staat in hoofdstuk 2, de bibliografie naast de hoofdstukken
+    chapters = document.findall(namespace + "chapter")
+    assert [len(chapter.findall(namespace + "figure")) for chapter in chapters] == [2, 3, 1]
+    assert document[-1].tag == namespace + "bibliography"
@@ -0,0 +1,45 @@
+from latexmlsuite.cleanup import remove_files
+from latexmlsuite.main_suite import LaTeXMLSuite
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+
+def test_remove_files(tmp_path):
+    """Alleen files die aan een patroon voldoen worden verwijderd, behalve de keep files"""
+    for name in ("main.aux", "main.log", "main.tex", "keep.log"):
+        (tmp_path / name).write_text(name)
+    removed = remove_files({tmp_path: ["*.aux", "*.log"]}, keep={tmp_path / "keep.log"})
+    assert sorted(p.name for p in removed) == ["main.aux", "main.log"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["keep.log", "main.tex"]
+
+
+def test_remove_files_dry_run(tmp_path, capsys):
+    """Met test worden de files alleen getoond"""
+    (tmp_path / "main.css").write_text("")
+    remove_files({tmp_path: ["*.css"]}, test=True)
+    assert (tmp_path / "main.css").exists()
+    assert f"rm {(tmp_path / 'main.css').as_posix()}" in capsys.readouterr().out
+
+
+def test_clean_log_removes_log_files(tmp_path, monkeypatch):
+    """clean_log ruimt de log files op en niet de css files"""
+    monkeypatch.chdir(tmp_path)
+    for name in ("main.log", "main.aux", "style.css"):
+        (tmp_path / name).write_text("")
+    suite = LaTeXMLSuite(mode="clean")
+    suite.clean_log()
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_file()) == ["style.css"]
+
+
+def test_clean_log_keeps_report_files(tmp_path, monkeypatch):
+    """In de directory van het rapport blijven files als een eigen .bbl staan"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "out").mkdir()
+    for name in ("main.log", "main.bbl", "main.toc", "out/main.bbl", "out/main.toc"):
+        (tmp_path / name).write_text("")
+    suite = LaTeXMLSuite(mode="clean")
+    suite.clean_log()
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_file()) == ["main.bbl", "main.toc"]
+    assert not list((tmp_path / "out").iterdir())
@@ -0,0 +1,62 @@
+from latexmlsuite.build_cache import BuildCache
+from latexmlsuite.history import HISTORY_FILE_NAME, BuildHistory
+from latexmlsuite.main_suite import LaTeXMLSuite, main
+from latexmlsuite.tracing import Tracer
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+
+def test_record_run(tmp_path):
+    """Stages, commando's en triggers van iedere run komen in de database"""
+    history = BuildHistory(tmp_path / HISTORY_FILE_NAME)
+    for run in range(3):
+        cache = BuildCache(tmp_path / "cache")
+        tracer = Tracer(build_cache=cache)
+        with tracer.span("launch_makefiles"):
+            with tracer.span("make figures/iris", category="command") as info:
+                info["exit_status"] = 0
+        if run > 0:
+            cache.add_trigger("make", "figures/iris")
+        history.record_run(tracer, cache, mode="all", wall_time=1.0 + run)
+
+    assert [row[3] for row in history.trend(n_runs=2)] == [2.0, 3.0]
+    slowest = {(category, name): count for category, name, count, *_ in history.slowest()}
+    assert slowest[("command", "make figures/iris")] == 3
+    assert history.triggers() == [("figures/iris", 2, "make")]
+
+
+def test_stats_command(tmp_path, monkeypatch, capsys):
+    """latex2ccn stats leest de database in de cache directory van het rapport"""
+    monkeypatch.chdir(tmp_path)
+    makefile_dir = tmp_path / "figures"
+    makefile_dir.mkdir()
+    (makefile_dir / "Makefile").write_text("all:\n\t@echo plot\n")
+    suite = LaTeXMLSuite(mode="none", makefile_directories=["figures"])
+    suite.run()
+    suite.history.close()
+    capsys.readouterr()
+
+    main(["stats", "--settings_filename", "geen_settings.yml"])
+    output = capsys.readouterr().out
+    assert "make figures" in output
+    assert "Trend of the last 10 runs" in output
+
+
+def test_stats_command_draft(tmp_path, monkeypatch, capsys):
+    """Met --draft leest latex2ccn stats de database in de cache directory van de draft"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "main.tex").write_text("\\documentclass{cbsdocs}\n")
+    suite = LaTeXMLSuite(mode="draft", main_file_name="main.tex")
+    monkeypatch.setattr(suite, "launch_draft", lambda: None)
+    suite.run()
+    suite.history.close()
+    capsys.readouterr()
+
+    main(["stats", "--settings_filename", "geen_settings.yml"])
+    assert "No build history found" in capsys.readouterr().out
+    main(["stats", "--settings_filename", "geen_settings.yml", "--draft"])
+    output = capsys.readouterr().out
+    assert "Trend of the last 10 runs" in output
+    assert "draft" in output
@@ -0,0 +1,61 @@
+import os
+import stat
+import sys
+from pathlib import Path
+
+from latexmlsuite.html_cleaner import clean_html_files
+from latexmlsuite.main_suite import LaTeXMLSuite
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+STUB_CLEANER = f"""#!{sys.executable}
+import sys
+with open(sys.argv[1]) as stream:
+    content = stream.read()
+with open(sys.argv[1], "w") as stream:
+    stream.write(content.replace("dirty", "clean"))
+with open(sys.argv[1] + ".count", "a") as stream:
+    stream.write("x")
+"""
+
+
+def add_stub_cleaner(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    cleaner = bin_dir / "htmlcleaner"
+    cleaner.write_text(STUB_CLEANER)
+    cleaner.chmod(cleaner.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+
+
+def test_clean_html_files(tmp_path, monkeypatch):
+    """Alle files worden schoongemaakt en krijgen een tijd"""
+    add_stub_cleaner(tmp_path, monkeypatch)
+    html_files = []
+    for name in ("main_Ch1.html", "main_Ch2.html"):
+        html_file = tmp_path / name
+        html_file.write_text("<p>dirty</p>")
+        html_files.append(html_file)
+    results = clean_html_files(html_files, in_process=False)
+    assert [Path(result[0]) for result in results] == html_files
+    assert all(result[2] for result in results)
+    for html_file in html_files:
+        assert html_file.read_text() == "<p>clean</p>"
+
+
+def test_unchanged_pages_are_not_cleaned_again(tmp_path, monkeypatch):
+    """Een pagina die gelijk is aan die van de vorige run komt uit de cache"""
+    add_stub_cleaner(tmp_path, monkeypatch)
+    monkeypatch.setattr("latexmlsuite.html_cleaner.find_cleaner_entry_point", lambda: None)
+    suite = LaTeXMLSuite(ccn_output_directory=tmp_path / "ccn",
+                         output_directory_html=tmp_path / "out_html")
+    page = tmp_path / "main_Ch1.html"
+    for _ in range(2):
+        # latexmlpost schrijft iedere run weer de ruwe pagina
+        page.write_text("<p>dirty</p>")
+        suite.clean_html([page])
+        assert page.read_text() == "<p>clean</p>"
+    assert (tmp_path / "main_Ch1.html.count").read_text() == "x"
+    assert suite.build_cache.hits["htmlcleaner"] == 1
@@ -0,0 +1,114 @@
+import os
+import socket
+import stat
+import sys
+from pathlib import Path
+
+from latexmlsuite.latexml_server import LaTeXMLServer
+from latexmlsuite.main_suite import LaTeXMLSuite
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+STUB_LATEXML = f"""#!{sys.executable}
+import sys
+dest = [a.split("=", 1)[1] for a in sys.argv[1:] if a.startswith("--dest=")][0]
+with open(dest, "w") as stream:
+    stream.write(" ".join(sys.argv))
+"""
+
+STUB_FAILING_CLIENT = f"""#!{sys.executable}
+import sys
+print("connection refused")
+sys.exit(1)
+"""
+
+STUB_LATEXMLC = f"""#!{sys.executable}
+import sys
+if any(a.startswith("--port=") for a in sys.argv[1:]):
+    print("connection refused")
+    sys.exit(1)
+dest = [a.split("=", 1)[1] for a in sys.argv[1:] if a.startswith("--dest=")][0]
+with open(dest, "w") as stream:
+    stream.write(" ".join(sys.argv))
+"""
+
+
+def add_stub(bin_dir, name, content):
+    bin_dir.mkdir(exist_ok=True)
+    stub = bin_dir / name
+    stub.write_text(content)
+    stub.chmod(stub.stat().st_mode | stat.S_IEXEC)
+
+
+def test_client_command(tmp_path, monkeypatch):
+    """Alle paden in een request zijn absoluut, want de server heeft zijn eigen werkdirectory"""
+    monkeypatch.chdir(tmp_path)
+    server = LaTeXMLServer(port=4000)
+    cmd = server.client_command(["--dest=out_html/main.xml", "out_html/main.tex"])
+    assert cmd[:3] == ["latexmlc", "--port=4000", "--expire=600"]
+    assert f"--dest={(tmp_path / 'out_html' / 'main.xml').as_posix()}" in cmd
+    assert (tmp_path / "out_html" / "main.tex").as_posix() in cmd
+    assert "--bibtex" in server.client_command(["--dest=refs.xml", "refs.bib"])
+
+
+def test_server_fallback(tmp_path, monkeypatch):
+    """Als de conversie via de server mislukt, wordt latexml zelf gedraaid"""
+    monkeypatch.chdir(tmp_path)
+    bin_dir = tmp_path / "bin"
+    add_stub(bin_dir, "latexml", STUB_LATEXML)
+    add_stub(bin_dir, "latexmlc", STUB_FAILING_CLIENT)
+    add_stub(bin_dir, "latexmls", STUB_FAILING_CLIENT)
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+
+    # een socket die luistert doet zich voor als een draaiende server
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+        suite = LaTeXMLSuite(latexml_server=True, latexml_server_port=port)
+        assert suite.latexml_server.ensure_running()
+        result = suite.execute_latexml(["latexml", "--dest=main.xml", "main.tex"],
+                                       stage="latexml")
+
+    assert result.returncode == 0
+    assert Path("main.xml").read_text().split()[1:] == ["--dest=main.xml", "main.tex"]
+    assert "connection refused" in (tmp_path / "out" / "logs" / "latexml_server.log").read_text()
+
+
+def test_latexmlc_server_fallback(tmp_path, monkeypatch):
+    """Als latexmlc via de server mislukt, draait latexmlc zelf; mislukt dat ook, dan geen html"""
+    monkeypatch.chdir(tmp_path)
+    bin_dir = tmp_path / "bin"
+    add_stub(bin_dir, "latexmlc", STUB_LATEXMLC)
+    add_stub(bin_dir, "latexmls", STUB_FAILING_CLIENT)
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    (tmp_path / "out_html").mkdir()
+    (tmp_path / "out_html" / "main.tex").write_text("\\documentclass{cbsdocs}\n")
+
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+        suite = LaTeXMLSuite(main_file_name="main.tex", latexml_server=True,
+                             latexml_server_port=port, single_pass=True, history=False)
+        assert suite.launch_latexmlc()
+        assert "--port=" not in (tmp_path / "ccn" / "html" / "main.html").read_text()
+
+        add_stub(bin_dir, "latexmlc", STUB_FAILING_CLIENT)
+        suite = LaTeXMLSuite(main_file_name="main.tex", latexml_server=True,
+                             latexml_server_port=port, single_pass=True, force_html=True,
+                             history=False)
+        assert not suite.launch_latexmlc()
+
+
+def test_server_not_installed(tmp_path, monkeypatch):
+    """Zonder latexmls en latexmlc wordt de server niet gebruikt"""
+    monkeypatch.setenv("PATH", str(tmp_path))
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = LaTeXMLServer(port=port)
+    assert not server.is_running()
+    assert not server.ensure_running()
@@ -1,6 +1,16 @@
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
 import pytest
 
-from latexmlsuite.main_suite import check_make_was_clean, main
+from latexmlsuite.benchmark import create_stub_toolchain
+from latexmlsuite.draft import draft_main_content
+from latexmlsuite.main_suite import (OUTPUT_HEAD_LINES, OUTPUT_TAIL_LINES, CommandResult,
+                                     LaTeXMLSuite, check_make_was_clean, main,
+                                     query_make_up_to_date, run_command)
 
 __author__ = "Eelco van Vliet"
 __copyright__ = "Eelco van Vliet"
@@ -10,4 +20,407 @@ __license__ = "MIT"
 def test_check_make_was_clean():
     """API Tests"""
     clean_example = ["make: Nothing to be done for 'sidn'"]
-    assert check_make_was_clean(clean_example)
\ No newline at end of file
+    assert check_make_was_clean(clean_example)
+
+
+def test_launch_makefiles_parallel(tmp_path, capsys):
+    """Alle makefile directories worden gedraaid zonder de werkdirectory te veranderen"""
+    makefile_directories = []
+    for name in ("figures", "tables"):
+        makefile_dir = tmp_path / name
+        makefile_dir.mkdir()
+        (makefile_dir / "Makefile").write_text(f"all:\n\techo {name} > output.txt\n")
+        makefile_directories.append(makefile_dir)
+
+    cwd = os.getcwd()
+    suite = LaTeXMLSuite(makefile_directories=makefile_directories,
+                         ccn_output_directory=tmp_path / "ccn",
+                         output_directory=tmp_path / "out",
+                         output_directory_html=tmp_path / "out_html",
+                         jobs=2)
+    suite.launch_makefiles()
+
+    assert os.getcwd() == cwd
+    for makefile_dir in makefile_directories:
+        assert (makefile_dir / "output.txt").read_text().strip() == makefile_dir.name
+    # de output van elke directory staat gegroepeerd bij elkaar
+    out = capsys.readouterr().out
+    for makefile_dir in makefile_directories:
+        cd_line = out.index(f"cd {makefile_dir}")
+        assert out.index(f"echo {makefile_dir.name} > output.txt", cd_line) > cd_line
+
+
+def test_query_make_up_to_date(tmp_path):
+    """De exit status van 'make -q' bepaalt of een directory overgeslagen wordt"""
+    (tmp_path / "Makefile").write_text("output.txt:\n\techo done > output.txt\n")
+    assert query_make_up_to_date("make", tmp_path) is False
+    (tmp_path / "output.txt").write_text("done\n")
+    assert query_make_up_to_date("make", tmp_path) is True
+    assert query_make_up_to_date("make", tmp_path / "does_not_exist") is None
+
+
+def test_pdf_and_xml_branches_run_concurrently(tmp_path, monkeypatch):
+    """copy_pdf wacht alleen op de pdf tak, terwijl de xml tak nog bezig is"""
+    xml_started = threading.Event()
+    pdf_copied = threading.Event()
+    calls = []
+
+    def launch_latexmk():
+        # de pdf tak wacht tot de xml tak ook begonnen is, dus ze moeten tegelijk draaien
+        assert xml_started.wait(timeout=5)
+        calls.append("latexmk")
+
+    def launch_xml_branch():
+        xml_started.set()
+        assert pdf_copied.wait(timeout=5)
+        calls.append("latexml")
+
+    def copy_pdf():
+        calls.append("copy_pdf")
+        pdf_copied.set()
+
+    suite = LaTeXMLSuite(ccn_output_directory=tmp_path / "ccn",
+                         output_directory_html=tmp_path / "out_html")
+    monkeypatch.setattr(suite, "launch_latexmk", launch_latexmk)
+    monkeypatch.setattr(suite, "launch_xml_branch", launch_xml_branch)
+    monkeypatch.setattr(suite, "copy_pdf", copy_pdf)
+    suite.launch_pdf_and_xml_branches()
+    assert calls == ["latexmk", "copy_pdf", "latexml"]
+
+
+def test_pdf_error_kept_when_both_branches_fail(tmp_path, monkeypatch, caplog):
+    """Als beide takken mislukken, komt de fout van de pdf tak door en wordt de xml fout gelogd"""
+
+    def launch_latexmk():
+        raise RuntimeError("latexmk failed")
+
+    def launch_xml_branch():
+        raise ValueError("latexml failed")
+
+    suite = LaTeXMLSuite(ccn_output_directory=tmp_path / "ccn",
+                         output_directory_html=tmp_path / "out_html")
+    monkeypatch.setattr(suite, "launch_latexmk", launch_latexmk)
+    monkeypatch.setattr(suite, "launch_xml_branch", launch_xml_branch)
+    with pytest.raises(RuntimeError, match="latexmk failed"):
+        suite.launch_pdf_and_xml_branches()
+    assert "latexml failed" in caplog.text
+
+    monkeypatch.setattr(suite, "launch_latexmk", lambda: None)
+    monkeypatch.setattr(suite, "copy_pdf", lambda: None)
+    with pytest.raises(ValueError, match="latexml failed"):
+        suite.launch_pdf_and_xml_branches()
+
+
+def test_run_command_keeps_head_and_tail(tmp_path):
+    """Alleen het begin en het einde van de output blijft in het geheugen, alles gaat naar de log"""
+    n_lines = OUTPUT_HEAD_LINES + OUTPUT_TAIL_LINES + 100
+    script = f"for i in range({n_lines}): print('regel', i, '\u00e9')"
+    log_file = tmp_path / "logs" / "python.log"
+    result = run_command([sys.executable, "-c", script], log_file=log_file, quiet=True)
+    assert result.returncode == 0
+    assert result.n_lines == n_lines
+    assert result.truncated
+    assert len(result) == OUTPUT_HEAD_LINES + OUTPUT_TAIL_LINES
+    assert result[0] == "regel 0 \u00e9"
+    assert result[-1] == f"regel {n_lines - 1} \u00e9"
+    assert len(log_file.read_text(encoding="utf-8").splitlines()) == n_lines
+
+
+def test_single_xelatex_cycle(tmp_path, monkeypatch):
+    """Zonder latexmk_html draait xelatex alleen voor de pdf en wacht latexml op de eerste pass"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "main.tex").write_text("\\documentclass[twoside]{cbsdocs}\n")
+    pdf_running = threading.Event()
+    latexml_done = threading.Event()
+    calls = []
+
+    def launch_latexmk():
+        pdf_running.set()
+        watch_line = suite.latexmk_pass_watcher()
+        watch_line("Run number 1 of rule 'xelatex'")
+        time.sleep(0.2)
+        calls.append("xelatex")
+        # latexml begint zodra latexmk aan de volgende regel begint
+        watch_line("Run number 1 of rule 'bibtex main'")
+        assert latexml_done.wait(timeout=5)
+        calls.append("latexmk")
+
+    def launch_latexml_bibtex():
+        # de bibliografie wordt geconverteerd terwijl de pdf nog gemaakt wordt
+        assert pdf_running.wait(timeout=5)
+        calls.append("bibtex")
+
+    def launch_latexml():
+        calls.append("latexml")
+        latexml_done.set()
+
+    def launch_latexmk_for_html():
+        raise AssertionError("latexmk should run only once")
+
+    suite = LaTeXMLSuite(main_file_name="main.tex", bibtex_file="references.bib",
+                         history=False)
+    monkeypatch.setattr(suite, "launch_latexmk", launch_latexmk)
+    monkeypatch.setattr(suite, "launch_latexmk_for_html", launch_latexmk_for_html)
+    monkeypatch.setattr(suite, "launch_latexml_bibtex", launch_latexml_bibtex)
+    monkeypatch.setattr(suite, "launch_latexml", launch_latexml)
+    monkeypatch.setattr(suite, "copy_pdf", lambda: None)
+    suite.launch_pdf_and_xml_branches()
+    assert calls == ["bibtex", "xelatex", "latexml", "latexmk"]
+    html_main = (tmp_path / "out_html" / "main.tex").read_text()
+    assert "[twoside,nographs,notables,nohyperrefs]{cbsdocs}" in html_main
+
+
+TWO_PASS_LATEXMK = """#!{python}
+import sys
+import time
+from pathlib import Path
+
+output_directory = sys.argv[1].split("=", 1)[1]
+Path(output_directory).mkdir(parents=True, exist_ok=True)
+print("Run number 1 of rule 'xelatex'", flush=True)
+Path(output_directory, "main.aux").write_text("pass 1")
+Path(output_directory, "main.log").write_text("log")
+print("Run number 2 of rule 'xelatex'", flush=True)
+time.sleep(1)
+Path(output_directory, "main.aux").write_text("pass 2")
+print("Run number 1 of rule 'xdvipdfmx'", flush=True)
+Path(output_directory, "main.pdf").write_text("pdf")
+"""
+
+LATEXML_REPORTS_AUX = """
+if source.suffix == ".tex":
+    seen = [(source.parent / "main.aux").read_text(), str(Path("out", "main.pdf").exists())]
+    Path("latexml_saw.txt").write_text(" ".join(seen))
+"""
+
+
+def test_latexml_reads_first_pass_copy(tmp_path, monkeypatch):
+    """latexml start na de eerste pass en leest de aux van die pass, niet die van de tweede"""
+    bin_dir = create_stub_toolchain(tmp_path / "bin")
+    (bin_dir / "latexmk").write_text(TWO_PASS_LATEXMK.format(python=sys.executable))
+    stub = bin_dir / "latexml"
+    stub.write_text(stub.read_text() + LATEXML_REPORTS_AUX)
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "main.tex").write_text("\\documentclass{cbsdocs}\n\\begin{document}\n"
+                                       "\\chapter{Een}\n\\end{document}\n")
+    suite = LaTeXMLSuite(main_file_name="main.tex", bibtex_file=None,
+                         output_filename="rapport.pdf", history=False)
+    suite.launch_pdf_and_xml_branches()
+    # latexml was klaar voordat de tweede pass de pdf maakte
+    assert (tmp_path / "latexml_saw.txt").read_text() == "pass 1 False"
+    assert (tmp_path / "out" / "main.aux").read_text() == "pass 2"
+    assert (tmp_path / "out_html" / "main.aux").read_text() == "pass 1"
+    assert not (tmp_path / "out_html" / "main.log").exists()
+    assert (tmp_path / "ccn" / "rapport.pdf").read_text() == "pdf"
+
+
+def test_xml_mode_keeps_html_latexmk(tmp_path, monkeypatch, capsys):
+    """Zonder pdf maakt de latexmk run van de html variant de shell-escape files"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "main.tex").write_text("\\documentclass[twoside]{cbsdocs}\n")
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "main.pdf").write_text("pdf")
+    suite = LaTeXMLSuite(mode="xml", test=True, main_file_name="main.tex",
+                         output_filename="rapport.pdf", history=False)
+    suite.run_document_stages()
+    assert "latexmk out_html/main.tex -xelatex -shell-escape" in capsys.readouterr().out
+
+
+def test_failed_bibliography_is_not_updated(tmp_path, monkeypatch):
+    """Alleen een geslaagde conversie van de bibliografie telt als bijgewerkt"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "references.bib").write_text("@book{boek, title={Boek}}\n")
+    suite = LaTeXMLSuite(main_file_name="main.tex", bibtex_file="references.bib",
+                         history=False)
+    monkeypatch.setattr(suite, "execute_latexml",
+                        lambda command, stage: CommandResult(returncode=1))
+    suite.launch_latexml_bibtex()
+    assert not suite.updated_references
+
+    monkeypatch.setattr(suite, "execute_latexml",
+                        lambda command, stage: CommandResult(returncode=0))
+    suite.launch_latexml_bibtex()
+    assert suite.updated_references
+
+
+def test_draft_mode(tmp_path, monkeypatch, capsys):
+    """Een draft komt in zijn eigen directory en laat ccn en de andere outputs met rust"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "main.tex").write_text("\\documentclass[dutch]{cbsdocs}\n\\begin{document}\n"
+                                       "\\input{sections/01_introductie}\n"
+                                       "\\input{sections/02_voorbeelden}\n\\end{document}\n")
+    suite = LaTeXMLSuite(mode="draft", test=True, main_file_name="main.tex",
+                         makefile_directories=["figures"], draft_chapters=["02"])
+    suite.run()
+    assert "xelatex -shell-escape -interaction=nonstopmode -output-directory=out_draft " \
+           "out_draft/main.tex" in capsys.readouterr().out
+    # een droge run schrijft niets
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["main.tex"]
+
+    draft_main, included = draft_main_content(tmp_path / "main.tex", chapters=["02"])
+    assert "[dutch,draft,nographs,notables]{cbsdocs}" in draft_main
+    assert "\\includeonly{sections/02_voorbeelden}" in draft_main
+    assert included == ["sections/01_introductie", "sections/02_voorbeelden"]
+
+
+def test_partial_build(tmp_path, monkeypatch, capsys):
+    """Een gedeeltelijke build werkt alleen de pagina's van de gekozen hoofdstukken bij"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "main.tex").write_text("\\documentclass[dutch]{cbsdocs}\n\\begin{document}\n"
+                                       "\\input{sections/01_introductie}\n"
+                                       "\\input{sections/02_voorbeelden}\n\\appendix\n"
+                                       "\\input{sections/03_bijlage}\n\\end{document}\n")
+    (tmp_path / "sections").mkdir()
+    (tmp_path / "sections" / "01_introductie.tex").write_text(
+        "\\chapter{Introductie}\\label{ch:intro}\n")
+    (tmp_path / "sections" / "02_voorbeelden.tex").write_text(
+        "\\chapter{Voorbeelden}\n\\section{Tabellen}\\label{sec:tabellen}\n")
+    (tmp_path / "sections" / "03_bijlage.tex").write_text("\\chapter{Bijlage}\n")
+    (tmp_path / "out").mkdir()
+    (tmp_path / "out" / "main.aux").write_text("\\relax\n\\newlabel{ch:intro}{{1}{1}}\n"
+                                               "\\newlabel{sec:tabellen}{{2.1}{3}}\n")
+
+    suite = LaTeXMLSuite(test=True, main_file_name="main.tex", only_sections=["tabellen"],
+                         history=False)
+    suite.run_document_stages()
+    assert suite.partial_chapters == ["sections/02_voorbeelden"]
+    assert suite.partial_pages == {"Ch2"}
+    # een droge run schrijft de partial directory niet
+    partial_dir = Path("out") / "partial"
+    assert not (tmp_path / partial_dir).exists()
+    # de labels van de andere hoofdstukken komen uit de volledige build
+    included = ["sections/01_introductie", "sections/02_voorbeelden", "sections/03_bijlage"]
+    aux_files = suite.partial_aux_files(included, selected=["sections/02_voorbeelden"])
+    seeded = aux_files[partial_dir / "sections" / "01_introductie.aux"]
+    assert "ch:intro" in seeded and "sec:tabellen" not in seeded
+    assert aux_files[partial_dir / "sections" / "03_bijlage.aux"] == "\\relax\n"
+    output = capsys.readouterr().out
+    assert "latexmk -output-directory=out/partial out/partial/main.tex" in output
+    assert "cp out_html/latexmlpost/Ch2.html ccn/html/main_Ch2.html" in output
+    assert "main_Ch1.html" not in output and "main_A1.html" not in output
+    assert "is not updated" in output
+
+    suite = LaTeXMLSuite(test=True, main_file_name="main.tex", only_chapters=["bijlage"],
+                         history=False)
+    suite.select_partial_chapters()
+    assert suite.partial_pages == {"A1"}
+
+
+def write_document_xml(xml_file, chapters):
+    xml_file.parent.mkdir(parents=True, exist_ok=True)
+    xml_file.write_text('<document xmlns="http://dlmf.nist.gov/LaTeXML">' + "".join(
+        f'<chapter xml:id="Ch{n}"><p>{text}</p></chapter>'
+        for n, text in enumerate(chapters, start=1)) + "</document>\n")
+
+
+def test_incremental_latexmlpost(tmp_path, monkeypatch):
+    """Alleen de pagina's van gewijzigde hoofdstukken worden opnieuw in ccn gezet"""
+    bin_dir = create_stub_toolchain(tmp_path / "bin")
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    monkeypatch.setattr("latexmlsuite.html_cleaner.find_cleaner_entry_point", lambda: None)
+    monkeypatch.chdir(tmp_path)
+    xml_file = tmp_path / "out_html" / "main.xml"
+
+    def build(chapters):
+        write_document_xml(xml_file, chapters)
+        suite = LaTeXMLSuite(main_file_name="main.tex", history=False)
+        if suite.launch_latexml_post():
+            suite.install_html_pages()
+        return suite
+
+    build(["een", "twee", "drie"])
+    pages = [tmp_path / "ccn" / "html" / f"main_Ch{n}.html" for n in (1, 2, 3)]
+    assert pages[1].read_text() == "<html><!-- clean --><p>twee</p></html>"
+    for page in pages:
+        os.utime(page, (1000, 1000))
+
+    build(["een", "twee bis", "drie"])
+    assert pages[1].read_text() == "<html><!-- clean --><p>twee bis</p></html>"
+    assert pages[1].stat().st_mtime != 1000
+    assert [pages[0].stat().st_mtime, pages[2].stat().st_mtime] == [1000, 1000]
+
+    suite = build(["een", "twee bis", "drie"])
+    assert suite.build_cache.hits["latexmlpost"] == 1
+
+
+def test_failed_latexmlpost_keeps_pages(tmp_path, monkeypatch):
+    """Een mislukte latexmlpost run laat de pagina's van de vorige run in ccn staan"""
+    bin_dir = create_stub_toolchain(tmp_path / "bin")
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    monkeypatch.setattr("latexmlsuite.html_cleaner.find_cleaner_entry_point", lambda: None)
+    monkeypatch.chdir(tmp_path)
+    xml_file = tmp_path / "out_html" / "main.xml"
+    write_document_xml(xml_file, ["een", "twee"])
+    suite = LaTeXMLSuite(mode="html", main_file_name="main.tex", bibtex_file=None)
+    suite.run()
+    pages = sorted(path.name for path in (tmp_path / "ccn" / "html").iterdir())
+    assert pages == ["main.html", "main_Ch1.html", "main_Ch2.html"]
+
+    # deze latexmlpost schrijft een halve pagina en stopt dan met een fout
+    stub = bin_dir / "latexmlpost"
+    stub.write_text(stub.read_text() + 'destination.write_text("<html>half")\nsys.exit(3)\n')
+    write_document_xml(xml_file, ["een", "twee bis"])
+    suite = LaTeXMLSuite(mode="html", main_file_name="main.tex", bibtex_file=None)
+    suite.run()
+    assert suite.failed_stages == ["latexmlpost"]
+    assert sorted(path.name for path in (tmp_path / "ccn" / "html").iterdir()) == pages
+    assert (tmp_path / "ccn" / "html" / "main_Ch2.html").read_text() == \
+           "<html><!-- clean --><p>twee</p></html>"
+    assert (tmp_path / "out_html" / "latexmlpost" / "main.html").read_text() == \
+           "<html>index</html>"
+    assert not (tmp_path / "out_html" / "latexmlpost_new").exists()
+    assert [row[4] for row in suite.history.trend()] == [1, 0]
+
+
+def test_latexmlpost_dry_run(tmp_path, monkeypatch, capsys):
+    """Een droge run laat de pagina's van de vorige latexmlpost run staan"""
+    monkeypatch.chdir(tmp_path)
+    page = tmp_path / "out_html" / "latexmlpost" / "Ch1.html"
+    page.parent.mkdir(parents=True)
+    page.write_text("<html>Ch1</html>")
+    suite = LaTeXMLSuite(test=True, main_file_name="main.tex", history=False)
+    assert suite.launch_latexml_post()
+    assert "latexmlpost --dest=out_html/latexmlpost_new/main.html" in capsys.readouterr().out
+    assert [path.name for path in page.parent.iterdir()] == ["Ch1.html"]
+    assert page.read_text() == "<html>Ch1</html>"
+
+
+def test_sharded_latexmlpost_dry_run(tmp_path, monkeypatch, capsys):
+    """Een droge run laat de scan en de shards zien zonder files te schrijven"""
+    monkeypatch.chdir(tmp_path)
+    write_document_xml(tmp_path / "out_html" / "main.xml", ["een", "twee"])
+    suite = LaTeXMLSuite(test=True, main_file_name="main.tex", history=False, jobs=2,
+                         parallel_latexmlpost=True)
+    suite.xml_refs = tmp_path / "out_html" / "references.bib.xml"
+    assert suite.launch_latexml_post()
+    lines = capsys.readouterr().out.splitlines()
+    assert any("--prescan" in line and "--bibliography" in line for line in lines)
+    shard_lines = [line for line in lines if "--noscan" in line]
+    assert len(shard_lines) == 3
+    assert [line for line in shard_lines if "--bibliography" in line] == \
+           [line for line in shard_lines if "shards/document.xml" in line]
+    assert sorted(path.name for path in (tmp_path / "out_html").iterdir()) == ["main.xml"]
+
+
+def test_sharded_latexmlpost_falls_back(tmp_path, monkeypatch):
+    """Als latexmlpost de pagina's van de shards anders noemt, draait het in één keer"""
+    bin_dir = create_stub_toolchain(tmp_path / "bin")
+    # deze latexmlpost maakt bij --noscan geen pagina per hoofdstuk
+    stub = bin_dir / "latexmlpost"
+    content = stub.read_text()
+    stub.write_text(content.replace('if "--split" in sys.argv[1:]:',
+                                    'if "--split" in sys.argv[1:] and "--noscan" not in '
+                                    'sys.argv[1:]:'))
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    monkeypatch.setattr("latexmlsuite.html_cleaner.find_cleaner_entry_point", lambda: None)
+    monkeypatch.chdir(tmp_path)
+    write_document_xml(tmp_path / "out_html" / "main.xml", ["een", "twee"])
+    suite = LaTeXMLSuite(main_file_name="main.tex", history=False, jobs=2,
+                         parallel_latexmlpost=True)
+    assert suite.launch_latexml_post()
+    suite.install_html_pages()
+    html_dir = tmp_path / "ccn" / "html"
+    assert sorted(path.name for path in html_dir.glob("*.html")) == \
+           ["main.html", "main_Ch1.html", "main_Ch2.html"]
+    assert (tmp_path / "out" / "logs" / "latexmlpost.log").exists()
@@ -0,0 +1,81 @@
+import os
+import sys
+from pathlib import Path
+
+from latexmlsuite.build_cache import BuildCache
+from latexmlsuite.main_suite import run_command
+from latexmlsuite.preamble_format import PreambleFormat, count_passes, extract_preamble
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+# een xelatex die bij -ini de format file maakt en iedere aanroep in een log schrijft
+STUB_XELATEX = """#!{python}
+import sys
+from pathlib import Path
+arguments = sys.argv[1:]
+if arguments == ["--version"]:
+    print("XeTeX 3.141592653-2.6-0.999995 (stub)")
+    sys.exit(0)
+with open({log!r}, "a") as stream:
+    stream.write(" ".join(arguments) + "\\n")
+if "-ini" in arguments:
+    options = dict(a.lstrip("-").split("=", 1) for a in arguments if a.startswith("-") and "=" in a)
+    Path(options["output-directory"], options["jobname"] + ".fmt").write_text("format")
+"""
+
+
+def test_extract_preamble():
+    tex = "\\documentclass{cbsdocs}\n% \\begin{document} in commentaar\n\\usepackage{siunitx}\n" \
+          "\\begin{document}\nTekst\n\\end{document}\n"
+    assert extract_preamble(tex) == "\\documentclass{cbsdocs}\n% \\begin{document} in " \
+                                    "commentaar\n\\usepackage{siunitx}\n"
+    assert extract_preamble("\\input{hoofdstuk}\n") is None
+
+
+def test_count_passes(tmp_path):
+    log_file = tmp_path / "latexmk.log"
+    log_file.write_text("Run number 1 of rule 'xelatex'\nRun number 1 of rule 'biber main'\n"
+                        "Run number 2 of rule 'xelatex'\n")
+    assert count_passes(log_file) == 2
+    assert count_passes(tmp_path / "missing.log") == 0
+
+
+def test_format_rebuilt_when_preamble_changes(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    calls = tmp_path / "calls.log"
+    stub = bin_dir / "xelatex"
+    stub.write_text(STUB_XELATEX.format(python=sys.executable, log=str(calls)))
+    stub.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.chdir(tmp_path)
+
+    (tmp_path / "cbsdocs.cls").write_text("\\ProvidesClass{cbsdocs}\n")
+    main_file = Path("main.tex")
+    main_file.write_text("\\documentclass{cbsdocs}\n\\begin{document}\nTekst\n\\end{document}\n")
+    preamble_format = PreambleFormat(BuildCache(tmp_path / "cache"))
+
+    def execute(command, stage):
+        return run_command(command, output=[])
+
+    def n_dumps():
+        return sum("-ini" in line for line in calls.read_text().splitlines())
+
+    format_file = preamble_format.ensure(main_file, execute=execute)
+    assert format_file.read_text() == "format"
+    assert n_dumps() == 1
+    assert preamble_format.saved_per_pass(main_file) >= 0
+    option = preamble_format.latexmk_options(format_file)[0]
+    assert option.startswith("-xelatex=xelatex -fmt=") and option.endswith(" %O %S")
+
+    # alleen de tekst van het document veranderd: de format blijft geldig
+    main_file.write_text("\\documentclass{cbsdocs}\n\\begin{document}\nMeer\n\\end{document}\n")
+    assert preamble_format.ensure(main_file, execute=execute) == format_file
+    assert n_dumps() == 1
+
+    # een gewijzigde class file geeft een nieuwe format
+    (tmp_path / "cbsdocs.cls").write_text("\\ProvidesClass{cbsdocs}[2]\n")
+    assert preamble_format.ensure(main_file, execute=execute) == format_file
+    assert n_dumps() == 2
@@ -0,0 +1,78 @@
+import pytest
+
+from latexmlsuite.main_suite import LaTeXMLSuite
+from latexmlsuite.scripts import (read_makefiles, read_scripts, script_dependencies,
+                                  topological_order)
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+
+def test_script_dependencies():
+    """Gewone namen zijn een barrière, mappings wachten alleen op hun after"""
+    scripts = read_scripts([
+        "prepare",
+        dict(script="figures/iris/sync_htmls", inputs=["figures/iris/*.html"]),
+        dict(script="figures/iris_via_hc/sync_htmls"),
+        dict(script="publish", after=["figures/iris/sync_htmls"]),
+        "finish",
+    ])
+    dependencies = script_dependencies(scripts)
+    assert dependencies == [set(), {0}, {0}, {0, 1}, {0, 1, 2, 3}]
+    assert topological_order(scripts, dependencies) == [0, 1, 2, 3, 4]
+
+
+def test_script_errors():
+    with pytest.raises(ValueError):
+        read_scripts([dict(script="a", after=["unknown"])])
+    with pytest.raises(ValueError):
+        read_scripts([dict(script="a", depends=["b"])])
+    scripts = read_scripts([dict(script="a", after=["b"]), dict(script="b", after=["a"])])
+    with pytest.raises(ValueError):
+        topological_order(scripts, script_dependencies(scripts))
+
+
+def test_read_makefiles():
+    """Alleen directories met inputs en outputs komen in de artifact cache"""
+    directories, artifacts = read_makefiles([
+        "tables",
+        dict(directory="./figures/iris", inputs=["data/*.csv"], outputs=["figures/iris/*.pdf"]),
+        dict(directory="figures/other", outputs=["figures/other/*.pdf"]),
+    ])
+    assert directories == ["tables", "./figures/iris", "figures/other"]
+    assert artifacts == {"figures/iris": dict(inputs=["data/*.csv"],
+                                              outputs=["figures/iris/*.pdf"])}
+    assert read_makefiles(None) == (None, {})
+    with pytest.raises(ValueError):
+        read_makefiles([dict(directory="figures", scripts=["plot"])])
+
+
+def test_scripts_skipped_when_inputs_unchanged(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ("iris", "iris_via_hc"):
+        directory = tmp_path / "figures" / name
+        directory.mkdir(parents=True)
+        (directory / "plot.html").write_text(name)
+        (directory / "sync_htmls.sh").write_text(f"echo {name} >> {tmp_path / 'runs.log'}\n")
+    (tmp_path / "publish.sh").write_text(f"echo publish >> {tmp_path / 'runs.log'}\n")
+    pre_scripts = [
+        dict(script=f"figures/{name}/sync_htmls", inputs=[f"figures/{name}/*.html"])
+        for name in ("iris", "iris_via_hc")
+    ] + [dict(script="publish", after=["figures/iris/sync_htmls",
+                                        "figures/iris_via_hc/sync_htmls"])]
+
+    def run_scripts():
+        suite = LaTeXMLSuite(mode="none", pre_scripts=pre_scripts, jobs=2, history=False)
+        suite.run()
+        runs = (tmp_path / "runs.log").read_text().splitlines()
+        (tmp_path / "runs.log").unlink()
+        return runs
+
+    runs = run_scripts()
+    assert sorted(runs[:2]) == ["iris", "iris_via_hc"]
+    assert runs[2:] == ["publish"]
+    # zonder inputs draait publish altijd
+    assert run_scripts() == ["publish"]
+    (tmp_path / "figures" / "iris" / "plot.html").write_text("nieuw")
+    assert run_scripts() == ["iris", "publish"]
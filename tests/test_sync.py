@@ -0,0 +1,52 @@
+import os
+
+from latexmlsuite.sync import synchronise_directory
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+
+def test_synchronise_directory(tmp_path):
+    """Alleen gewijzigde files worden gekopieerd en json files worden overgeslagen"""
+    source = tmp_path / "figures" / "highcharts"
+    destination = tmp_path / "ccn" / "highcharts"
+    (source / "hoofdstuk2").mkdir(parents=True)
+    (source / "hoofdstuk2" / "fig.html").write_text("<html>1</html>")
+    (source / "fig.json").write_text("{}")
+
+    result = synchronise_directory(source, destination)
+    assert result.copied == ["hoofdstuk2/fig.html"]
+    assert (destination / "hoofdstuk2" / "fig.html").read_text() == "<html>1</html>"
+    assert not (destination / "fig.json").exists()
+
+    # een aangeraakte maar gelijke file wordt niet opnieuw gekopieerd
+    os.utime(source / "hoofdstuk2" / "fig.html", ns=(0, 0))
+    result = synchronise_directory(source, destination)
+    assert result.copied == []
+    assert result.unchanged == ["hoofdstuk2/fig.html"]
+
+    (source / "hoofdstuk2" / "fig.html").write_text("<html>22</html>")
+    result = synchronise_directory(source, destination)
+    assert result.copied == ["hoofdstuk2/fig.html"]
+
+
+def test_delete_only_files_from_same_source(tmp_path):
+    """Bij delete verdwijnen alleen files die eerder vanuit dezelfde bron kwamen"""
+    destination = tmp_path / "ccn" / "highcharts"
+    iris = tmp_path / "iris"
+    iris_hc = tmp_path / "iris_via_hc"
+    iris.mkdir()
+    iris_hc.mkdir()
+    (iris / "old.html").write_text("old")
+    (iris_hc / "other.html").write_text("other")
+
+    manifest = tmp_path / "iris.json"
+    synchronise_directory(iris, destination, delete=True, manifest_file=manifest)
+    synchronise_directory(iris_hc, destination, delete=True, manifest_file=tmp_path / "hc.json")
+
+    (iris / "old.html").unlink()
+    (iris / "new.html").write_text("new")
+    result = synchronise_directory(iris, destination, delete=True, manifest_file=manifest)
+    assert result.deleted == ["old.html"]
+    assert sorted(p.name for p in destination.iterdir()) == ["new.html", "other.html"]
@@ -0,0 +1,50 @@
+from latexmlsuite.build_cache import BuildCache
+from latexmlsuite.tex_dependencies import DependencyScanner, find_references
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+
+def test_find_references():
+    """Commentaar wordt overgeslagen en lijsten met namen worden gesplitst"""
+    tex = "\n".join([
+        r"\documentclass[dutch,",
+        r"    publicatie]{cbsdocs}",
+        r"\usepackage{siunitx, mystyle}",
+        r"\inputencoding{utf8}",
+        r"% \input{sections/uitgecommentarieerd}",
+        r"\input{sections/01_introductie}",
+        r"\includegraphics[width=0.5\textwidth]{figures/iris/plot}",
+        r"\bibliography{references}",
+    ])
+    assert find_references(tex) == [
+        ("documentclass", "cbsdocs"),
+        ("usepackage", "siunitx"),
+        ("usepackage", "mystyle"),
+        ("input", "sections/01_introductie"),
+        ("includegraphics", "figures/iris/plot"),
+        ("bibliography", "references"),
+    ]
+
+
+def test_dependencies_are_transitive(tmp_path, monkeypatch):
+    """Een file die via een andere file ingelezen wordt hoort ook bij de afhankelijkheden"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "sections").mkdir()
+    (tmp_path / "tables").mkdir()
+    (tmp_path / "out_html").mkdir()
+    (tmp_path / "main.tex").write_text("\\documentclass{cbsdocs}\n\\input{sections/intro}\n")
+    (tmp_path / "out_html" / "main.tex").write_text("\\input{sections/intro}\n")
+    (tmp_path / "sections" / "intro.tex").write_text("\\input{tables/data.tex}\n")
+    (tmp_path / "tables" / "data.tex").write_text("1 & 2\n")
+
+    scanner = DependencyScanner(BuildCache(tmp_path / "cache"))
+    expected = ["out_html/main.tex", "sections/intro.tex", "tables/data.tex"]
+    dependencies = scanner.dependencies("out_html/main.tex")
+    assert [d.as_posix() for d in dependencies] == expected
+
+    # de graph wordt bewaard en bij de volgende run hergebruikt
+    scanner = DependencyScanner(BuildCache(tmp_path / "cache"))
+    assert "sections/intro.tex" in scanner._graph
+    assert [d.as_posix() for d in scanner.dependencies("out_html/main.tex")] == expected
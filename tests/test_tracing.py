@@ -0,0 +1,48 @@
+import json
+
+from latexmlsuite.main_suite import LaTeXMLSuite
+from latexmlsuite.tracing import Tracer
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+
+def test_tracer_summary(tmp_path):
+    """De samenvatting is gesorteerd op de totale wall tijd"""
+    tracer = Tracer()
+    with tracer.span("snel"):
+        pass
+    with tracer.span("langzaam") as info:
+        info["exit_status"] = 0
+        sum(range(100000))
+    assert [row["name"] for row in tracer.summary()] == ["langzaam", "snel"]
+
+    trace_file = tmp_path / "trace.json"
+    tracer.write_chrome_trace(trace_file)
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    assert {event["ph"] for event in events} == {"X"}
+    assert events[1]["args"]["exit_status"] == 0
+
+
+def test_run_writes_trace(tmp_path, capsys):
+    """Iedere stage en ieder commando komt in de trace"""
+    makefile_dir = tmp_path / "figures"
+    makefile_dir.mkdir()
+    (makefile_dir / "Makefile").write_text("all:\n\t@echo plot\n")
+    trace_file = tmp_path / "out" / "trace.json"
+    suite = LaTeXMLSuite(mode="none",
+                         makefile_directories=[makefile_dir],
+                         ccn_output_directory=tmp_path / "ccn",
+                         output_directory=tmp_path / "out",
+                         output_directory_html=tmp_path / "out_html",
+                         trace_file=trace_file)
+    suite.run()
+
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    names = {(event["cat"], event["name"]) for event in events}
+    assert ("stage", "launch_makefiles") in names
+    assert ("command", f"make {makefile_dir}") in names
+    command = [event for event in events if event["name"] == f"make {makefile_dir}"][0]
+    assert command["args"]["exit_status"] == 0
+    assert "launch_makefiles" in capsys.readouterr().out
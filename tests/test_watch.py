@@ -0,0 +1,80 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from latexmlsuite.main_suite import LaTeXMLSuite
+from latexmlsuite.watch import (InotifyWatcher, PollingWatcher, TreeFilter, plan_rebuild,
+                                watch_report)
+
+__author__ = "Eelco van Vliet"
+__copyright__ = "Eelco van Vliet"
+__license__ = "MIT"
+
+
+def test_plan_rebuild(tmp_path, monkeypatch):
+    """Iedere gewijzigde file geeft alleen de stages die ervan afhangen"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "sections").mkdir()
+    (tmp_path / "figures").mkdir()
+    (tmp_path / "main.tex").write_text("\\begin{document}\n\\input{sections/intro}\n")
+    (tmp_path / "sections" / "intro.tex").write_text("\\chapter{Intro}\n")
+    suite = LaTeXMLSuite(main_file_name="main.tex", makefile_directories=["figures"],
+                         pre_scripts=["scripts/prepare"])
+
+    plan = plan_rebuild(suite, {"figures/plot.py"}, settings_filename="rapport_settings.yml")
+    assert plan.makefile_directories == {Path("figures")}
+    assert not plan.document
+
+    plan = plan_rebuild(suite, {"sections/intro.tex"})
+    assert plan.document and not plan.makefile_directories
+
+    assert plan_rebuild(suite, {"scripts/prepare.sh"}).pre_scripts
+    assert plan_rebuild(suite, {"rapport_settings.yml"},
+                        settings_filename="rapport_settings.yml").settings
+    assert not plan_rebuild(suite, {"notes.txt"})
+
+
+def test_polling_watcher(tmp_path):
+    """Nieuwe en gewijzigde files worden gevonden, output directories en editor files niet"""
+    (tmp_path / "out").mkdir()
+    (tmp_path / "main.tex").write_text("a")
+    watcher = PollingWatcher(TreeFilter(tmp_path, ["out"]), interval=0)
+    (tmp_path / "main.tex").write_text("ab")
+    (tmp_path / "new.tex").write_text("b")
+    (tmp_path / "out" / "main.xml").write_text("c")
+    (tmp_path / "main.tex.swp").write_text("d")
+    changes = watcher.read_changes()
+    assert {path.as_posix() for path in changes} == {"main.tex", "new.tex"}
+    assert watcher.read_changes() == set()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is linux only")
+def test_inotify_watcher(tmp_path):
+    """Ook files in nieuwe subdirectories worden gevonden"""
+    watcher = InotifyWatcher(TreeFilter(tmp_path))
+    try:
+        (tmp_path / "sections").mkdir()
+        watcher.read_changes(timeout=1)
+        (tmp_path / "sections" / "intro.tex").write_text("a")
+        changes = set()
+        deadline = time.monotonic() + 5
+        while not changes and time.monotonic() < deadline:
+            changes = watcher.read_changes(timeout=1)
+        assert {path.as_posix() for path in changes} == {"sections/intro.tex"}
+    finally:
+        watcher.close()
+
+
+def test_watch_after_failed_build(tmp_path, monkeypatch, capsys):
+    """Een mislukte eerste build stopt het watchen niet"""
+    monkeypatch.chdir(tmp_path)
+
+    def create_suite():
+        suite = LaTeXMLSuite(mode="none", history=False)
+        monkeypatch.setattr(suite, "run", lambda: 1 / 0)
+        return suite
+
+    watch_report(create_suite, poll=True, max_rebuilds=0)
+    assert "Watching" in capsys.readouterr().out